@@ -0,0 +1,116 @@
+"""Peak memory and time of parsing / importing a synthetic coco dataset.
+
+The synthetic dataset has `--num-images` images with `--num-annotations` annotations in
+total (1M by default). Every method runs in its own process so the peak RSS is its own.
+
+Usage:
+    cd app
+    python -m benchmarks.coco_import --num-annotations 1000000 --num-images 50000
+    python -m benchmarks.coco_import --full  # also run the whole streaming import
+"""
+import argparse
+import io
+import json
+import random
+import resource
+import time
+import zipfile
+from multiprocessing import Pipe, Process, set_start_method
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import PIL.Image
+
+
+def make_dataset(dir: Path, num_images: int, num_annotations: int, num_categories: int = 80):
+    random.seed(0)
+    coco_file = dir / "coco.json"
+    with open(coco_file, "w") as f:
+        # written item by item, so making a big file does not need the memory it measures
+        f.write('{"images": [')
+        for i in range(1, num_images + 1):
+            image = {"id": i, "file_name": f"{i}.jpg", "width": 1, "height": 1}
+            f.write(("," if i > 1 else "") + json.dumps(image))
+        f.write('], "annotations": [')
+        for i in range(1, num_annotations + 1):
+            annotation = {
+                "id": i,
+                "image_id": (i - 1) % num_images + 1,
+                "category_id": random.randint(1, num_categories),
+                "bbox": [random.random() * 100, random.random() * 100, 10.0, 20.0],
+                "area": 200.0,
+                "iscrowd": 0,
+            }
+            f.write(("," if i > 1 else "") + json.dumps(annotation))
+        f.write('], "categories": [')
+        categories = [
+            {"id": i, "name": f"category_{i}", "supercategory": "object"}
+            for i in range(1, num_categories + 1)
+        ]
+        f.write(",".join(json.dumps(category) for category in categories))
+        f.write("]}")
+
+    # the benchmark is about annotations, so every image is the same 1x1 jpeg
+    buffer = io.BytesIO()
+    PIL.Image.new("RGB", (1, 1)).save(buffer, format="JPEG")
+    image_zip_file = dir / "images.zip"
+    with zipfile.ZipFile(image_zip_file, "w", compression=zipfile.ZIP_STORED) as zf:
+        for i in range(1, num_images + 1):
+            zf.writestr(f"{i}.jpg", buffer.getvalue())
+    return coco_file, image_zip_file
+
+
+def parse_json_load(coco_file: Path, image_zip_file: Path, root_dir: Path) -> int:
+    with open(coco_file) as f:
+        return len(json.load(f)["annotations"])
+
+
+def parse_streaming(coco_file: Path, image_zip_file: Path, root_dir: Path) -> int:
+    from src.service.coco_import import iter_json_items
+
+    return sum(1 for _ in iter_json_items(coco_file, ["annotations"]))
+
+
+def import_streaming(coco_file: Path, image_zip_file: Path, root_dir: Path) -> int:
+    from src.service.coco_import import from_coco
+
+    dataset = from_coco("benchmark", "object_detection", [coco_file], image_zip_file, root_dir)
+    return len(dataset.annotation_dict)
+
+
+def _measure(conn, func, *args):
+    start = time.perf_counter()
+    count = func(*args)
+    elapsed = time.perf_counter() - start
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    conn.send((count, elapsed, max_rss_mb))
+    conn.close()
+
+
+def measure(name: str, func, *args):
+    parent_conn, child_conn = Pipe(duplex=False)
+    process = Process(target=_measure, args=(child_conn, func, *args))
+    process.start()
+    child_conn.close()
+    count, elapsed, max_rss_mb = parent_conn.recv()
+    process.join()
+    print(f"{name:>16}: {count:>9} annotations, {elapsed:8.1f} s, peak rss {max_rss_mb:8.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-images", type=int, default=50000)
+    parser.add_argument("--num-annotations", type=int, default=1000000)
+    parser.add_argument("--full", action="store_true")
+    args = parser.parse_args()
+
+    set_start_method("spawn")
+    with TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+        coco_file, image_zip_file = make_dataset(temp_dir, args.num_images, args.num_annotations)
+        print(f"coco file: {coco_file.stat().st_size / 1024**2:.1f} MB")
+
+        measure("json.load", parse_json_load, coco_file, image_zip_file, temp_dir)
+        measure("streaming parse", parse_streaming, coco_file, image_zip_file, temp_dir)
+        if args.full:
+            measure("streaming import", import_streaming, coco_file, image_zip_file, temp_dir)
@@ -0,0 +1,79 @@
+"""Compare end-to-end latency of a short job on a cold spawned process and a warm worker.
+
+Usage:
+    cd app
+    python -m benchmarks.worker_pool --num-jobs 10
+"""
+import argparse
+import statistics
+import time
+from multiprocessing import Pipe, Process, set_start_method
+from multiprocessing.connection import wait
+
+from src.service.worker_pool import WarmWorkerPool
+from src.utils.process import run_target
+
+
+def short_job():
+    # what a short run (evaluate, export) pays before doing any work
+    import torch  # noqa: F401
+    from waffle_hub.hub import Hub  # noqa: F401
+
+
+def run_cold(num_jobs: int) -> list[float]:
+    latencies = []
+    for _ in range(num_jobs):
+        start = time.perf_counter()
+        parent_conn, child_conn = Pipe(duplex=False)
+        process = Process(
+            target=run_target, kwargs={"func": short_job, "kwargs": {}, "conn": child_conn}
+        )
+        process.start()
+        child_conn.close()
+        process.join()
+        parent_conn.close()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_pool_job(pool: WarmWorkerPool):
+    handle = pool.submit(short_job, {})
+    while True:
+        wait([handle.conn])
+        if handle.conn.recv()["type"] == "done":
+            break
+    handle.done = True
+    handle.close()
+
+
+def run_warm(num_jobs: int, max_jobs_per_worker: int) -> list[float]:
+    pool = WarmWorkerPool(1, max_jobs_per_worker=max_jobs_per_worker)
+    # wait until the worker finished its imports, as it would be in the app
+    run_pool_job(pool)
+
+    latencies = []
+    for _ in range(num_jobs):
+        start = time.perf_counter()
+        run_pool_job(pool)
+        latencies.append(time.perf_counter() - start)
+    pool.close()
+    return latencies
+
+
+def summary(name: str, latencies: list[float]):
+    print(
+        f"{name:>6}: mean {statistics.mean(latencies) * 1000:9.1f} ms, "
+        f"median {statistics.median(latencies) * 1000:9.1f} ms, "
+        f"max {max(latencies) * 1000:9.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-jobs", type=int, default=10)
+    parser.add_argument("--max-jobs-per-worker", type=int, default=5)
+    args = parser.parse_args()
+
+    set_start_method("spawn")
+    summary("cold", run_cold(args.num_jobs))
+    summary("warm", run_warm(args.num_jobs, args.max_jobs_per_worker))
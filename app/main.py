@@ -12,7 +12,6 @@ if multiprocessing.current_process().name == "MainProcess":
     from src.page.nav import get_page_list, nav
     from src.service import waffle_dataset as wd
     from src.service import waffle_hub as wh
-    from src.utils.resource import cpu_check, gpu_check, memory_check
     from streamlit_autorefresh import st_autorefresh
     from waffle_utils.logger import initialize_logger
 
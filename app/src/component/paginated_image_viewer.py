@@ -0,0 +1,49 @@
+import math
+
+import streamlit as st
+from src.service.thumbnail_cache import thumbnail_cache
+from streamlit_image_viewer import image_viewer
+
+
+def lazy_paginated_image_viewer(
+    num_images: int, load_page, ncol: int, nrow: int, key: str, image_name_visible: bool = False
+):
+    """Show one page of images at a time, loading only that page.
+
+    Args:
+        num_images (int): total number of images.
+        load_page (Callable): (offset, count) -> image paths of the page.
+    """
+    page_size = ncol * nrow
+    num_pages = max(1, math.ceil(num_images / page_size))
+    page = 1
+    if num_pages > 1:
+        page = st.number_input(
+            f"Page (1 ~ {num_pages})",
+            min_value=1,
+            max_value=num_pages,
+            value=1,
+            step=1,
+            key=f"{key}_page",
+        )
+    page_paths = load_page((page - 1) * page_size, page_size)
+    image_viewer(
+        thumbnail_cache.get_thumbnails(page_paths),
+        ncol=ncol,
+        nrow=nrow,
+        image_name_visible=image_name_visible,
+    )
+
+
+def paginated_image_viewer(
+    image_paths: list, ncol: int, nrow: int, key: str, image_name_visible: bool = False
+):
+    """Show one page of images at a time, sending only that page's thumbnails."""
+    lazy_paginated_image_viewer(
+        len(image_paths),
+        lambda offset, count: image_paths[offset : offset + count],
+        ncol=ncol,
+        nrow=nrow,
+        key=key,
+        image_name_visible=image_name_visible,
+    )
@@ -43,5 +43,11 @@ class BasePage:
         if st.button("refresh"):
             st.rerun()
 
+        self.watch()
+
+    def watch(self):
+        """Keep the rendered page up to date. Pages that follow runs override this."""
+        pass
+
     def __call__(self):
         self.render()
@@ -1,16 +1,19 @@
 import decimal
 import logging
 import os
+import random
 from collections import OrderedDict, defaultdict
-from tempfile import NamedTemporaryFile, TemporaryDirectory
 
 import streamlit as st
 import streamlit_shadcn_ui as ui
+from src.component.paginated_image_viewer import lazy_paginated_image_viewer
+from src.schema.run import DATASET_RUN_TYPES, RunType
+from src.service import dataset_job
 from src.service import waffle_dataset as wd
-from src.utils.plot import plot_bar
-from streamlit_image_viewer import image_viewer
+from src.service.download_server import download_server
+from src.service.run_service import END_STATUS, run_service
+from src.utils.plot import plot_bar, plot_heatmap, plot_histogram
 from waffle_hub.schema.fields import Image
-from waffle_utils.file import io
 
 from .base_page import BasePage
 
@@ -61,17 +64,23 @@ class DatasetPage(BasePage):
                     st.session_state.import_dataset_name and st_image_zip_file and st_json_files
                 ),
             ):
-                wd.from_coco(
-                    dataset_name=st.session_state.import_dataset_name,
-                    task=st.session_state.import_dataset_task_type,
-                    image_zip_file=st_image_zip_file,
-                    json_files=st_json_files,
-                    root_dir=st.session_state.waffle_dataset_root_dir,
+                with st.spinner("Uploading..."):
+                    staging_dir, (image_zip_file, *json_files) = wd.stage_uploads(
+                        [st_image_zip_file, *st_json_files],
+                        root_dir=st.session_state.waffle_dataset_root_dir,
+                    )
+                self.add_dataset_run(
+                    RunType.DATASET_IMPORT,
+                    st.session_state.import_dataset_name,
+                    dataset_job.import_coco,
+                    {
+                        "task": st.session_state.import_dataset_task_type,
+                        "image_zip_file": str(image_zip_file),
+                        "json_files": [str(json_file) for json_file in json_files],
+                        "staging_dir": str(staging_dir),
+                    },
                 )
 
-                st.success("Import done!")
-                st.session_state.select_dataset_name = st.session_state.import_dataset_name
-
         elif data_type == "yolo":
             st.selectbox(
                 "Task Type",
@@ -92,41 +101,120 @@ class DatasetPage(BasePage):
                 "Import",
                 disabled=not (st.session_state.import_dataset_name and st_yolo_root_zip_file),
             ):
-                wd.from_yolo(
-                    dataset_name=st.session_state.import_dataset_name,
-                    task=st.session_state.import_dataset_task_type,
-                    yolo_root_zip_file=st_yolo_root_zip_file,
-                    root_dir=st.session_state.waffle_dataset_root_dir,
+                with st.spinner("Uploading..."):
+                    staging_dir, (yolo_root_zip_file,) = wd.stage_uploads(
+                        [st_yolo_root_zip_file], root_dir=st.session_state.waffle_dataset_root_dir
+                    )
+                self.add_dataset_run(
+                    RunType.DATASET_IMPORT,
+                    st.session_state.import_dataset_name,
+                    dataset_job.import_yolo,
+                    {
+                        "task": st.session_state.import_dataset_task_type,
+                        "yolo_root_zip_file": str(yolo_root_zip_file),
+                        "staging_dir": str(staging_dir),
+                    },
+                )
+
+    def add_dataset_run(self, run_type: str, dataset_name: str, func, args: dict):
+        run_service.add_run(
+            dataset_job.get_run_name(run_type, dataset_name),
+            run_type,
+            func,
+            {
+                "dataset_name": dataset_name,
+                "root_dir": st.session_state.waffle_dataset_root_dir,
+                **args,
+            },
+        )
+        st.info(f"{run_type} Process is registered. See the Run page for the progress.")
+
+    def get_last_dataset_run(self, run_type: str, dataset_name: str) -> dict:
+        runs = [run_service.get_run(run_name) for run_name in run_service.get_run_list(run_type)]
+        runs = [run for run in runs if run and run["args"]["dataset_name"] == dataset_name]
+        return runs[-1] if runs else None
+
+    def render_dataset_runs(self, dataset_name: str):
+        for run_type in DATASET_RUN_TYPES:
+            run = self.get_last_dataset_run(run_type, dataset_name)
+            if run is None:
+                continue
+            run_info = run["run_info"]
+            if run_info.status in END_STATUS:
+                if run_info.status != "SUCCESS":
+                    st.error(f"{run_type} {run_info.status}: {run_info.error_msg}")
+                continue
+            progress = (
+                run_info.current_step / run_info.total_step
+                if run_info.current_step and run_info.total_step
+                else 0.0
+            )
+            st.progress(progress, text=f"{run_type}: {run_info.status}")
+
+    def render_ingest_report(self, dataset_name: str):
+        report = wd.get_ingest_report(
+            dataset_name=dataset_name, root_dir=st.session_state.waffle_dataset_root_dir
+        )
+        if report and report["duplicates"]:
+            st.warning(
+                f"{len(report['duplicates'])} of {report['num_images']} images are duplicates."
+            )
+            with st.expander("Duplicate Images"):
+                st.dataframe(
+                    [
+                        {"image": name, "duplicate_of": original}
+                        for name, original in report["duplicates"].items()
+                    ],
+                    use_container_width=True,
                 )
 
-                st.success("Import done!")
-                st.session_state.select_dataset_name = st.session_state.import_dataset_name
+    def render_merge_report(self, dataset_name: str):
+        report = wd.get_merge_report(
+            dataset_name=dataset_name, root_dir=st.session_state.waffle_dataset_root_dir
+        )
+        if report is None:
+            return
+        with st.expander("Merge Report"):
+            st.write(
+                {
+                    "sources": report["sources"],
+                    "images": report["num_images"],
+                    "duplicate images": report["num_duplicates"],
+                    "annotations": report["num_annotations"],
+                    "saved (MB)": round(report["bytes_saved"] / 1024**2, 1),
+                    "linked/copied (MB)": {
+                        method: round(size / 1024**2, 1)
+                        for method, size in report["bytes"].items()
+                    },
+                    "elapsed (s)": round(report["elapsed"], 1),
+                    "images/s": round(report["images_per_second"] or 0, 1),
+                    "MB/s": round(report["mb_per_second"] or 0, 1),
+                }
+            )
 
     def render_select_dataset(self):
         st.subheader("Select Dataset")
-        dataset_list = wd.get_dataset_list(root_dir=st.session_state.waffle_dataset_root_dir)
+        dataset_entries = wd.get_dataset_entries(root_dir=st.session_state.waffle_dataset_root_dir)
+        dataset_list = [entry["name"] for entry in dataset_entries]
 
         filter_maps = defaultdict(set)
         dataset_infos = []
         dataset_captions = []
-        with st.spinner("Loading get dataset list..."):
-            for name in dataset_list:
-                dataset_info = wd.get_dataset_info_dict(
-                    dataset_name=name, root_dir=st.session_state.waffle_dataset_root_dir
-                )
-                dataset_infos.append(dataset_info)
-                for key, value in dataset_info.items():
-                    if isinstance(value, (str, int, float)) and key != "name":
-                        if key == "created":
-                            value = value.split(" ")[0]
-                        filter_maps[key].add(value)
-
-                dataset_captions.append(
-                    f"Task: {dataset_info['task'].upper():>24}, Categories: {str([category['name'] for category in dataset_info['categories']]):>20}, Created: {dataset_info['created']:>20}"
-                )
+        for entry in dataset_entries:
+            dataset_info = entry["info"]
+            dataset_infos.append(dataset_info)
+            for key, value in dataset_info.items():
+                if isinstance(value, (str, int, float)) and key != "name":
+                    if key == "created":
+                        value = value.split(" ")[0]
+                    filter_maps[key].add(value)
+
+            dataset_captions.append(
+                f"Task: {dataset_info['task'].upper():>24}, Categories: {str([category['name'] for category in dataset_info['categories']]):>20}, Images: {entry['stats']['num_images']}, Created: {dataset_info['created']:>20}"
+            )
 
-            for key, value in filter_maps.items():
-                filter_maps[key] = list(set(value))
+        for key, value in filter_maps.items():
+            filter_maps[key] = list(set(value))
         filter_key = st.selectbox("filter key", ["All"] + list(filter_maps.keys()), key="filter_key")
         if filter_key and filter_key != "All":
             values = list(filter_maps[st.session_state.filter_key])
@@ -170,34 +258,95 @@ class DatasetPage(BasePage):
             st.error("The sum of ratios must be 1.0")
             split_button_disabled = True
 
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            seed = st.number_input("seed", min_value=0, value=0, step=1, key="split_seed")
+        with col2:
+            group_by = st.selectbox(
+                "group by",
+                ["none", "directory"],
+                key="split_group_by",
+                help="Images of the same group (e.g. frames of a video in one directory) go "
+                "to the same split.",
+            )
+        with col3:
+            stratify = st.checkbox(
+                "stratify by category",
+                value=True,
+                key="split_stratify",
+                help="Keep the ratios for each category, by the rarest category of each image.",
+            )
+        with col4:
+            is_split = bool(
+                wd.get_split_list(
+                    st.session_state.select_dataset_name,
+                    root_dir=st.session_state.waffle_dataset_root_dir,
+                )
+            )
+            incremental = st.checkbox(
+                "only new images",
+                value=is_split,
+                disabled=not is_split,
+                key="split_incremental",
+                help="Keep the current split and assign only the images not in any set yet.",
+            )
+
         if st.button("Split", disabled=split_button_disabled):
-            wd.split(
-                dataset_name=st.session_state.select_dataset_name,
-                train_ratio=train_ratio,
-                val_ratio=val_ratio,
-                test_ratio=test_ratio,
-                root_dir=st.session_state.waffle_dataset_root_dir,
+            self.add_dataset_run(
+                RunType.DATASET_SPLIT,
+                st.session_state.select_dataset_name,
+                dataset_job.split,
+                {
+                    "train_ratio": train_ratio,
+                    "val_ratio": val_ratio,
+                    "test_ratio": test_ratio,
+                    "seed": int(seed),
+                    "stratify": stratify,
+                    "group_by": None if group_by == "none" else group_by,
+                    "incremental": incremental and is_split,
+                },
             )
-            st.success("Split done!")
 
     def render_export_dataset(self):
         st.subheader("Download Dataset")
         data_type = st.selectbox("format", ["coco", "yolo", "autocare_dlt", "transformers"])
         if st.button("Export"):
-            exported_directory = wd.export(
-                dataset_name=st.session_state.select_dataset_name,
-                data_type=data_type,
-                root_dir=st.session_state.waffle_dataset_root_dir,
+            self.add_dataset_run(
+                RunType.DATASET_EXPORT,
+                st.session_state.select_dataset_name,
+                dataset_job.export,
+                {"data_type": data_type},
             )
-            st.success("Export done!")
-            st.info(f"Exported Path: {exported_directory}")
-            with NamedTemporaryFile(suffix=".zip") as zip_file:
-                io.zip(exported_directory, zip_file.name)
-                with open(zip_file.name, "rb") as f:
-                    data = f.read()
-                    st.download_button(
-                        "Download", data, f"{data_type}.zip", key="download_exported_dataset"
-                    )
+
+        export_run = self.get_last_dataset_run(
+            RunType.DATASET_EXPORT, st.session_state.select_dataset_name
+        )
+        if export_run is not None and export_run["run_info"].status not in END_STATUS:
+            return
+        archive_file = wd.get_export_archive(
+            dataset_name=st.session_state.select_dataset_name,
+            data_type=data_type,
+            root_dir=st.session_state.waffle_dataset_root_dir,
+        )
+        if archive_file is None:
+            return
+
+        file_name = f"{st.session_state.select_dataset_name}_{data_type}.zip"
+        st.info(f"Exported Path: {archive_file} ({archive_file.stat().st_size / 1024**2:.1f} MB)")
+        if not download_server.base_url:
+            # the download server needs a second port reachable from the browser, so without
+            # WAFFLE_APP_DOWNLOAD_URL the archive goes through streamlit from an open file
+            with open(archive_file, "rb") as f:
+                st.download_button(
+                    f"Download {file_name}", f, file_name, key="download_exported_dataset"
+                )
+            return
+        # served from disk by the download server, the archive is never read into memory
+        url = download_server.get_url(archive_file, file_name)
+        if url is None:
+            st.warning("Download server is not available. Copy the archive from the path above.")
+        else:
+            st.markdown(f"[Download {file_name}]({url})")
 
     def render_dataset_info(self):
         st.subheader("Dataset Info")
@@ -206,6 +355,9 @@ class DatasetPage(BasePage):
             root_dir=st.session_state.waffle_dataset_root_dir,
         )
         st.write(dataset_info)
+        self.render_dataset_runs(st.session_state.select_dataset_name)
+        self.render_ingest_report(st.session_state.select_dataset_name)
+        self.render_merge_report(st.session_state.select_dataset_name)
 
         st.divider()
 
@@ -255,10 +407,10 @@ class DatasetPage(BasePage):
         with columns[0]:
             st.pyplot(
                 plot_bar(
-                    list(statistics["num_instances_per_category"].keys()),
-                    list(statistics["num_instances_per_category"].values()),
+                    statistics["category_ids"],
+                    statistics["num_instances_per_category"],
                     title="num_instances_per_category",
-                    names=[category.name for category in statistics["categories"]],
+                    names=statistics["category_names"],
                     xlabel="num_instances",
                     ylabel="category_id",
                     figsize=(10, 5),
@@ -269,10 +421,10 @@ class DatasetPage(BasePage):
         with columns[1]:
             st.pyplot(
                 plot_bar(
-                    list(statistics["num_images_per_category"].keys()),
-                    list(statistics["num_images_per_category"].values()),
+                    statistics["category_ids"],
+                    statistics["num_images_per_category"],
                     title="num_images_per_category",
-                    names=[category.name for category in statistics["categories"]],
+                    names=statistics["category_names"],
                     xlabel="num_images",
                     ylabel="category_id",
                     figsize=(10, 5),
@@ -280,20 +432,118 @@ class DatasetPage(BasePage):
                 )
             )
 
+        columns = st.columns(2)
+
+        with columns[0]:
+            st.pyplot(
+                plot_histogram(
+                    statistics["bbox_size_bins"],
+                    statistics["bbox_size_hist"],
+                    title="bbox_size (sqrt(area))",
+                    xlabel="bbox_size",
+                    ylabel="num_instances",
+                    figsize=(10, 5),
+                )
+            )
+
+        with columns[1]:
+            st.pyplot(
+                plot_histogram(
+                    statistics["aspect_ratio_bins"],
+                    statistics["aspect_ratio_hist"],
+                    title="aspect_ratio (log2(w/h))",
+                    xlabel="aspect_ratio",
+                    ylabel="num_instances",
+                    figsize=(10, 5),
+                )
+            )
+
+        columns = st.columns(2)
+
+        with columns[0]:
+            st.pyplot(
+                plot_histogram(
+                    statistics["resolution_bins"],
+                    statistics["resolution_hist"],
+                    title="image_resolution (long side)",
+                    xlabel="resolution",
+                    ylabel="num_images",
+                    figsize=(10, 5),
+                )
+            )
+            st.dataframe(statistics["top_resolutions"], use_container_width=True)
+
+        with columns[1]:
+            st.pyplot(
+                plot_histogram(
+                    statistics["objects_per_image_bins"],
+                    statistics["objects_per_image_hist"],
+                    title=f"objects_per_image (mean: {statistics['mean_objects_per_image']:.2f})",
+                    xlabel="num_objects",
+                    ylabel="num_images",
+                    figsize=(10, 5),
+                )
+            )
+
+        st.pyplot(
+            plot_heatmap(
+                statistics["cooccurrence"],
+                names=statistics["category_names"],
+                title="category_cooccurrence (num_images)",
+                figsize=(10, 10),
+            )
+        )
+
         st.divider()
 
         st.subheader("Sample Images")
 
-        draw = st.checkbox("Show Annotations")
-        with st.spinner("Drawing..."):
-            image_paths = wd.get_sample_image_paths(
+        if "dataset_sample_seed" not in st.session_state:
+            st.session_state.dataset_sample_seed = random.randrange(2**31)
+        col1, col2, col3 = st.columns([0.4, 0.4, 0.2])
+        with col1:
+            draw = st.checkbox("Show Annotations")
+        with col2:
+            method = st.selectbox(
+                "Sampling",
+                wd.SAMPLE_METHODS,
+                key="dataset_sample_method",
+                help="random: uniform, stratified: categories in turn, "
+                "hard: many, small and rare objects first",
+            )
+        with col3:
+            if st.button("Shuffle", key="dataset_sample_shuffle"):
+                st.session_state.dataset_sample_seed = random.randrange(2**31)
+
+        progress_bar = st.empty()
+
+        def on_progress(num_done: int, num_total: int):
+            if num_done < num_total:
+                progress_bar.progress(num_done / num_total, text=f"Drawing {num_done}/{num_total}")
+            else:
+                progress_bar.empty()
+
+        lazy_paginated_image_viewer(
+            wd.get_num_sample_images(
+                dataset_name=st.session_state.select_dataset_name,
+                set_name=set_name,
+                root_dir=st.session_state.waffle_dataset_root_dir,
+            ),
+            lambda offset, count: wd.get_sample_image_paths(
                 dataset_name=st.session_state.select_dataset_name,
-                sample_num=105,
+                sample_num=count,
                 draw=draw,
                 set_name=set_name,
                 root_dir=st.session_state.waffle_dataset_root_dir,
-            )
-            image_viewer(image_paths, ncol=5, nrow=3)
+                seed=st.session_state.dataset_sample_seed,
+                callback=on_progress,
+                method=method,
+                offset=offset,
+            ),
+            ncol=5,
+            nrow=3,
+            key="dataset_sample",
+        )
 
     def render_merge_dataset(self):
         st.subheader("Merge Dataset")
@@ -315,19 +565,27 @@ class DatasetPage(BasePage):
             task=st.session_state.merge_dataset_task_type,
         )
         st.multiselect("Select Datasets", dataset_list, key="merge_dataset_select_datasets")
+        st.checkbox(
+            "Deduplicate and link images",
+            value=True,
+            key="merge_dataset_deduplicate",
+            help="Merge identical images by content and hard link raw images instead of copying.",
+        )
         if st.button(
             "Merge",
             disabled=(len(st.session_state.merge_dataset_select_datasets) < 2)
             or not st.session_state.merge_dataset_name,
         ):
-            with st.spinner("Merging..."):
-                wd.merge(
-                    new_dataset_name=st.session_state.merge_dataset_name,
-                    task=st.session_state.merge_dataset_task_type,
-                    select_dataset_names=st.session_state.merge_dataset_select_datasets,
-                    root_dir=st.session_state.waffle_dataset_root_dir,
-                )
-                st.success("Merge done!")
+            self.add_dataset_run(
+                RunType.DATASET_MERGE,
+                st.session_state.merge_dataset_name,
+                dataset_job.merge,
+                {
+                    "select_dataset_names": st.session_state.merge_dataset_select_datasets,
+                    "task": st.session_state.merge_dataset_task_type,
+                    "deduplicate": st.session_state.merge_dataset_deduplicate,
+                },
+            )
 
     def render_content(self):
         with st.expander("Import New Dataset"):
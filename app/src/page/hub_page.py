@@ -5,13 +5,13 @@ from pathlib import Path
 import streamlit as st
 import streamlit_shadcn_ui as ui
 from src.component.auto_component import generate_component
+from src.component.paginated_image_viewer import paginated_image_viewer
 from src.schema.run import RunType
 from src.service import waffle_dataset as wd
 from src.service import waffle_hub as wh
 from src.service.run_service import run_service
 from src.utils.plot import plot_graphs
 from src.utils.resource import get_available_devices
-from streamlit_image_viewer import image_viewer
 from streamlit_tags import st_tags
 from waffle_utils.file import io, search
 
@@ -86,45 +86,33 @@ class HubPage(BasePage):
 
     def render_select_hub(self):
         st.subheader("Select Hub")
-        model_list = wh.get_hub_list(root_dir=st.session_state.waffle_hub_root_dir)
+        hub_infos = wh.get_hub_infos(root_dir=st.session_state.waffle_hub_root_dir)
 
-        filter_maps = defaultdict(list)
+        filter_maps = defaultdict(set)
         filter_map_keys = ["backend", "task", "status"]
-        model_infos = []
-        model_captions = []
-        for name in model_list:
-            hub = wh.load(name, root_dir=st.session_state.waffle_hub_root_dir)
-            model_info = wh.get_model_config_dict(hub)
-            model_status = wh.get_train_status(hub)
-            model_info["status"] = model_status.status_desc if model_status else "INIT"
-            model_infos.append(model_info)
+        for hub_info in hub_infos:
             for key in filter_map_keys:
-                filter_maps[key].append(model_info[key])
+                filter_maps[key].add(hub_info["info"][key])
 
-            model_captions.append(
-                f"Backend: {model_info['backend'].upper():>24}, Task: {model_info['task'].upper():>24}, Categories: {str([category['name'] for category in model_info['categories']]):>20}, Status: {model_status.status_desc if model_status else 'INIT'}"
-            )
-
-        for key, value in filter_maps.items():
-            filter_maps[key] = list(set(value))
-
-        filter_key = st.selectbox("filter key", ["All"] + list(filter_maps.keys()), key="filter_key")
+        filter_key = st.selectbox("filter key", ["All"] + filter_map_keys, key="filter_key")
         if filter_key and filter_key != "All":
             values = list(filter_maps[st.session_state.filter_key])
             st.multiselect("filter value", values, default=values, key="filter_value")
 
-            filtered_model_index = []
-            for i, model_info in enumerate(model_infos):
-                if model_info[st.session_state.filter_key] in st.session_state.filter_value:
-                    filtered_model_index.append(i)
-
-            model_list = [model_list[i] for i in filtered_model_index]
-            model_captions = [model_captions[i] for i in filtered_model_index]
+            hub_infos = [
+                hub_info
+                for hub_info in hub_infos
+                if hub_info["info"][st.session_state.filter_key] in st.session_state.filter_value
+            ]
 
         hub_name = st.radio(
-            "Select Hub", model_list, 0, captions=model_captions, key="select_waffle_hub_name"
+            "Select Hub",
+            [hub_info["name"] for hub_info in hub_infos],
+            0,
+            captions=[hub_info["caption"] for hub_info in hub_infos],
+            key="select_waffle_hub_name",
         )
-        st.session_state.select_waffle_hub = wh.load(
+        st.session_state.select_waffle_hub = wh.load_cached(
             hub_name, root_dir=st.session_state.waffle_hub_root_dir
         )
 
@@ -191,6 +179,7 @@ class HubPage(BasePage):
             st.multiselect("device", get_available_devices(), key="train_device")
             st.number_input("num_workers", value=0, key="train_num_workers")
             st.number_input("seed", value=42, key="train_seed")
+            st.number_input("priority", value=0, key="train_priority")
 
     def render_train(self):
         if st.session_state.select_waffle_hub is None:
@@ -249,7 +238,13 @@ class HubPage(BasePage):
 
             wh.delete_status(st.session_state.select_waffle_hub, RunType.TRAIN)
             run_name = f"{st.session_state.select_waffle_hub.name}_{str(RunType.TRAIN)}"
-            run_service.add_run(run_name, RunType.TRAIN, wh.train, run_args)
+            run_service.add_run(
+                run_name,
+                RunType.TRAIN,
+                wh.train,
+                run_args,
+                priority=st.session_state.train_priority,
+            )
             st.info("Train Process is registered.")
 
         # for name, type in TrainConfig.__annotations__.items():
@@ -262,11 +257,23 @@ class HubPage(BasePage):
         #     )
 
     def render_train_result(self):
-        if wh.is_trained(st.session_state.select_waffle_hub):
-            st.subheader("Train Results")
-            train_loss, val_loss, metrics = wh.get_metrics(st.session_state.select_waffle_hub)
+        hub = st.session_state.select_waffle_hub
+        if wh.is_trained(hub) or wh.is_training(hub):
+            if wh.is_trained(hub):
+                st.subheader("Train Results")
+            else:
+                # ultralytics의 results.csv는 epoch마다 추가되므로 학습 중에도 그릴 수 있습니다.
+                st.subheader("Train Progress")
+                st.button("Refresh", key="hub_page_train_progress_refresh")
+            train_loss, val_loss, metrics = wh.get_metrics(hub)
+            num_epochs = max(
+                map(len, [*train_loss.values(), *val_loss.values(), *metrics.values()]), default=0
+            )
+            if num_epochs == 0:
+                st.info("No metrics yet.")
+                return
             col1, col2 = st.columns([0.5, 0.5], gap="medium")
-            x = [i + 1 for i in range(len(list(train_loss.items())[0][1]))]
+            x = [i + 1 for i in range(num_epochs)]
             with col1:
                 if train_loss == {}:
                     st.warning("Train Loss is empty")
@@ -359,6 +366,7 @@ class HubPage(BasePage):
                 )
 
             num_workers = st.number_input("num_workers", value=0, key=f"{func}_num_workers")
+            st.number_input("priority", value=0, key=f"{func}_priority")
 
         device = "cpu" if "cpu" in device else ",".join(device)
         if "cpu" in device:
@@ -433,7 +441,13 @@ class HubPage(BasePage):
             }
             wh.delete_status(st.session_state.select_waffle_hub, RunType.EVALUATE)
             run_name = f"{st.session_state.select_waffle_hub.name}_{str(RunType.EVALUATE)}"
-            run_service.add_run(run_name, RunType.EVALUATE, wh.evaluate, run_args)
+            run_service.add_run(
+                run_name,
+                RunType.EVALUATE,
+                wh.evaluate,
+                run_args,
+                priority=st.session_state.eval_priority,
+            )
             st.info("Evaluate Process is registered.")
 
     def render_evaluate_result(self):
@@ -531,7 +545,13 @@ class HubPage(BasePage):
 
             wh.delete_status(st.session_state.select_waffle_hub, RunType.INFERENCE)
             run_name = f"{st.session_state.select_waffle_hub.name}_{str(RunType.INFERENCE)}"
-            run_service.add_run(run_name, RunType.INFERENCE, wh.inference, run_args)
+            run_service.add_run(
+                run_name,
+                RunType.INFERENCE,
+                wh.inference,
+                run_args,
+                priority=st.session_state.infer_priority,
+            )
             st.info("Inference Process is registered.")
 
     def render_inference_result(self):
@@ -544,9 +564,9 @@ class HubPage(BasePage):
             )
             image_list = search.get_image_files(directory=infer_path / "draws")
             with st.spinner("Image Loading..."):
-                if len(image_list) > 1000:
-                    image_list = image_list[:1000]
-                image_viewer(image_list, ncol=5, nrow=2, image_name_visible=True)
+                paginated_image_viewer(
+                    image_list, ncol=5, nrow=2, key="inference_result", image_name_visible=True
+                )
 
             # TODO: Video Viewer
             # video_path = search.get_video_files(directory=infer_path)
@@ -1,47 +1,159 @@
+import os
+import time
 from collections import defaultdict
 from dataclasses import asdict
 
+import numpy as np
+import pandas as pd
 import streamlit as st
-from src.schema.run import RunType
+from src.schema.run import DATASET_RUN_TYPES, RunType
+from src.service import waffle_dataset as wd
 from src.service import waffle_hub as wh
+from src.service.resource_sampler import RUN_COLUMNS, resource_sampler
 from src.service.run_service import run_service
-from src.utils.resource import cpu_check, gpu_check, memory_check
-from streamlit_autorefresh import st_autorefresh
 from waffle_hub.hub import Hub
 from waffle_hub.schema.running_status import TrainingStatus
 
 from .base_page import BasePage
 
+# seconds between resource and curve updates while runs are running / while nothing runs
+ACTIVE_INTERVAL = float(os.getenv("WAFFLE_APP_RUN_PAGE_ACTIVE_INTERVAL", 1.0))
+IDLE_INTERVAL = float(os.getenv("WAFFLE_APP_RUN_PAGE_IDLE_INTERVAL", 10.0))
+# run changes are waited for in slices of this, so widgets respond within it
+HEARTBEAT_INTERVAL = 0.5
+
+
+def get_dataset_run_list() -> list[str]:
+    return [
+        run_name for run_type in DATASET_RUN_TYPES for run_name in run_service.get_run_list(run_type)
+    ]
+
 
 class RunPage(BasePage):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._resources = []  # (placeholder, render(placeholder))
+        self._tables = []  # [placeholder, get_run_names, info_dict]
+        self._curves = None  # (placeholder, hub)
+        self._structure = None  # run names and running run names the page was rendered with
+
+    def render_resource(self, render):
+        """Resource view, drawn again by watch() from the latest samples."""
+        placeholder = st.empty()
+        render(placeholder)
+        self._resources.append((placeholder, render))
+
+    @staticmethod
+    def _get_frame(times: np.ndarray, values: np.ndarray, columns: list[str]) -> pd.DataFrame:
+        index = pd.to_datetime(times, unit="s").tz_localize("UTC").tz_convert(None)
+        return pd.DataFrame(values, index=index, columns=columns)
+
+    def _render_system_resource(self, placeholder, name: str, unit: str = "%"):
+        times, values, columns = resource_sampler.get_history()
+        frame = self._get_frame(times, values, columns)[[name]]
+        with placeholder.container():
+            if len(frame) > 0:
+                st.metric(name, f"{frame[name].iloc[-1]:.1f}{unit}")
+            st.line_chart(frame, height=200)
+
+    def _render_gpu_resource(self, placeholder):
+        times, values, columns = resource_sampler.get_history()
+        gpu_names = resource_sampler.get_gpu_names()
+        with placeholder.container():
+            if not gpu_names:
+                st.info("No GPU")
+                return
+            frame = self._get_frame(times, values, columns)
+            if len(frame) > 0:
+                last = frame.iloc[-1]
+                st.table(
+                    {
+                        "GPU id": gpu_names,
+                        "Mem %": [f"{last[f'gpu{name}_memory']:.2f}" for name in gpu_names],
+                        "Util %": [f"{last[f'gpu{name}_util']:.2f}" for name in gpu_names],
+                    }
+                )
+            st.line_chart(frame[[f"gpu{name}_util" for name in gpu_names]], height=200)
+
     def render_cpu_resource(self):
         st.subheader("CPU Resource")
-        st.code(cpu_check())
+        self.render_resource(lambda placeholder: self._render_system_resource(placeholder, "cpu"))
 
     def render_memory_resource(self):
         st.subheader("Memory Resource")
-        st.code(memory_check())
+        self.render_resource(lambda placeholder: self._render_system_resource(placeholder, "memory"))
 
     def render_gpu_resource(self):
         st.subheader("GPU Resource")
-        st.code(gpu_check())
+        self.render_resource(self._render_gpu_resource)
 
-    def render_train_list(self):
-        st.subheader("Train Process List")
-        train_run_list = run_service.get_run_list(RunType.TRAIN)
+    def _render_run_resource(self, placeholder):
+        run_history = resource_sampler.get_run_history()
+        with placeholder.container():
+            if not run_history:
+                st.info("No running process.")
+                return
+            info_dict = defaultdict(list)
+            frames = {column: {} for column in RUN_COLUMNS}
+            for run_name, (times, values) in run_history.items():
+                frame = self._get_frame(times, values, RUN_COLUMNS)
+                info_dict["name"].append(run_name)
+                for column in RUN_COLUMNS:
+                    info_dict[column].append(frame[column].iloc[-1] if len(frame) else None)
+                usage = resource_sampler.get_run_usage(run_name)
+                info_dict["cpu (avg)"].append(usage.get("avg_cpu", None))
+                info_dict["rss (peak)"].append(usage.get("peak_rss", None))
+                info_dict["gpu_memory (peak)"].append(usage.get("peak_gpu_memory", None))
+                for column in RUN_COLUMNS:
+                    frames[column][run_name] = frame[column]
+            st.caption("cpu in %, rss and gpu_memory in MB, over the process tree of each run")
+            st.table(info_dict)
+            cols = st.columns(len(RUN_COLUMNS))
+            for col, column in zip(cols, RUN_COLUMNS):
+                with col:
+                    st.caption(column)
+                    st.line_chart(pd.DataFrame(frames[column]), height=200)
+
+    def render_run_resource(self):
+        st.subheader("Run Resources")
+        self.render_resource(self._render_run_resource)
+
+    @staticmethod
+    def _get_info_dict(run_names: list[str]) -> dict:
         info_dict = defaultdict(list)
-        for run_name in train_run_list:
+        for run_name in run_names:
             run = run_service.get_run(run_name)
-            run_info = run["run_info"]
-            for key, value in asdict(run_info).items():
+            if run is None:
+                continue
+            for key, value in asdict(run["run_info"]).items():
+                info_dict[key].append(value)
+        return dict(info_dict)
+
+    def render_run_table(self, get_run_names):
+        """Table of runs, updated by watch() when their infos change."""
+        placeholder = st.empty()
+        info_dict = self._get_info_dict(get_run_names())
+        placeholder.table(info_dict)
+        self._tables.append([placeholder, get_run_names, info_dict])
+
+    def render_cache_stats(self):
+        cache_stats = {**wh.get_cache_stats(), "dataset": wd.get_dataset_cache_stats()}
+        info_dict = defaultdict(list)
+        for name, stats in cache_stats.items():
+            info_dict["cache"].append(name)
+            for key, value in stats.items():
                 info_dict[key].append(value)
+        st.table(info_dict)
+
+    def render_train_list(self):
+        st.subheader("Train Process List")
         option_set = set(run_service.get_run_list(RunType.TRAIN)) - set(
             run_service.get_running_process_name_list(RunType.TRAIN)
         )
 
         col1, col2 = st.columns([0.8, 0.2], gap="medium")
         with col1:
-            st.table(info_dict)
+            self.render_run_table(lambda: run_service.get_run_list(RunType.TRAIN))
         with col2:
             st.selectbox(
                 "Remove Train Status",
@@ -55,6 +167,36 @@ class RunPage(BasePage):
                 ),
             )
 
+    def render_train_curves(self):
+        running_list = run_service.get_running_process_name_list(RunType.TRAIN)
+        if not running_list:
+            return
+        st.subheader("Train Curves")
+        run_name = st.selectbox("Select", options=running_list, key="run_page_train_curve_select")
+        run = run_service.get_run(run_name)
+        if run is None:
+            return
+        placeholder = st.empty()
+        self._curves = (placeholder, run["args"]["hub"])
+        self._render_curves()
+
+    def _render_curves(self):
+        placeholder, hub = self._curves
+        # 추가된 행만 읽으므로 매 refresh마다 읽어도 부담이 없습니다.
+        train_loss, val_loss, metrics = wh.get_metrics(hub)
+        with placeholder.container():
+            if not (train_loss or val_loss or metrics):
+                st.info("No metrics yet. Curves are shown while training only for ultralytics.")
+                return
+            cols = st.columns(3)
+            for col, (title, values) in zip(
+                cols, [("Train Loss", train_loss), ("Val Loss", val_loss), ("Metrics", metrics)]
+            ):
+                with col:
+                    st.caption(title)
+                    if values:
+                        st.line_chart(values)
+
     def render_train_kill(self):
         st.subheader("Kill Train Process")
         st.selectbox(
@@ -69,20 +211,13 @@ class RunPage(BasePage):
 
     def render_eval_list(self):
         st.subheader("Evaluate Process List")
-        eval_run_list = run_service.get_run_list(RunType.EVALUATE)
-        info_dict = defaultdict(list)
-        for run_name in eval_run_list:
-            run = run_service.get_run(run_name)
-            run_info = run["run_info"]
-            for key, value in asdict(run_info).items():
-                info_dict[key].append(value)
         option_set = set(run_service.get_run_list(RunType.EVALUATE)) - set(
             run_service.get_running_process_name_list(RunType.EVALUATE)
         )
 
         col1, col2 = st.columns([0.8, 0.2], gap="medium")
         with col1:
-            st.table(info_dict)
+            self.render_run_table(lambda: run_service.get_run_list(RunType.EVALUATE))
         with col2:
             st.selectbox(
                 "Remove Evaluate Status",
@@ -110,20 +245,13 @@ class RunPage(BasePage):
 
     def render_infer_list(self):
         st.subheader("Inference Process List")
-        infer_run_list = run_service.get_run_list(RunType.INFERENCE)
-        info_dict = defaultdict(list)
-        for run_name in infer_run_list:
-            run = run_service.get_run(run_name)
-            run_info = run["run_info"]
-            for key, value in asdict(run_info).items():
-                info_dict[key].append(value)
         option_set = set(run_service.get_run_list(RunType.INFERENCE)) - set(
             run_service.get_running_process_name_list(RunType.INFERENCE)
         )
 
         col1, col2 = st.columns([0.8, 0.2], gap="medium")
         with col1:
-            st.table(info_dict)
+            self.render_run_table(lambda: run_service.get_run_list(RunType.INFERENCE))
         with col2:
             st.selectbox(
                 "Remove Inference Status",
@@ -151,20 +279,13 @@ class RunPage(BasePage):
 
     def render_export_onnx_list(self):
         st.subheader("Export Onnx Process List")
-        export_onnx_run_list = run_service.get_run_list(RunType.EXPORT_ONNX)
-        info_dict = defaultdict(list)
-        for run_name in export_onnx_run_list:
-            run = run_service.get_run(run_name)
-            run_info = run["run_info"]
-            for key, value in asdict(run_info).items():
-                info_dict[key].append(value)
         option_set = set(run_service.get_run_list(RunType.EXPORT_ONNX)) - set(
             run_service.get_running_process_name_list(RunType.EXPORT_ONNX)
         )
 
         col1, col2 = st.columns([0.8, 0.2], gap="medium")
         with col1:
-            st.table(info_dict)
+            self.render_run_table(lambda: run_service.get_run_list(RunType.EXPORT_ONNX))
         with col2:
             st.selectbox(
                 "Remove Export Onnx Status",
@@ -192,20 +313,13 @@ class RunPage(BasePage):
 
     def render_export_waffle_list(self):
         st.subheader("Export Waffle Process List")
-        export_waffle_run_list = run_service.get_run_list(RunType.EXPORT_WAFFLE)
-        info_dict = defaultdict(list)
-        for run_name in export_waffle_run_list:
-            run = run_service.get_run(run_name)
-            run_info = run["run_info"]
-            for key, value in asdict(run_info).items():
-                info_dict[key].append(value)
         option_set = set(run_service.get_run_list(RunType.EXPORT_WAFFLE)) - set(
             run_service.get_running_process_name_list(RunType.EXPORT_WAFFLE)
         )
 
         col1, col2 = st.columns([0.8, 0.2], gap="medium")
         with col1:
-            st.table(info_dict)
+            self.render_run_table(lambda: run_service.get_run_list(RunType.EXPORT_WAFFLE))
         with col2:
             st.selectbox(
                 "Remove Export Waffle Status",
@@ -231,8 +345,55 @@ class RunPage(BasePage):
             on_click=lambda: run_service.kill(st.session_state.run_page_export_waffle_kill_select),
         )
 
+    def render_dataset_list(self):
+        st.subheader("Dataset Process List")
+        dataset_run_list = get_dataset_run_list()
+        option_set = set(dataset_run_list) - set(run_service.get_running_process_name_list())
+
+        col1, col2 = st.columns([0.8, 0.2], gap="medium")
+        with col1:
+            self.render_run_table(get_dataset_run_list)
+        with col2:
+            st.selectbox(
+                "Remove Dataset Status",
+                options=list(option_set),
+                key="run_page_dataset_remove_status_select",
+            )
+            st.button(
+                "Delete Dataset Status",
+                on_click=lambda: run_service.del_run_list(
+                    st.session_state.run_page_dataset_remove_status_select
+                ),
+            )
+
+    def render_run_history(self):
+        history = pd.DataFrame(run_service.get_history())
+        st.download_button(
+            "Download Run History",
+            data=history.to_csv(index=False),
+            file_name="run_history.csv",
+            mime="text/csv",
+            disabled=history.empty,
+        )
+
+    def render_dataset_kill(self):
+        st.subheader("Kill Dataset Process")
+        st.selectbox(
+            "Select",
+            options=[
+                run_name
+                for run_type in DATASET_RUN_TYPES
+                for run_name in run_service.get_running_process_name_list(run_type)
+            ],
+            key="run_page_dataset_kill_select",
+        )
+        st.button(
+            "Dataset Kill",
+            on_click=lambda: run_service.kill(st.session_state.run_page_dataset_kill_select),
+        )
+
     def render_content(self):
-        st_autorefresh(interval=1000)
+        self._structure = self._get_structure()
 
         st.subheader("Resource")
         cols = st.columns(3)
@@ -242,17 +403,23 @@ class RunPage(BasePage):
             self.render_memory_resource()
         with cols[2]:
             self.render_gpu_resource()
+        self.render_run_resource()
+        with st.expander("Cache"):
+            self.render_cache_stats()
 
         st.divider()
 
         self.render_train_list()
+        self.render_train_curves()
         self.render_eval_list()
         self.render_infer_list()
         self.render_export_onnx_list()
         self.render_export_waffle_list()
+        self.render_dataset_list()
+        self.render_run_history()
 
         st.divider()
-        cols = st.columns(5)
+        cols = st.columns(6)
         with cols[0]:
             self.render_train_kill()
         with cols[1]:
@@ -263,5 +430,50 @@ class RunPage(BasePage):
             self.render_export_onnx_kill()
         with cols[4]:
             self.render_export_waffle_kill()
+        with cols[5]:
+            self.render_dataset_kill()
 
         st.divider()
+
+    @staticmethod
+    def _get_structure() -> tuple:
+        return (
+            tuple(run_service.get_run_list()),
+            tuple(run_service.get_running_process_name_list()),
+        )
+
+    def watch(self):
+        """Update the parts of the page whose data changed, until the page is left.
+
+        Run tables are updated on run changes only, resources and curves every
+        ACTIVE_INTERVAL while runs are running and every IDLE_INTERVAL otherwise. When runs
+        are added, started, finished or deleted the page is rerun, so the selects follow.
+        """
+        heartbeat = st.empty()
+        structure = self._structure
+        version = run_service.get_version()
+        last_update_time = time.monotonic()
+        while True:
+            new_version = run_service.wait_for_change(version, timeout=HEARTBEAT_INTERVAL)
+            if self._get_structure() != structure:
+                st.rerun()
+
+            if new_version != version:
+                version = new_version
+                for table in self._tables:
+                    info_dict = self._get_info_dict(table[1]())
+                    if info_dict != table[2]:
+                        table[0].table(info_dict)
+                        table[2] = info_dict
+
+            interval = ACTIVE_INTERVAL if structure[1] else IDLE_INTERVAL
+            if time.monotonic() - last_update_time >= interval:
+                for placeholder, render in self._resources:
+                    render(placeholder)
+                if self._curves is not None:
+                    self._render_curves()
+                last_update_time = time.monotonic()
+
+            # streamlit stops or reruns the script only when it sends something, so a widget
+            # used on the page takes effect within HEARTBEAT_INTERVAL
+            heartbeat.empty()
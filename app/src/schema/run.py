@@ -7,6 +7,11 @@ class RunInfo:
     run_type: str = None
 
     status: str = None
+    pid: int = None
+
+    device: str = None
+    priority: int = None
+    reserved_memory: int = None
 
     scheduled_time: str = None
     start_time: str = None
@@ -14,6 +19,16 @@ class RunInfo:
 
     current_step: int = None
     total_step: int = None
+    steps_per_second: float = None
+
+    # usage of the process tree of the run, sampled while it runs
+    peak_rss: float = None  # MB
+    avg_rss: float = None  # MB
+    avg_cpu: float = None  # %
+    cpu_time: float = None  # seconds
+    io_read_bytes: int = None
+    io_write_bytes: int = None
+    peak_gpu_memory: float = None  # MB
 
     error_type: str = None
     error_msg: str = None
@@ -28,3 +43,16 @@ class RunType:
     INFERENCE = "inference"
     EXPORT_ONNX = "export_onnx"
     EXPORT_WAFFLE = "export_waffle"
+
+    DATASET_IMPORT = "dataset_import"
+    DATASET_EXPORT = "dataset_export"
+    DATASET_SPLIT = "dataset_split"
+    DATASET_MERGE = "dataset_merge"
+
+
+DATASET_RUN_TYPES = [
+    RunType.DATASET_IMPORT,
+    RunType.DATASET_EXPORT,
+    RunType.DATASET_SPLIT,
+    RunType.DATASET_MERGE,
+]
@@ -0,0 +1,219 @@
+import json
+import logging
+import shutil
+import zipfile
+from pathlib import Path, PurePosixPath
+
+from waffle_hub.dataset import Dataset
+from waffle_hub.schema import Annotation, Category, Image
+from waffle_utils.file import io
+
+try:
+    import ijson
+except ImportError:  # fall back to json.load, which keeps the whole file in memory
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 1024**2
+# annotations written per add_annotations call, which reads the category files each time
+ANNOTATION_BATCH_SIZE = 1000
+# save the status every this many images
+STATUS_INTERVAL = 256
+
+
+def copy_upload(uploaded_file, dst: Path) -> Path:
+    """Copy an uploaded file to dst in chunks."""
+    uploaded_file.seek(0)
+    with open(dst, "wb") as f:
+        shutil.copyfileobj(uploaded_file, f, COPY_CHUNK_SIZE)
+    return dst
+
+
+def iter_json_items(json_file, keys: list[str]):
+    """Yield (key, item) for the items of the top level arrays `keys` of a json file.
+
+    With ijson the file is parsed incrementally, so only one item is in memory at a time.
+    """
+    if ijson is None:
+        with open(json_file) as f:
+            data = json.load(f)
+        for key in keys:
+            for item in data.get(key, None) or []:
+                yield key, item
+        return
+
+    prefixes = {f"{key}.item": key for key in keys}
+    current, builder = None, None
+    with open(json_file, "rb") as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if current is None:
+                if prefix in prefixes and event == "start_map":
+                    current, builder = prefix, ijson.ObjectBuilder()
+                    builder.event(event, value)
+                continue
+            builder.event(event, value)
+            if prefix == current and event == "end_map":
+                yield prefixes[current], builder.value
+                current, builder = None, None
+
+
+def is_safe_member_name(name: str) -> bool:
+    """A zip member name that stays inside the directory it is extracted to."""
+    path = PurePosixPath(name.replace("\\", "/"))
+    if not path.parts or path.is_absolute() or ".." in path.parts:
+        return False
+    return ":" not in path.parts[0]  # no windows drive
+
+
+def get_image_dst(raw_image_dir: Path, file_name: str) -> Path:
+    """Path of an image in the raw image dir, rejecting file names that point outside it."""
+    root = raw_image_dir.resolve()
+    dst = (raw_image_dir / file_name).resolve()
+    if not is_safe_member_name(file_name) or not dst.is_relative_to(root) or dst == root:
+        raise ValueError(f"Unsafe image file name: {file_name}")
+    return dst
+
+
+def _get_categories(coco_file) -> list[dict]:
+    return [category for _, category in iter_json_items(coco_file, ["categories"])]
+
+
+def import_coco(dataset: Dataset, coco_files: list, image_zip_file, status_logger=None):
+    """Stream coco json files and an image zip into an empty dataset.
+
+    Same result as waffle_hub's coco import, but annotations are parsed and written in
+    batches and images are extracted straight from the zip into the raw image dir, so
+    memory does not grow with the number of annotations. Imported images of each file are
+    reported to status_logger (RunningStatusLogger) as steps.
+    """
+    if len(coco_files) == 1:
+        set_names = [None]
+    elif len(coco_files) == 2:
+        set_names = ["train", "val"]
+    elif len(coco_files) == 3:
+        set_names = ["train", "val", "test"]
+    else:
+        raise ValueError("coco_file should have 1, 2, or 3 files.")
+
+    # categories should be same between coco files
+    categories = _get_categories(coco_files[0])
+    for coco_file in coco_files[1:]:
+        if categories != _get_categories(coco_file):
+            raise ValueError("categories should be same between coco files.")
+
+    coco_cat_id_to_waffle_cat_id = {}
+    for i, category in enumerate(categories, start=1):
+        coco_category_id = category.pop("id")
+        coco_cat_id_to_waffle_cat_id[coco_category_id] = i
+        dataset.add_categories(
+            [Category.from_dict({**category, "category_id": i}, task=dataset.task)]
+        )
+
+    image_id = 1
+    annotation_id = 1
+    with zipfile.ZipFile(image_zip_file) as zf:
+        members = {}
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            if not is_safe_member_name(info.filename):
+                logger.warning(f"Skipped zip member with an unsafe name: {info.filename}")
+                continue
+            members[info.filename] = info
+
+        for coco_file, set_name in zip(coco_files, set_names):
+            image_dicts = {
+                image_dict.pop("id"): image_dict
+                for _, image_dict in iter_json_items(coco_file, ["images"])
+            }
+
+            if status_logger:
+                status_logger.set_total_step(len(image_dicts))
+
+            # images are numbered in the order of their first annotation, like pycocotools
+            coco_image_id_to_waffle_image_id = {}
+            image_ids = []
+            annotations = []
+            for _, annotation_dict in iter_json_items(coco_file, ["annotations"]):
+                coco_image_id = annotation_dict["image_id"]
+                if coco_image_id not in coco_image_id_to_waffle_image_id:
+                    image_dict = dict(image_dicts[coco_image_id])
+                    file_name = image_dict.pop("file_name")
+                    if file_name not in members:
+                        raise FileNotFoundError(f"{file_name} does not exist.")
+
+                    waffle_file_name = f"{set_name}/{file_name}" if set_name else file_name
+                    dst = get_image_dst(dataset.raw_image_dir, waffle_file_name)
+                    dataset.add_images(
+                        [
+                            Image.from_dict(
+                                {**image_dict, "image_id": image_id, "file_name": waffle_file_name}
+                            )
+                        ]
+                    )
+                    dst.parent.mkdir(parents=True, exist_ok=True)
+                    with zf.open(members[file_name]) as src, open(dst, "wb") as f:
+                        shutil.copyfileobj(src, f, COPY_CHUNK_SIZE)
+
+                    coco_image_id_to_waffle_image_id[coco_image_id] = image_id
+                    image_ids.append(image_id)
+                    image_id += 1
+                    if status_logger and len(image_ids) % STATUS_INTERVAL == 0:
+                        status_logger.set_current_step(len(image_ids))
+
+                annotation_dict.pop("id")
+                annotations.append(
+                    Annotation.from_dict(
+                        {
+                            **annotation_dict,
+                            "image_id": coco_image_id_to_waffle_image_id[coco_image_id],
+                            "annotation_id": annotation_id,
+                            "category_id": coco_cat_id_to_waffle_cat_id[
+                                annotation_dict["category_id"]
+                            ],
+                        },
+                        task=dataset.task,
+                    )
+                )
+                annotation_id += 1
+                if len(annotations) >= ANNOTATION_BATCH_SIZE:
+                    dataset.add_annotations(annotations)
+                    annotations = []
+            if annotations:
+                dataset.add_annotations(annotations)
+
+            num_skipped = len(image_dicts) - len(image_ids)
+            if num_skipped:
+                logger.warning(f"{num_skipped} images of {coco_file} have no annotations.")
+            logger.info(f"Imported {len(image_ids)} images of {coco_file}")
+
+            if set_name:
+                io.save_json(image_ids, dataset.set_dir / f"{set_name}.json", create_directory=True)
+
+
+def from_coco(
+    name: str,
+    task: str,
+    coco_files: list,
+    image_zip_file,
+    root_dir: str = None,
+    status_logger=None,
+) -> Dataset:
+    """Dataset.from_coco reading images from a zip file instead of an extracted directory."""
+    dataset = Dataset.new(name=name, task=task, root_dir=root_dir)
+    try:
+        import_coco(dataset, coco_files, image_zip_file, status_logger=status_logger)
+
+        if len(coco_files) == 2:
+            logger.info("copying val set to test set")
+            io.copy_file(dataset.val_set_file, dataset.test_set_file, create_directory=True)
+
+        io.save_json([], dataset.unlabeled_set_file, create_directory=True)
+    except BaseException as e:
+        # BaseException too, so a stopped import does not leave a half written dataset
+        dataset.delete()
+        raise e
+
+    dataset.create_index()
+    return dataset
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from src.utils.cache import get_cache_dir
+from waffle_hub.dataset import Dataset
+from waffle_utils.file import io
+
+INDEX_FILE_NAME = "dataset_index.json"
+SET_NAMES = ["train", "val", "test", "unlabeled"]
+
+
+def _stat_key(path: Path) -> list:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _subdir_key(directory: Path) -> list:
+    """Number and digest of the mtimes of the subdirectories of a directory.
+
+    Adding or removing a file in a subdirectory changes only the mtime of that
+    subdirectory, not the one of the directory.
+    """
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return None
+    with entries:
+        keys = sorted((entry.name, entry.stat().st_mtime_ns) for entry in entries if entry.is_dir())
+    return [len(keys), hashlib.md5(str(keys).encode()).hexdigest()]
+
+
+def _count_files(directory: Path, depth: int = 1) -> int:
+    if not directory.exists():
+        return 0
+    if depth == 1:
+        return sum(1 for entry in os.scandir(directory) if entry.is_file())
+    return sum(
+        _count_files(Path(entry.path), depth - 1)
+        for entry in os.scandir(directory)
+        if entry.is_dir()
+    )
+
+
+class DatasetCatalog:
+    """Persistent index of dataset metadata.
+
+    Each entry is keyed on the mtimes of the dataset's info file, image/annotation
+    directories (and the per image annotation directories) and set files, and only
+    datasets whose files changed are read again.
+    The index is saved under the dataset root dir so it survives restarts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}  # root_dir: {name: {"signature", "info", "stats"}}
+
+    @staticmethod
+    def get_signature(dataset_dir: Path) -> list:
+        return [
+            _stat_key(dataset_dir / Dataset.DATASET_INFO_FILE_NAME),
+            _stat_key(dataset_dir / Dataset.IMAGE_DIR),
+            _stat_key(dataset_dir / Dataset.ANNOTATION_DIR),
+            _subdir_key(dataset_dir / Dataset.ANNOTATION_DIR),
+            _stat_key(dataset_dir / Dataset.CATEGORY_DIR),
+            _stat_key(dataset_dir / Dataset.SET_DIR),
+        ] + [_stat_key(dataset_dir / Dataset.SET_DIR / f"{name}.json") for name in SET_NAMES]
+
+    @staticmethod
+    def _read_entry(dataset_dir: Path) -> dict:
+        info = io.load_yaml(dataset_dir / Dataset.DATASET_INFO_FILE_NAME)
+        info["categories"] = info.get("categories", None) or [
+            io.load_json(f)
+            for f in sorted(
+                (dataset_dir / Dataset.CATEGORY_DIR).glob("*.json"), key=lambda f: int(f.stem)
+            )
+        ]
+
+        split_sizes = {}
+        for set_name in SET_NAMES:
+            set_file = dataset_dir / Dataset.SET_DIR / f"{set_name}.json"
+            if set_file.exists():
+                split_sizes[set_name] = len(io.load_json(set_file))
+
+        return {
+            "info": info,
+            "stats": {
+                "num_images": _count_files(dataset_dir / Dataset.IMAGE_DIR),
+                "num_annotations": _count_files(dataset_dir / Dataset.ANNOTATION_DIR, depth=2),
+                "split_sizes": split_sizes,
+            },
+        }
+
+    def _index_file(self, root_dir: Path) -> Path:
+        return get_cache_dir(root_dir) / INDEX_FILE_NAME
+
+    def _get_index(self, root_dir: Path) -> dict:
+        if root_dir not in self._indexes:
+            index_file = self._index_file(root_dir)
+            try:
+                self._indexes[root_dir] = io.load_json(index_file) if index_file.exists() else {}
+            except ValueError:
+                self._indexes[root_dir] = {}
+        return self._indexes[root_dir]
+
+    def _refresh(self, index: dict, dataset_dir: Path) -> tuple[dict, bool]:
+        """Entry of a dataset, read again if its files changed.
+
+        Returns:
+            tuple: entry (None if it is not a dataset) and whether the index changed.
+        """
+        signature = self.get_signature(dataset_dir)
+        if signature[0] is None:
+            return None, index.pop(dataset_dir.name, None) is not None
+        entry = index.get(dataset_dir.name, None)
+        if entry is not None and entry["signature"] == signature:
+            return entry, False
+        try:
+            entry = {"signature": signature, **self._read_entry(dataset_dir)}
+        except Exception:
+            return None, index.pop(dataset_dir.name, None) is not None
+        index[dataset_dir.name] = entry
+        return entry, True
+
+    def scan(self, root_dir) -> list[dict]:
+        """Get dataset entries in root_dir, refreshing only the changed datasets.
+
+        Returns:
+            list[dict]: {"name", "info", "stats"} sorted by name
+        """
+        root_dir = Dataset.parse_root_dir(root_dir)
+        if not root_dir.exists():
+            return []
+
+        with self._lock:
+            index = self._get_index(root_dir)
+            changed = False
+            names = set()
+            for dataset_dir in root_dir.iterdir():
+                if not dataset_dir.is_dir():
+                    continue
+                entry, entry_changed = self._refresh(index, dataset_dir)
+                changed |= entry_changed
+                if entry is not None:
+                    names.add(dataset_dir.name)
+
+            for name in set(index.keys()) - names:
+                del index[name]
+                changed = True
+
+            if changed:
+                io.save_json(index, self._index_file(root_dir))
+
+            return [
+                {"name": name, "info": index[name]["info"], "stats": index[name]["stats"]}
+                for name in sorted(names)
+            ]
+
+    def get(self, name: str, root_dir) -> dict:
+        """Get the entry of one dataset, refreshing only that dataset."""
+        root_dir = Dataset.parse_root_dir(root_dir)
+        dataset_dir = root_dir / name
+        if not dataset_dir.is_dir():
+            return None
+
+        with self._lock:
+            index = self._get_index(root_dir)
+            entry, changed = self._refresh(index, dataset_dir)
+            if changed:
+                io.save_json(index, self._index_file(root_dir))
+            if entry is None:
+                return None
+            return {"name": name, "info": entry["info"], "stats": entry["stats"]}
+
+
+dataset_catalog = DatasetCatalog()
@@ -0,0 +1,86 @@
+import logging
+import os
+import shutil
+import zipfile
+from pathlib import Path
+
+from src.utils.cache import get_cache_dir
+from waffle_hub import EXPORT_MAP
+from waffle_hub.dataset import Dataset
+
+from .dataset_store import get_dataset_version
+
+logger = logging.getLogger(__name__)
+
+# already compressed files, deflating them only costs cpu
+STORED_SUFFIXES = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".zip", ".gz", ".mp4"}
+COMPRESS_LEVEL = 6
+# save the status every this many files
+STATUS_INTERVAL = 256
+
+
+def _get_archive_dir(dataset: Dataset) -> Path:
+    return get_cache_dir(dataset.root_dir, "exports", dataset.name)
+
+
+def get_archive_file(dataset: Dataset, data_type: str) -> Path:
+    """Archive of an export, named after the dataset version so edits make a new one."""
+    version = get_dataset_version(dataset.dataset_dir)
+    return _get_archive_dir(dataset) / f"{EXPORT_MAP[data_type.upper()]}-{version}.zip"
+
+
+def zip_dir(src_dir, zip_file, status_logger=None) -> Path:
+    """Zip a directory file by file into zip_file.
+
+    Files are copied into the archive in chunks by zipfile, so memory does not grow with
+    the size of the dataset. Images are stored as they are and other files are deflated.
+    The archive is written to a temporary file first, so zip_file is always complete.
+    """
+    src_dir, zip_file = Path(src_dir), Path(zip_file)
+    files = sorted(path for path in src_dir.rglob("*") if path.is_file())
+    if status_logger:
+        status_logger.set_total_step(len(files))
+
+    tmp_file = zip_file.with_name(f".tmp-{zip_file.name}")
+    with zipfile.ZipFile(tmp_file, "w", allowZip64=True) as zf:
+        for step, path in enumerate(files, start=1):
+            if path.suffix.lower() in STORED_SUFFIXES:
+                zf.write(path, path.relative_to(src_dir), compress_type=zipfile.ZIP_STORED)
+            else:
+                zf.write(
+                    path,
+                    path.relative_to(src_dir),
+                    compress_type=zipfile.ZIP_DEFLATED,
+                    compresslevel=COMPRESS_LEVEL,
+                )
+            if status_logger and (step % STATUS_INTERVAL == 0 or step == len(files)):
+                status_logger.set_current_step(step)
+    os.replace(tmp_file, zip_file)
+    return zip_file
+
+
+def export_archive(dataset: Dataset, data_type: str, status_logger=None) -> Path:
+    """Export a dataset and zip it, reusing the archive of the same dataset version.
+
+    Returns:
+        Path: zip file of the export.
+    """
+    archive_file = get_archive_file(dataset, data_type)
+    if archive_file.exists():
+        logger.info(f"Reusing {archive_file}")
+        return archive_file
+
+    export_dir = dataset.export(data_type=data_type)
+    zip_dir(export_dir, archive_file, status_logger=status_logger)
+
+    # archives of older versions are never served again
+    prefix = f"{EXPORT_MAP[data_type.upper()]}-"
+    for old_file in archive_file.parent.glob(f"{prefix}*.zip"):
+        if old_file != archive_file:
+            old_file.unlink(missing_ok=True)
+    return archive_file
+
+
+def delete_archives(dataset_name: str, root_dir: str = None):
+    root_dir = Dataset.parse_root_dir(root_dir)
+    shutil.rmtree(get_cache_dir(root_dir, "exports", dataset_name), ignore_errors=True)
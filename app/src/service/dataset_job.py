@@ -0,0 +1,233 @@
+import enum
+import logging
+import shutil
+import signal
+from dataclasses import dataclass
+from pathlib import Path
+
+from src.schema.run import RunType
+from src.utils.cache import get_cache_dir
+from waffle_hub import BaseEnum
+from waffle_hub.dataset import Dataset
+from waffle_hub.schema.running_status import BaseRunningStatus
+from waffle_hub.utils.running_status_logger import RunningStatusLogger
+
+from . import waffle_dataset as wd
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetJobStatusDesc(BaseEnum):
+    INIT = enum.auto()
+    RUNNING = enum.auto()
+    SUCCESS = enum.auto()
+    FAILED = enum.auto()
+    STOPPED = enum.auto()
+
+
+@dataclass
+class DatasetJobStatus(BaseRunningStatus[DatasetJobStatusDesc]):
+    pass
+
+
+class DatasetJobStatusLogger(RunningStatusLogger):
+    def __init__(self, save_path: Path):
+        super().__init__(DatasetJobStatus(), save_path)
+        self.set_init()
+
+    def set_init(self):
+        self.clear_error()
+        self.clear_step()
+        self.set_status(DatasetJobStatusDesc.INIT)
+
+    def set_failed(self, e):
+        self.set_error(e)
+        self.set_status(DatasetJobStatusDesc.FAILED)
+
+    def set_success(self):
+        self.clear_error()
+        self.running_status.step = self.running_status.total_step
+        self.set_status(DatasetJobStatusDesc.SUCCESS)
+
+    def set_running(self):
+        self.set_status(DatasetJobStatusDesc.RUNNING)
+
+    def set_stopped(self, e):
+        self.set_error(e)
+        self.set_status(DatasetJobStatusDesc.STOPPED)
+
+    def set_progress(self, step: int, *args):
+        self.set_current_step(step)
+
+
+class DatasetJobStopped(Exception):
+    pass
+
+
+def _raise_stopped(signum, frame):
+    raise DatasetJobStopped("Stopped by user.")
+
+
+def get_status_file(run_type: str, dataset_name: str, root_dir: str = None) -> Path:
+    root_dir = Dataset.parse_root_dir(root_dir)
+    return get_cache_dir(root_dir, "running_status") / f"{dataset_name}_{run_type}_status.json"
+
+
+def get_status(run_type: str, dataset_name: str, root_dir: str = None) -> DatasetJobStatus:
+    status_file = get_status_file(run_type, dataset_name, root_dir=root_dir)
+    return DatasetJobStatus.load(status_file) if status_file.exists() else None
+
+
+def get_run_name(run_type: str, dataset_name: str) -> str:
+    return f"{dataset_name}_{run_type}"
+
+
+def _run_job(run_type: str, dataset_name: str, root_dir: str, job, cleanup=None):
+    """Run job(status_logger) with a running status like the hub runs.
+
+    RunService.kill terminates the process, which is turned into DatasetJobStopped so the
+    job can clean up after itself and the status ends as STOPPED.
+    """
+    signal.signal(signal.SIGTERM, _raise_stopped)
+    status_logger = DatasetJobStatusLogger(get_status_file(run_type, dataset_name, root_dir))
+    status_logger.set_total_step(1)
+    status_logger.set_running()
+    try:
+        job(status_logger)
+    except BaseException as e:
+        if cleanup is not None:
+            cleanup()
+        if isinstance(e, (DatasetJobStopped, KeyboardInterrupt)):
+            status_logger.set_stopped(e)
+        else:
+            status_logger.set_failed(e)
+        raise e
+    status_logger.set_success()
+
+
+def _delete_new_dataset(dataset_name: str, root_dir: str):
+    """Cleanup of imports and merges, which must not leave a half written dataset."""
+    dataset_dir = Dataset.parse_root_dir(root_dir) / dataset_name
+    existed = dataset_dir.exists()
+
+    def cleanup():
+        if not existed and dataset_dir.exists():
+            shutil.rmtree(dataset_dir, ignore_errors=True)
+
+    return cleanup
+
+
+def import_coco(
+    dataset_name: str,
+    root_dir: str,
+    task: str,
+    image_zip_file: str,
+    json_files: list[str],
+    staging_dir: str = None,
+):
+    try:
+        _run_job(
+            RunType.DATASET_IMPORT,
+            dataset_name,
+            root_dir,
+            lambda status_logger: wd.from_coco(
+                dataset_name=dataset_name,
+                root_dir=root_dir,
+                task=task,
+                image_zip_file=image_zip_file,
+                json_files=json_files,
+                status_logger=status_logger,
+            ),
+            cleanup=_delete_new_dataset(dataset_name, root_dir),
+        )
+    finally:
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def import_yolo(
+    dataset_name: str, root_dir: str, task: str, yolo_root_zip_file: str, staging_dir: str = None
+):
+    try:
+        _run_job(
+            RunType.DATASET_IMPORT,
+            dataset_name,
+            root_dir,
+            lambda status_logger: wd.from_yolo(
+                dataset_name=dataset_name,
+                root_dir=root_dir,
+                task=task,
+                yolo_root_zip_file=yolo_root_zip_file,
+                status_logger=status_logger,
+            ),
+            cleanup=_delete_new_dataset(dataset_name, root_dir),
+        )
+    finally:
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def split(
+    dataset_name: str,
+    root_dir: str,
+    train_ratio: float,
+    val_ratio: float,
+    test_ratio: float,
+    seed: int = 0,
+    stratify: bool = True,
+    group_by: str = None,
+    incremental: bool = False,
+):
+    _run_job(
+        RunType.DATASET_SPLIT,
+        dataset_name,
+        root_dir,
+        lambda status_logger: wd.split(
+            dataset_name=dataset_name,
+            train_ratio=train_ratio,
+            val_ratio=val_ratio,
+            test_ratio=test_ratio,
+            root_dir=root_dir,
+            seed=seed,
+            stratify=stratify,
+            group_by=group_by,
+            incremental=incremental,
+        ),
+    )
+
+
+def export(dataset_name: str, root_dir: str, data_type: str):
+    _run_job(
+        RunType.DATASET_EXPORT,
+        dataset_name,
+        root_dir,
+        lambda status_logger: wd.export_archive(
+            dataset_name=dataset_name,
+            data_type=data_type,
+            root_dir=root_dir,
+            status_logger=status_logger,
+        ),
+    )
+
+
+def merge(
+    dataset_name: str,
+    root_dir: str,
+    select_dataset_names: list[str],
+    task: str,
+    deduplicate: bool = True,
+):
+    _run_job(
+        RunType.DATASET_MERGE,
+        dataset_name,
+        root_dir,
+        lambda status_logger: wd.merge(
+            new_dataset_name=dataset_name,
+            select_dataset_names=select_dataset_names,
+            task=task,
+            root_dir=root_dir,
+            deduplicate=deduplicate,
+            status_logger=status_logger,
+        ),
+        cleanup=_delete_new_dataset(dataset_name, root_dir),
+    )
@@ -0,0 +1,277 @@
+import copy
+import errno
+import logging
+import os
+import shutil
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+from waffle_hub import TaskType
+from waffle_hub.dataset import Dataset
+from waffle_utils.file import io
+
+from .image_ingest import hash_file
+
+logger = logging.getLogger(__name__)
+
+# ioctl of linux to share the extents of a file (btrfs, xfs)
+FICLONE = 0x40049409
+# annotations written per add_annotations call, which reads the category files each time
+ANNOTATION_BATCH_SIZE = 1000
+# save the status every this many images
+STATUS_INTERVAL = 256
+
+
+def _reflink(src: Path, dst: Path):
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            dst.unlink(missing_ok=True)
+            raise
+
+
+def link_file(src, dst) -> str:
+    """Place src at dst without copying its data if the file system allows it.
+
+    Tries a hard link, then a reflink (copy on write clone) and copies as a last resort.
+    Raw images are never modified in place, so sharing them between datasets is safe.
+
+    Returns:
+        str: "hardlink", "reflink" or "copy".
+    """
+    src, dst = Path(src), Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise e
+    try:
+        _reflink(src, dst)
+        return "reflink"
+    except (OSError, ImportError):
+        pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+def _hash_files(paths: list[str], num_workers: int = None, callback=None) -> list[str]:
+    hashes = []
+    num_workers = num_workers or os.cpu_count()
+    with ProcessPoolExecutor(num_workers, mp_context=get_context("spawn")) as executor:
+        for step, h in enumerate(executor.map(hash_file, paths, chunksize=64), start=1):
+            hashes.append(h)
+            if callback and (step % STATUS_INTERVAL == 0 or step == len(paths)):
+                callback(step)
+    return hashes
+
+
+def _is_duplicate(annotation, annotations: list) -> bool:
+    try:
+        return annotation in annotations
+    except NotImplementedError:  # Annotation.__eq__ of text recognition and semantic seg.
+        return False
+
+
+def _remap(ids: np.ndarray, src_ids: np.ndarray, dst_ids: np.ndarray) -> np.ndarray:
+    """Map ids through the pairs (src_ids, dst_ids) with one lookup table."""
+    size = max(int(src_ids.max(initial=0)), int(ids.max(initial=0))) + 1
+    table = np.zeros(size, dtype=np.int64)
+    table[src_ids] = dst_ids
+    return table[ids]
+
+
+def merge(
+    name: str,
+    root_dir: str,
+    src_names: list[str],
+    src_root_dirs,
+    task: str,
+    status_logger=None,
+    num_workers: int = None,
+) -> tuple[Dataset, dict]:
+    """Dataset.merge without copying images.
+
+    Images are identified by the hash of their content instead of their file name, so an
+    image found in several sources is stored and annotated once, and raw images are hard
+    linked (or reflinked, or copied) from the sources. Category, image and annotation ids
+    are remapped with lookup tables over id arrays. An image whose file name is taken by
+    another image is stored as "{source name}/{file name}".
+
+    Args:
+        name (str): new dataset name.
+        root_dir (str): new dataset root directory.
+        src_names (list[str]): source dataset names.
+        src_root_dirs (Union[str, list[str]]): source dataset root directories.
+        task (str): dataset task.
+        status_logger (RunningStatusLogger, optional): progress of hashing and then placing
+            the images of all sources.
+        num_workers (int, optional): processes hashing images. Defaults to the number of cpus.
+
+    Returns:
+        tuple[Dataset, dict]: merged dataset and a report with the number of images,
+            duplicates, bytes by link method, bytes saved and throughput.
+    """
+    if isinstance(src_root_dirs, (str, Path)):
+        src_root_dirs = [src_root_dirs] * len(src_names)
+    if len(src_names) != len(src_root_dirs):
+        raise ValueError("Length of src_names and src_root_dirs should be same.")
+    task = task.upper()
+    if task not in [k for k in TaskType]:
+        raise ValueError(f"task should be one of {[k for k in TaskType]}")
+
+    start = time.perf_counter()
+    src_datasets = []
+    for src_name, src_root_dir in zip(src_names, src_root_dirs):
+        src_ds = Dataset.load(src_name, src_root_dir)
+        if src_ds.task != task:
+            raise ValueError(f"Task of {src_ds.name} is {src_ds.task}. It should be {task}.")
+        src_datasets.append(src_ds)
+
+    # hash the images of every source at once, so the pool is busy across sources
+    src_images = [list(src_ds.image_dict.values()) for src_ds in src_datasets]
+    paths = [
+        str(src_ds.raw_image_dir / image.file_name)
+        for src_ds, images in zip(src_datasets, src_images)
+        for image in images
+    ]
+    if status_logger:
+        status_logger.set_total_step(2 * len(paths))
+    hashes = _hash_files(
+        paths,
+        num_workers=num_workers,
+        callback=status_logger.set_current_step if status_logger else None,
+    )
+
+    merged_ds = Dataset.new(name=name, root_dir=root_dir, task=task)
+    try:
+        category_name_to_id = {}
+        hash_to_image_id = {}
+        file_names = set()
+        # merged annotations of the images found more than once, to skip the same ones
+        repeated_hashes = {h for h, count in Counter(hashes).items() if count > 1}
+        image_id_to_annotations = {}
+        duplicate_image_ids = set()
+        num_annotations = 0
+        report = {"num_images": 0, "num_duplicates": 0, "num_annotations": 0}
+        bytes_by_method = {"hardlink": 0, "reflink": 0, "copy": 0, "duplicate": 0}
+
+        offset = 0
+        for src_ds, images in zip(src_datasets, src_images):
+            # categories by name
+            src_categories = src_ds.get_categories()
+            for category in src_categories:
+                if category.name not in category_name_to_id:
+                    new_category = copy.deepcopy(category)
+                    new_category.category_id = len(category_name_to_id) + 1
+                    category_name_to_id[category.name] = new_category.category_id
+                    merged_ds.add_categories([new_category])
+
+            # images by content
+            new_image_ids = np.empty(len(images), dtype=np.int64)
+            for i, image in enumerate(images):
+                step = offset + i
+                h = hashes[step]
+                size = os.path.getsize(paths[step])
+                if h in hash_to_image_id:
+                    new_image_ids[i] = hash_to_image_id[h]
+                    duplicate_image_ids.add(hash_to_image_id[h])
+                    bytes_by_method["duplicate"] += size
+                    report["num_duplicates"] += 1
+                else:
+                    new_image = copy.deepcopy(image)
+                    new_image.image_id = len(hash_to_image_id) + 1
+                    if new_image.file_name in file_names:
+                        new_image.file_name = f"{src_ds.name}/{image.file_name}"
+                    file_names.add(new_image.file_name)
+                    hash_to_image_id[h] = new_image_ids[i] = new_image.image_id
+                    if h in repeated_hashes:
+                        image_id_to_annotations[new_image.image_id] = []
+
+                    method = link_file(paths[step], merged_ds.raw_image_dir / new_image.file_name)
+                    bytes_by_method[method] += size
+                    merged_ds.add_images([new_image])
+
+                if status_logger and ((step + 1) % STATUS_INTERVAL == 0):
+                    status_logger.set_current_step(len(paths) + step + 1)
+            offset += len(images)
+
+            # annotations, with their ids remapped as arrays
+            annotations = list(src_ds.annotation_dict.values())
+            if not annotations:
+                continue
+            new_category_ids = _remap(
+                np.array([annotation.category_id for annotation in annotations], dtype=np.int64),
+                np.array([category.category_id for category in src_categories], dtype=np.int64),
+                np.array(
+                    [category_name_to_id[category.name] for category in src_categories],
+                    dtype=np.int64,
+                ),
+            )
+            annotation_image_ids = _remap(
+                np.array([annotation.image_id for annotation in annotations], dtype=np.int64),
+                np.array([image.image_id for image in images], dtype=np.int64),
+                new_image_ids,
+            )
+
+            batch = []
+            for annotation, image_id, category_id in zip(
+                annotations, annotation_image_ids.tolist(), new_category_ids.tolist()
+            ):
+                new_annotation = copy.deepcopy(annotation)
+                new_annotation.category_id = category_id
+                if image_id in image_id_to_annotations:
+                    # an image seen before, keep only the annotations it does not have yet
+                    if image_id in duplicate_image_ids and _is_duplicate(
+                        new_annotation, image_id_to_annotations[image_id]
+                    ):
+                        continue
+                    image_id_to_annotations[image_id].append(new_annotation)
+
+                num_annotations += 1
+                new_annotation.image_id = image_id
+                new_annotation.annotation_id = num_annotations
+                batch.append(new_annotation)
+                if len(batch) >= ANNOTATION_BATCH_SIZE:
+                    merged_ds.add_annotations(batch)
+                    batch = []
+            if batch:
+                merged_ds.add_annotations(batch)
+
+        elapsed = time.perf_counter() - start
+        total_bytes = sum(bytes_by_method.values())
+        report.update(
+            {
+                "num_images": len(hash_to_image_id),
+                "num_annotations": num_annotations,
+                "bytes": bytes_by_method,
+                "bytes_saved": total_bytes - bytes_by_method["copy"],
+                "elapsed": elapsed,
+                "images_per_second": len(paths) / elapsed if elapsed else None,
+                "mb_per_second": total_bytes / 1024**2 / elapsed if elapsed else None,
+            }
+        )
+        logger.info(
+            f"Merged {len(paths)} images into {report['num_images']} in {elapsed:.1f} s, "
+            f"saved {report['bytes_saved'] / 1024**2:.1f} MB"
+        )
+    except BaseException as e:
+        merged_ds.delete()
+        raise e
+
+    merged_ds = Dataset.load(name, root_dir)
+    merged_ds.create_index()
+    return merged_ds, report
+
+
+def save_report(report: dict, report_file):
+    io.save_json(report, report_file, create_directory=True)
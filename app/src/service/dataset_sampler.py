@@ -0,0 +1,137 @@
+import itertools
+import threading
+
+import numpy as np
+from src.utils.cache import LRUCache
+
+from .dataset_store import SET_BITS, ColumnStore
+
+SAMPLE_METHODS = ["random", "stratified", "hard"]
+
+# pools up to this size are shuffled at once, bigger ones are drawn by rejection
+PERMUTATION_SIZE = 65536
+REJECTION_BATCH_SIZE = 1024
+
+
+def _iter_shuffled(size: int, rng: np.random.Generator):
+    """Yield range(size) in random order, drawing only as many numbers as are consumed.
+
+    Big ranges are drawn by rejection until half of them are out, then the rest is
+    shuffled, so the first k numbers cost O(k) and the whole range O(size).
+    """
+    if size <= PERMUTATION_SIZE:
+        yield from rng.permutation(size).tolist()
+        return
+    seen = set()
+    while len(seen) < size // 2:
+        for i in rng.integers(0, size, REJECTION_BATCH_SIZE).tolist():
+            if i not in seen:
+                seen.add(i)
+                yield i
+    rest = np.ones(size, dtype=bool)
+    rest[np.fromiter(seen, dtype=np.int64, count=len(seen))] = False
+    yield from rng.permutation(np.flatnonzero(rest)).tolist()
+
+
+class SampleStream:
+    """Image indexes of a split in the order of a sampling method, generated lazily.
+
+    The order is fixed by (store, method, set_name, seed), so page n of a stream is the
+    same on every rerun, and only the pages asked for are generated.
+
+    Args:
+        store (ColumnStore): column store of the dataset version.
+        method (str): "random" (uniform), "stratified" (round robin over categories, so
+            rare categories show up as often as common ones) or "hard" (by
+            image_difficulty of the store: many, small and rare objects first).
+        set_name (str): "total", "train", "val" or "test".
+        seed (int): random seed. "hard" uses it only to break ties.
+    """
+
+    def __init__(self, store: ColumnStore, method: str, set_name: str, seed: int):
+        if method not in SAMPLE_METHODS:
+            raise ValueError(f"method should be one of {SAMPLE_METHODS}")
+        self.store = store
+        self.set_name = set_name
+        self.rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._indexes = []
+        self._iterator = getattr(self, f"_iter_{method}")()
+
+    def _is_member(self, index: int) -> bool:
+        if self.set_name == "total":
+            return True
+        return bool(self.store.columns["image_split"][index] & SET_BITS[self.set_name])
+
+    def _iter_random(self):
+        for index in _iter_shuffled(self.store.num_images, self.rng):
+            if self._is_member(index):
+                yield index
+
+    def _iter_stratified(self):
+        offsets = self.store.columns["category_image_offsets"]
+        category_images = self.store.columns["category_image_index"]
+        iterators = [
+            (int(offsets[i]), _iter_shuffled(int(offsets[i + 1] - offsets[i]), self.rng))
+            for i in self.rng.permutation(len(offsets) - 1).tolist()
+        ]
+        seen = set()
+        while iterators:
+            alive = []
+            for start, iterator in iterators:
+                # next image of this category that is in the split and not sampled yet
+                for position in iterator:
+                    index = int(category_images[start + position])
+                    if index not in seen and self._is_member(index):
+                        seen.add(index)
+                        alive.append((start, iterator))
+                        yield index
+                        break
+            iterators = alive
+
+    def _iter_hard(self):
+        order = self.store.columns["image_hard_order"]
+        difficulty = self.store.columns["image_difficulty"]
+        for start in range(0, len(order), REJECTION_BATCH_SIZE):
+            block = np.asarray(order[start : start + REJECTION_BATCH_SIZE])
+            # shuffle images of the same difficulty, keeping the order by difficulty
+            block = block[np.lexsort((self.rng.random(len(block)), -difficulty[block]))]
+            for index in block.tolist():
+                if self._is_member(index):
+                    yield index
+
+    def get(self, offset: int, count: int) -> np.ndarray:
+        """Image indexes offset ~ offset + count of the stream (fewer at its end)."""
+        with self._lock:
+            missing = offset + count - len(self._indexes)
+            if missing > 0:
+                self._indexes.extend(itertools.islice(self._iterator, missing))
+            return np.array(self._indexes[offset : offset + count], dtype=np.int64)
+
+
+class DatasetSampler:
+    """Sample streams by (store, method, set_name, seed), the least recently used dropped."""
+
+    def __init__(self, max_streams: int = 64):
+        self._streams = LRUCache(max_streams)
+
+    def sample(
+        self,
+        store: ColumnStore,
+        method: str = "random",
+        set_name: str = "total",
+        seed: int = 0,
+        offset: int = 0,
+        count: int = 100,
+    ) -> np.ndarray:
+        """Image ids offset ~ offset + count of a sample.
+
+        The cost is proportional to offset + count, not to the number of images, and the
+        same arguments always give the same ids.
+        """
+        key = (str(store.store_dir), method, set_name, seed)
+        stream = self._streams.get_or_load(key, lambda: SampleStream(store, method, set_name, seed))
+        return store.columns["image_id"][stream.get(offset, count)]
+
+
+dataset_sampler = DatasetSampler()
@@ -0,0 +1,258 @@
+import hashlib
+import logging
+from pathlib import Path
+
+import numpy as np
+from waffle_hub.dataset import Dataset
+from waffle_utils.file import io
+
+from .dataset_store import SET_BITS
+
+logger = logging.getLogger(__name__)
+
+SET_NAMES = ["train", "val", "test"]
+GROUP_BY = [None, "directory"]
+
+UNASSIGNED = -1
+NO_CATEGORY = np.iinfo(np.int64).max  # stratum key of images without annotations
+
+
+def _mix(x: np.ndarray, seed: int) -> np.ndarray:
+    """splitmix64 of x + seed, a stable pseudo random key per id."""
+    with np.errstate(over="ignore"):
+        z = x.astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+def _hash_strings(strings) -> np.ndarray:
+    """Stable 64 bit ids of strings, unlike python's hash they do not change between runs."""
+    return np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little")
+            for s in strings
+        ),
+        dtype=np.uint64,
+    )
+
+
+def check_ratios(train_ratio: float, val_ratio: float, test_ratio: float) -> np.ndarray:
+    """Validate ratios like Dataset.split.
+
+    Returns:
+        np.ndarray: [train, val, test] ratios.
+    """
+    if train_ratio <= 0.0 or train_ratio >= 1.0:
+        raise ValueError(
+            "train_ratio must be between 0.0 and 1.0\n" f"given train_ratio: {train_ratio}"
+        )
+    if val_ratio == 0.0 and test_ratio == 0.0:
+        val_ratio = 1 - train_ratio
+    if not np.isclose(train_ratio + val_ratio + test_ratio, 1.0):
+        raise ValueError(
+            "train_ratio + val_ratio + test_ratio must be 1.0\n"
+            f"given train_ratio: {train_ratio}, val_ratio: {val_ratio}, test_ratio: {test_ratio}"
+        )
+    return np.array([train_ratio, val_ratio, test_ratio], dtype=np.float64)
+
+
+def _get_split_sizes(num: np.ndarray, ratios: np.ndarray) -> np.ndarray:
+    """Number of units of each split per stratum, like Dataset.split.
+
+    val and test get at least one unit of a stratum when their ratio is not 0 and the
+    stratum is big enough, train gets the rest.
+
+    Returns:
+        np.ndarray: [num strata, 3] sizes.
+    """
+    sizes = np.zeros((len(num), 3), dtype=np.int64)
+    for k in (1, 2):
+        if ratios[k] > 0:
+            sizes[:, k] = np.where(num > k, np.maximum((num * ratios[k]).astype(np.int64), 1), 0)
+    sizes[:, 0] = num - sizes[:, 1] - sizes[:, 2]
+    return sizes
+
+
+def get_image_strata_keys(columns: dict[str, np.ndarray]) -> tuple[np.ndarray, int]:
+    """Stratum key of each image: frequency * K + index of its rarest category.
+
+    The min of the keys of several images is the key of their rarest category, so groups
+    take the min of the keys of their images before turning them into strata.
+
+    Returns:
+        tuple: [num images] keys (NO_CATEGORY for images without annotations) and K.
+    """
+    num_images = len(columns["image_id"])
+    image_index = columns["annotation_image_index"]
+    category_id = columns["annotation_category_id"]
+    if len(category_id) == 0:
+        return np.full(num_images, NO_CATEGORY, dtype=np.int64), 0
+
+    # number of images per category
+    _, category_index = np.unique(category_id, return_inverse=True)
+    pairs = np.unique(category_index.astype(np.int64) * num_images + image_index)
+    frequency = np.bincount(pairs // num_images)
+
+    k = len(frequency)
+    key = frequency[category_index].astype(np.int64) * k + category_index
+    keys = np.full(num_images, NO_CATEGORY, dtype=np.int64)
+    np.minimum.at(keys, image_index, key)
+    return keys, k
+
+
+def get_strata(keys: np.ndarray, k: int) -> np.ndarray:
+    """Category index of stratum keys, K (a stratum of its own) for NO_CATEGORY."""
+    if k == 0:
+        return np.zeros(len(keys), dtype=np.int64)
+    return np.where(keys == NO_CATEGORY, k, keys % k)
+
+
+def assign_splits(
+    unit_keys: np.ndarray,
+    unit_strata: np.ndarray,
+    ratios: np.ndarray,
+    seed: int = 0,
+    assigned: np.ndarray = None,
+) -> np.ndarray:
+    """Assign units (images or groups) to train/val/test per stratum.
+
+    The order of the units of a stratum is given by a seeded hash of their keys, so the
+    result only depends on the keys and the seed. Units already assigned keep their split
+    and the new ones fill each stratum up to its target sizes.
+
+    Args:
+        unit_keys (np.ndarray): stable integer key of each unit (image id or group hash).
+        unit_strata (np.ndarray): stratum of each unit.
+        ratios (np.ndarray): [train, val, test] ratios.
+        seed (int, optional): random seed.
+        assigned (np.ndarray, optional): current split index of each unit, UNASSIGNED for
+            new units. Defaults to all new.
+
+    Returns:
+        np.ndarray: split index (0: train, 1: val, 2: test) of each unit.
+    """
+    num_units = len(unit_keys)
+    if assigned is None:
+        assigned = np.full(num_units, UNASSIGNED, dtype=np.int64)
+    _, strata = np.unique(unit_strata, return_inverse=True)
+    num_strata = int(strata.max(initial=-1)) + 1
+
+    # target sizes over all units minus what the stratum already has
+    existing = np.zeros((num_strata, 3), dtype=np.int64)
+    is_assigned = assigned != UNASSIGNED
+    np.add.at(existing, (strata[is_assigned], assigned[is_assigned]), 1)
+    target = _get_split_sizes(np.bincount(strata, minlength=num_strata), ratios)
+    needed = np.maximum(target - existing, 0)
+
+    new = np.flatnonzero(~is_assigned)
+    new_strata = strata[new]
+    num_new = np.bincount(new_strata, minlength=num_strata)
+    sizes = np.zeros((num_strata, 3), dtype=np.int64)
+    sizes[:, 1] = np.minimum(needed[:, 1], num_new)
+    sizes[:, 2] = np.minimum(needed[:, 2], num_new - sizes[:, 1])
+    sizes[:, 0] = num_new - sizes[:, 1] - sizes[:, 2]
+
+    # rank of each new unit in its stratum, in seeded hash order
+    order = np.lexsort((_mix(unit_keys[new], seed), new_strata))
+    sorted_strata = new_strata[order]
+    starts = np.concatenate([[0], np.cumsum(num_new)[:-1]])
+    rank = np.arange(len(order)) - starts[sorted_strata]
+
+    bounds = np.cumsum(sizes, axis=1)
+    split = (rank >= bounds[sorted_strata, 0]).astype(np.int64) + (rank >= bounds[sorted_strata, 1])
+    result = assigned.copy()
+    result[new[order]] = split
+    return result
+
+
+def get_groups(dataset: Dataset, image_id: np.ndarray, group_by: str) -> np.ndarray:
+    """Stable 64 bit group key of each image."""
+    if group_by == "directory":
+        image_dict = dataset.image_dict
+        return _hash_strings(
+            str(Path(image_dict[int(i)].file_name).parent) for i in image_id.tolist()
+        )
+    raise ValueError(f"group_by should be one of {GROUP_BY}")
+
+
+def split(
+    dataset: Dataset,
+    columns: dict[str, np.ndarray],
+    train_ratio: float,
+    val_ratio: float = 0.0,
+    test_ratio: float = 0.0,
+    seed: int = 0,
+    stratify: bool = True,
+    group_by: str = None,
+    incremental: bool = False,
+) -> dict:
+    """Split the labeled images of a dataset and save the set files.
+
+    Args:
+        dataset (Dataset): dataset to split.
+        columns (dict[str, np.ndarray]): dataset_store.build_columns of the dataset.
+        train_ratio (float): train ratio (0 ~ 1).
+        val_ratio (float, optional): val ratio (0 ~ 1).
+        test_ratio (float, optional): test ratio (0 ~ 1).
+        seed (int, optional): random seed. Same seed, same split.
+        stratify (bool, optional): keep the ratios per category (by the rarest category of
+            each image) instead of over the whole dataset.
+        group_by (str, optional): images of a group go to the same split. "directory"
+            groups images by the directory of their file name. Defaults to None.
+        incremental (bool, optional): keep the split of images already in a set and only
+            assign the new ones.
+
+    Returns:
+        dict: number of images of each set and of newly assigned images.
+    """
+    ratios = check_ratios(train_ratio, val_ratio, test_ratio)
+    image_id = columns["image_id"]
+    if len(image_id) == 0:
+        raise ValueError("Dataset has no labeled images to split.")
+
+    image_assigned = np.full(len(image_id), UNASSIGNED, dtype=np.int64)
+    if incremental:
+        # an image found in several sets keeps the first of them
+        for k in reversed(range(len(SET_NAMES))):
+            in_set = (columns["image_split"] & SET_BITS[SET_NAMES[k]]) != 0
+            image_assigned[in_set] = k
+    if stratify:
+        image_strata_keys, num_categories = get_image_strata_keys(columns)
+    else:
+        image_strata_keys, num_categories = np.zeros(len(image_id), dtype=np.int64), 0
+
+    if group_by is None:
+        image_strata = get_strata(image_strata_keys, num_categories)
+        image_split = assign_splits(
+            image_id, image_strata, ratios, seed=seed, assigned=image_assigned
+        )
+    else:
+        group_keys, image_group = np.unique(
+            get_groups(dataset, image_id, group_by), return_inverse=True
+        )
+        num_groups = len(group_keys)
+        # a group takes the rarest category of its images and the split of its assigned images
+        group_strata_keys = np.full(num_groups, NO_CATEGORY, dtype=np.int64)
+        np.minimum.at(group_strata_keys, image_group, image_strata_keys)
+        group_strata = get_strata(group_strata_keys, num_categories)
+        group_assigned = np.full(num_groups, UNASSIGNED, dtype=np.int64)
+        np.maximum.at(group_assigned, image_group, image_assigned)
+        group_split = assign_splits(
+            group_keys, group_strata, ratios, seed=seed, assigned=group_assigned
+        )
+        image_split = group_split[image_group]
+
+    set_ids = {set_name: image_id[image_split == k].tolist() for k, set_name in enumerate(SET_NAMES)}
+    for set_name, ids in set_ids.items():
+        io.save_json(ids, dataset.set_dir / f"{set_name}.json", create_directory=True)
+    io.save_json(
+        list(dataset.unlabeled_image_dict.keys()), dataset.unlabeled_set_file, create_directory=True
+    )
+
+    summary = {set_name: len(ids) for set_name, ids in set_ids.items()}
+    summary["new"] = int((image_assigned == UNASSIGNED).sum())
+    logger.info(
+        f"train num: {summary['train']}  val num: {summary['val']}  test num: {summary['test']}"
+    )
+    return summary
@@ -0,0 +1,131 @@
+import threading
+
+import numpy as np
+from waffle_hub.dataset import Dataset
+
+from .dataset_store import SET_BITS, column_store_manager
+
+# sqrt(bbox area) in pixels, like the small/medium/large split of coco
+BBOX_SIZE_BINS = np.array([0, 8, 16, 32, 64, 96, 128, 256, 512, np.inf])
+# log2(width / height)
+ASPECT_RATIO_BINS = np.array([-np.inf, -3, -2, -1, -0.5, 0.5, 1, 2, 3, np.inf])
+# long side of the image in pixels
+RESOLUTION_BINS = np.array([0, 320, 480, 640, 960, 1280, 1920, 2560, 3840, np.inf])
+OBJECTS_PER_IMAGE_BINS = np.array([0, 1, 2, 3, 5, 10, 20, 50, 100, np.inf])
+
+NUM_TOP_RESOLUTIONS = 10
+# bytes of the image x category indicator matrix multiplied at once
+COOCCURRENCE_CHUNK_BYTES = 64 * 1024**2
+
+
+def _get_cooccurrence(image_index: np.ndarray, category_index: np.ndarray, num_categories: int):
+    """Number of images in which each pair of categories appears together."""
+    image_index, image_row = np.unique(image_index, return_inverse=True)
+    # fewer rows per chunk with more categories, so a chunk stays within the byte budget
+    chunk_size = max(1, COOCCURRENCE_CHUNK_BYTES // (max(num_categories, 1) * 4))
+    order = np.argsort(image_row, kind="stable")
+    image_row, category_index = image_row[order], category_index[order]
+    cooccurrence = np.zeros((num_categories, num_categories), dtype=np.int64)
+    for start in range(0, len(image_index), chunk_size):
+        lo, hi = np.searchsorted(image_row, [start, start + chunk_size])
+        indicator = np.zeros(
+            (min(chunk_size, len(image_index) - start), num_categories), dtype=np.float32
+        )
+        indicator[image_row[lo:hi] - start, category_index[lo:hi]] = 1
+        cooccurrence += (indicator.T @ indicator).astype(np.int64)
+    return cooccurrence
+
+
+def _get_top_resolutions(width: np.ndarray, height: np.ndarray) -> list[dict]:
+    resolutions, counts = np.unique(
+        np.stack([width, height], axis=1).astype(np.int64), axis=0, return_counts=True
+    )
+    order = np.argsort(-counts, kind="stable")[:NUM_TOP_RESOLUTIONS]
+    return [
+        {"width": int(resolutions[i][0]), "height": int(resolutions[i][1]), "count": int(counts[i])}
+        for i in order
+    ]
+
+
+def compute_statistics(columns: dict[str, np.ndarray], set_name: str = "total") -> dict:
+    """Compute per-split statistics with vectorized ops over the columns."""
+    if set_name == "total":
+        image_mask = np.ones(len(columns["image_id"]), dtype=bool)
+    else:
+        image_mask = (columns["image_split"] & SET_BITS[set_name]) > 0
+    annotation_mask = image_mask[columns["annotation_image_index"]]
+
+    category_id = columns["category_id"]
+    num_categories = len(category_id)
+    annotation_category_id = columns["annotation_category_id"][annotation_mask]
+    category_index = np.searchsorted(category_id, annotation_category_id)
+    known = category_index < num_categories
+    known[known] = category_id[category_index[known]] == annotation_category_id[known]
+    category_index = category_index[known]
+    image_index = columns["annotation_image_index"][annotation_mask][known]
+
+    num_instances_per_category = np.bincount(category_index, minlength=num_categories)
+    unique_pairs = np.unique(image_index * num_categories + category_index)
+    num_images_per_category = np.bincount(
+        unique_pairs % max(num_categories, 1), minlength=num_categories
+    )
+
+    set_image_index = np.flatnonzero(image_mask)
+    objects_per_image = np.bincount(
+        columns["annotation_image_index"][annotation_mask], minlength=len(image_mask)
+    )[set_image_index]
+    width = columns["image_width"][set_image_index]
+    height = columns["image_height"][set_image_index]
+
+    area = columns["annotation_area"][annotation_mask]
+    area = area[area > 0]
+    aspect_ratio = columns["annotation_aspect_ratio"][annotation_mask]
+    aspect_ratio = aspect_ratio[np.isfinite(aspect_ratio) & (aspect_ratio > 0)]
+
+    return {
+        "num_images": int(image_mask.sum()),
+        "num_categories": num_categories,
+        "num_annotations": int(annotation_mask.sum()),
+        "category_ids": category_id.tolist(),
+        "num_instances_per_category": num_instances_per_category.tolist(),
+        "num_images_per_category": num_images_per_category.tolist(),
+        "bbox_size_hist": np.histogram(np.sqrt(area), bins=BBOX_SIZE_BINS)[0].tolist(),
+        "aspect_ratio_hist": np.histogram(np.log2(aspect_ratio), bins=ASPECT_RATIO_BINS)[0].tolist(),
+        "resolution_hist": np.histogram(np.maximum(width, height), bins=RESOLUTION_BINS)[0].tolist(),
+        "top_resolutions": _get_top_resolutions(width, height),
+        "objects_per_image_hist": np.histogram(objects_per_image, bins=OBJECTS_PER_IMAGE_BINS)[
+            0
+        ].tolist(),
+        "mean_objects_per_image": float(objects_per_image.mean()) if len(objects_per_image) else 0.0,
+        "cooccurrence": _get_cooccurrence(image_index, category_index, num_categories).tolist(),
+    }
+
+
+class StatisticsEngine:
+    """Statistics of each split are computed from the dataset's column store on first request
+    and kept until the dataset version changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statistics = {}  # (root_dir, name, set_name): (version, statistics)
+
+    def get_statistics(
+        self, dataset_name: str, root_dir, load_dataset, set_name: str = "total"
+    ) -> dict:
+        root_dir = Dataset.parse_root_dir(root_dir)
+        key = (str(root_dir), dataset_name, set_name)
+        version, store = column_store_manager.get_store(dataset_name, root_dir, load_dataset)
+
+        with self._lock:
+            cached = self._statistics.get(key, None)
+            if cached is not None and cached[0] == version:
+                return dict(cached[1])
+
+        statistics = compute_statistics(store.columns, set_name)
+        with self._lock:
+            self._statistics[key] = (version, statistics)
+        return dict(statistics)
+
+
+statistics_engine = StatisticsEngine()
@@ -0,0 +1,335 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import numpy as np
+from src.utils.cache import get_cache_dir
+from waffle_hub.dataset import Dataset
+
+from .dataset_catalog import DatasetCatalog
+
+SET_BITS = {
+    "train": 1 << 0,
+    "val": 1 << 1,
+    "test": 1 << 2,
+    "unlabeled": 1 << 3,
+}
+
+# string tables are saved as <name>.data.npy (utf-8 bytes) and <name>.offsets.npy
+STRING_TABLES = ["image_file_name", "category_name"]
+# bumped when columns are added, so stores of an older layout are built again
+STORE_FORMAT = 2
+# objects with sqrt(area) below this are small, like coco
+SMALL_OBJECT_SIZE = 32
+
+
+def get_dataset_version(dataset_dir) -> str:
+    signature = DatasetCatalog.get_signature(dataset_dir)
+    return hashlib.md5(json.dumps(signature).encode()).hexdigest()
+
+
+def build_columns(dataset: Dataset) -> dict[str, np.ndarray]:
+    """Build columnar arrays of images and annotations in one pass over the dataset.
+
+    Annotations are sorted by image, so the annotations of the image at index i are
+    annotation_offsets[i]:annotation_offsets[i + 1].
+
+    Returns:
+        dict[str, np.ndarray]: image_id, image_width, image_height, image_split (bit mask of
+            SET_BITS), annotation_offsets, annotation_id, annotation_image_index (index into
+            image arrays), annotation_category_id, annotation_area, annotation_aspect_ratio,
+            category_id
+    """
+    images = list(dataset.image_dict.values())
+    image_id = np.fromiter((image.image_id for image in images), dtype=np.int64, count=len(images))
+    order = np.argsort(image_id)
+    image_id = image_id[order]
+    image_width = np.array([images[i].width or 0 for i in order], dtype=np.float32)
+    image_height = np.array([images[i].height or 0 for i in order], dtype=np.float32)
+
+    image_split = np.zeros(len(image_id), dtype=np.uint8)
+    try:
+        split_ids = dataset.get_split_ids()
+    except FileNotFoundError:
+        split_ids = [[], [], [], []]
+    for set_name, ids in zip(["train", "val", "test", "unlabeled"], split_ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        index = np.searchsorted(image_id, ids)
+        valid = (index < len(image_id)) & (image_id[np.minimum(index, len(image_id) - 1)] == ids)
+        image_split[index[valid]] |= SET_BITS[set_name]
+
+    annotations = list(dataset.annotation_dict.values())
+    num_annotations = len(annotations)
+    annotation_id = np.fromiter(
+        (a.annotation_id for a in annotations), dtype=np.int64, count=num_annotations
+    )
+    annotation_image_id = np.fromiter(
+        (a.image_id for a in annotations), dtype=np.int64, count=num_annotations
+    )
+    annotation_category_id = np.fromiter(
+        (a.category_id or 0 for a in annotations), dtype=np.int64, count=num_annotations
+    )
+    bbox = np.array(
+        [a.bbox if a.bbox else [0, 0, 0, 0] for a in annotations], dtype=np.float32
+    ).reshape(-1, 4)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annotation_aspect_ratio = np.where(bbox[:, 3] > 0, bbox[:, 2] / bbox[:, 3], np.nan)
+
+    annotation_image_index = np.searchsorted(image_id, annotation_image_id)
+    annotation_order = np.argsort(annotation_image_index, kind="stable")
+    annotation_offsets = np.zeros(len(image_id) + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(annotation_image_index, minlength=len(image_id)), out=annotation_offsets[1:]
+    )
+
+    category_id = np.array(
+        sorted(category.category_id for category in dataset.get_categories()), dtype=np.int64
+    )
+
+    return {
+        "image_id": image_id,
+        "image_width": image_width,
+        "image_height": image_height,
+        "image_split": image_split,
+        "annotation_offsets": annotation_offsets,
+        "annotation_id": annotation_id[annotation_order],
+        "annotation_image_index": annotation_image_index[annotation_order],
+        "annotation_category_id": annotation_category_id[annotation_order],
+        "annotation_area": (bbox[:, 2] * bbox[:, 3])[annotation_order],
+        "annotation_aspect_ratio": annotation_aspect_ratio.astype(np.float32)[annotation_order],
+        "category_id": category_id,
+    }
+
+
+def build_indexes(columns: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Indexes for sampling without scanning the images.
+
+    Returns:
+        dict[str, np.ndarray]: category_image_offsets and category_image_index (images of
+            the category at index i are category_image_index[offsets[i]:offsets[i + 1]]),
+            image_difficulty and image_hard_order (image indexes by difficulty, descending)
+    """
+    num_images = len(columns["image_id"])
+    category_id = columns["category_id"]
+    num_categories = len(category_id)
+    image_index = columns["annotation_image_index"]
+    category_index = np.searchsorted(category_id, columns["annotation_category_id"])
+    known = category_index < num_categories
+    known[known] = category_id[category_index[known]] == columns["annotation_category_id"][known]
+
+    # unique (category, image) pairs, sorted by category then image
+    pairs = np.unique(category_index[known] * max(num_images, 1) + image_index[known])
+    pair_category, pair_image = np.divmod(pairs, max(num_images, 1))
+    category_image_offsets = np.zeros(num_categories + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair_category, minlength=num_categories), out=category_image_offsets[1:])
+
+    # many objects, small objects and rare categories make an image hard
+    num_objects = np.bincount(image_index, minlength=num_images)
+    small = np.sqrt(columns["annotation_area"]) < SMALL_OBJECT_SIZE
+    num_small = np.bincount(image_index, weights=small, minlength=num_images)
+    frequency = np.diff(category_image_offsets)
+    rarity = np.zeros(num_images, dtype=np.float64)
+    if len(pairs):
+        np.maximum.at(rarity, pair_image, np.log(frequency.max() / frequency[pair_category]))
+    difficulty = (np.log1p(num_objects) + num_small / np.maximum(num_objects, 1) + rarity).astype(
+        np.float32
+    )
+
+    return {
+        "category_image_offsets": category_image_offsets,
+        "category_image_index": pair_image.astype(np.int64),
+        "image_difficulty": difficulty,
+        "image_hard_order": np.argsort(-difficulty, kind="stable").astype(np.int64),
+    }
+
+
+def build_string_tables(dataset: Dataset, columns: dict[str, np.ndarray]) -> dict[str, list]:
+    image_dict = dataset.image_dict
+    category_dict = {category.category_id: category for category in dataset.get_categories()}
+    return {
+        "image_file_name": [image_dict[i].file_name for i in columns["image_id"].tolist()],
+        "category_name": [category_dict[i].name for i in columns["category_id"].tolist()],
+    }
+
+
+class StringTable:
+    """Read only list of strings in two arrays: utf-8 bytes and their offsets."""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @staticmethod
+    def encode(strings: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        encoded = [s.encode() for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return self.data[self.offsets[index] : self.offsets[index + 1]].tobytes().decode()
+
+    def take(self, indices) -> list[str]:
+        return [self[i] for i in np.asarray(indices).tolist()]
+
+
+class ColumnStore:
+    """Columns of one dataset version in .npy files, opened with mmap.
+
+    Arrays are paged in by the os on access, so a large dataset costs only the pages
+    queries touch, and no python object is made per image or annotation.
+
+    Args:
+        store_dir (Path): directory written by ColumnStore.write.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        self.columns = {}
+        self.strings = {}
+        for file in self.store_dir.glob("*.npy"):
+            name = file.name[: -len(".npy")]
+            if name.endswith(".data") or name.endswith(".offsets"):
+                continue
+            self.columns[name] = np.load(file, mmap_mode="r")
+        for name in STRING_TABLES:
+            self.strings[name] = StringTable(
+                np.load(self.store_dir / f"{name}.data.npy", mmap_mode="r"),
+                np.load(self.store_dir / f"{name}.offsets.npy", mmap_mode="r"),
+            )
+
+    @classmethod
+    def write(cls, dataset: Dataset, store_dir) -> "ColumnStore":
+        """Build the columns of a dataset and write them to store_dir atomically."""
+        store_dir = Path(store_dir)
+        tmp_dir = store_dir.with_name(f".tmp-{store_dir.name}-{os.getpid()}-{threading.get_ident()}")
+        tmp_dir.mkdir(parents=True)
+
+        columns = build_columns(dataset)
+        for name, array in {**columns, **build_indexes(columns)}.items():
+            np.save(tmp_dir / f"{name}.npy", array)
+        for name, strings in build_string_tables(dataset, columns).items():
+            data, offsets = StringTable.encode(strings)
+            np.save(tmp_dir / f"{name}.data.npy", data)
+            np.save(tmp_dir / f"{name}.offsets.npy", offsets)
+        try:
+            os.replace(tmp_dir, store_dir)
+        except OSError:
+            # written by another thread or process meanwhile
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not store_dir.exists():
+                raise
+        return cls(store_dir)
+
+    @property
+    def num_images(self) -> int:
+        return len(self.columns["image_id"])
+
+    def get_image_index(self, image_ids) -> np.ndarray:
+        """Index of each image id in the image arrays, -1 for unknown ids."""
+        image_id = self.columns["image_id"]
+        image_ids = np.asarray(image_ids, dtype=np.int64)
+        index = np.searchsorted(image_id, image_ids)
+        clipped = np.minimum(index, max(len(image_id) - 1, 0))
+        valid = (index < len(image_id)) & (image_id[clipped] == image_ids)
+        return np.where(valid, index, -1)
+
+    def get_image_mask(self, set_name: str = "total", category_id: int = None) -> np.ndarray:
+        """Mask over the image arrays of a split and of images with a category."""
+        if set_name == "total":
+            mask = np.ones(self.num_images, dtype=bool)
+        else:
+            mask = (self.columns["image_split"] & SET_BITS[set_name]) > 0
+        if category_id is not None:
+            has_category = np.zeros(self.num_images, dtype=bool)
+            has_category[
+                self.columns["annotation_image_index"][
+                    self.columns["annotation_category_id"] == category_id
+                ]
+            ] = True
+            mask &= has_category
+        return mask
+
+    def get_image_ids(self, set_name: str = "total", category_id: int = None) -> np.ndarray:
+        return self.columns["image_id"][self.get_image_mask(set_name, category_id)]
+
+    def get_file_names(self, image_ids) -> list[str]:
+        index = self.get_image_index(image_ids)
+        if (index < 0).any():
+            raise KeyError(f"Unknown image ids: {np.asarray(image_ids)[index < 0].tolist()[:5]}")
+        return self.strings["image_file_name"].take(index)
+
+    def get_category_names(self) -> dict[int, str]:
+        names = self.strings["category_name"].take(np.arange(len(self.columns["category_id"])))
+        return dict(zip(self.columns["category_id"].tolist(), names))
+
+    def get_annotations(self, image_id: int) -> dict[str, np.ndarray]:
+        """Annotation columns of one image, as array slices (no copy)."""
+        index = int(self.get_image_index([image_id])[0])
+        if index < 0:
+            raise KeyError(f"Unknown image id: {image_id}")
+        offsets = self.columns["annotation_offsets"]
+        start, end = int(offsets[index]), int(offsets[index + 1])
+        return {
+            name[len("annotation_") :]: array[start:end]
+            for name, array in self.columns.items()
+            if name.startswith("annotation_") and name != "annotation_offsets"
+        }
+
+
+class ColumnStoreManager:
+    """Column stores by dataset, built once per dataset version under the root's cache dir."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stores = {}  # (root_dir, name): (version, ColumnStore)
+
+    def get_store(self, dataset_name: str, root_dir, load_dataset) -> tuple[str, ColumnStore]:
+        """Column store of the current version of a dataset.
+
+        Args:
+            dataset_name (str): dataset name.
+            root_dir (str): dataset root directory.
+            load_dataset (Callable): returns the Dataset, called only to build a new version.
+
+        Returns:
+            tuple[str, ColumnStore]: dataset version and its store.
+        """
+        root_dir = Dataset.parse_root_dir(root_dir)
+        key = (str(root_dir), dataset_name)
+        version = get_dataset_version(root_dir / dataset_name)
+
+        with self._lock:
+            cached = self._stores.get(key, None)
+            if cached is not None and cached[0] == version:
+                return cached
+
+        stores_dir = get_cache_dir(root_dir, "columns", dataset_name)
+        store_dir = stores_dir / f"{version}.{STORE_FORMAT}"
+        if store_dir.exists():
+            store = ColumnStore(store_dir)
+        else:
+            store = ColumnStore.write(load_dataset(), store_dir)
+            # open maps of older versions stay valid after their files are removed
+            for old_dir in stores_dir.iterdir():
+                if old_dir != store_dir and not old_dir.name.startswith(".tmp-"):
+                    shutil.rmtree(old_dir, ignore_errors=True)
+
+        with self._lock:
+            self._stores[key] = (version, store)
+        return version, store
+
+    def invalidate(self, dataset_name: str, root_dir=None):
+        root_dir = Dataset.parse_root_dir(root_dir)
+        with self._lock:
+            self._stores.pop((str(root_dir), dataset_name), None)
+        shutil.rmtree(get_cache_dir(root_dir, "columns", dataset_name), ignore_errors=True)
+
+
+column_store_manager = ColumnStoreManager()
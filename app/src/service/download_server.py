@@ -0,0 +1,116 @@
+import logging
+import os
+import secrets
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote, unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class _DownloadHandler(SimpleHTTPRequestHandler):
+    """Serves only the registered files, streamed from disk by copyfileobj."""
+
+    def __init__(self, *args, files: dict, **kwargs):
+        self.files = files
+        super().__init__(*args, **kwargs)
+
+    def translate_path(self, path: str) -> str:
+        token = unquote(urlsplit(path).path).strip("/").split("/")[0]
+        file, expire_time = self.files.get(token, (None, 0))
+        if time.monotonic() > expire_time:
+            # a path that does not exist makes send_head answer 404
+            return os.devnull + ".missing"
+        return str(file)
+
+    def end_headers(self):
+        if self.command in ("GET", "HEAD"):
+            self.send_header("Content-Disposition", "attachment")
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class DownloadServer:
+    """HTTP server for files too large for st.download_button.
+
+    st.download_button keeps the whole file in memory (and so does the media file manager
+    behind it), and streamlit's static file serving is limited to 200 MB. This server sends
+    registered files from disk in chunks instead. It is started on first use in a daemon
+    thread of the app process.
+
+    Files are reachable only through a random token per registration, which expires after
+    ttl seconds.
+
+    Args:
+        port (int): port to listen on.
+        host (str, optional): address to listen on.
+            Defaults to streamlit's server.address, or localhost when it is not set.
+        base_url (str, optional): url the browser reaches the server at.
+            Defaults to http://{browser.serverAddress}:{port}.
+        ttl (float, optional): seconds a download url stays valid.
+    """
+
+    def __init__(self, port: int, host: str = None, base_url: str = None, ttl: float = 3600):
+        self.port = port
+        self.host = host
+        self.base_url = base_url
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._files = {}  # token: (file, expire time)
+        self._server = None
+
+    def _get_host(self) -> str:
+        if self.host:
+            return self.host
+        import streamlit as st
+
+        return st.get_option("server.address") or "localhost"
+
+    def _start(self) -> bool:
+        with self._lock:
+            if self._server is not None:
+                return True
+            host = self._get_host()
+            try:
+                self._server = ThreadingHTTPServer(
+                    (host, self.port), partial(_DownloadHandler, files=self._files)
+                )
+            except OSError as e:
+                logger.warning(f"Download server can not listen on {host}:{self.port}: {e}")
+                return False
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            return True
+
+    def _get_base_url(self) -> str:
+        if self.base_url:
+            return self.base_url.rstrip("/")
+        import streamlit as st
+
+        return f"http://{st.get_option('browser.serverAddress')}:{self.port}"
+
+    def get_url(self, file, file_name: str = None) -> str:
+        """Register a file and return its download url, None if the server can not start."""
+        if not self._start():
+            return None
+        file = Path(file).absolute()
+        token = secrets.token_urlsafe()
+        now = time.monotonic()
+        with self._lock:
+            for expired in [k for k, (_, expire_time) in self._files.items() if now > expire_time]:
+                del self._files[expired]
+            self._files[token] = (file, now + self.ttl)
+        return f"{self._get_base_url()}/{token}/{quote(file_name or file.name)}"
+
+
+download_server = DownloadServer(
+    port=int(os.getenv("WAFFLE_APP_DOWNLOAD_PORT", 8502)),
+    host=os.getenv("WAFFLE_APP_DOWNLOAD_HOST", None),
+    base_url=os.getenv("WAFFLE_APP_DOWNLOAD_URL", None),
+    ttl=float(os.getenv("WAFFLE_APP_DOWNLOAD_TTL", 3600)),
+)
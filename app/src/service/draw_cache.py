@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from pathlib import Path
+
+from src.utils.cache import get_cache_dir
+from waffle_hub.dataset import Dataset
+
+logger = logging.getLogger(__name__)
+
+
+def _draw_image(
+    image_path: str, annotation_files: list[str], task: str, names: list[str], output_path: str
+) -> str:
+    from waffle_hub.schema import Annotation
+    from waffle_hub.temp_utils.image.io import load_image, save_image
+    from waffle_hub.utils.draw import draw_results
+
+    annotations = [Annotation.from_json(f, task) for f in annotation_files]
+    drawn_image = draw_results(load_image(image_path), annotations, names)
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # a tmp file per drawing, so sessions drawing the same image do not collide. It keeps
+    # the suffix, save_image picks the image format by it
+    fd, tmp_path = tempfile.mkstemp(suffix=output_path.suffix, prefix=".", dir=output_path.parent)
+    os.close(fd)
+    try:
+        save_image(tmp_path, drawn_image, create_directory=True)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+    return str(output_path)
+
+
+class DrawCache:
+    """Drawn images keyed by (image_id, annotation version).
+
+    The version of an image is a hash of the stats of its raw image, its annotation files
+    and the category files, so an image is drawn again only when one of them changes.
+    Missing images are drawn in a process pool.
+
+    Args:
+        num_workers (int): processes drawing images.
+    """
+
+    def __init__(self, num_workers: int = 4):
+        self.num_workers = num_workers
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.num_workers, mp_context=get_context("spawn")
+                )
+            return self._executor
+
+    @staticmethod
+    def _get_stats(paths) -> list:
+        stats = []
+        for path in sorted(paths):
+            stat = os.stat(path)
+            stats.append([str(path), stat.st_mtime_ns, stat.st_size])
+        return stats
+
+    def get_version(self, dataset: Dataset, image_id: int, file_name: str, categories) -> str:
+        annotation_files = list((dataset.annotation_dir / str(image_id)).glob("*.json"))
+        signature = [
+            self._get_stats([dataset.raw_image_dir / file_name]),
+            self._get_stats(annotation_files),
+            categories,
+        ]
+        return hashlib.md5(str(signature).encode()).hexdigest()
+
+    def get_draw_dir(self, dataset: Dataset) -> Path:
+        return get_cache_dir(dataset.root_dir, "draws", dataset.name)
+
+    def draw(self, dataset: Dataset, image_ids: list[int], callback=None) -> list[Path]:
+        """Get drawn images, drawing the missing ones in parallel.
+
+        Args:
+            dataset (Dataset): dataset to draw.
+            image_ids (list[int]): image ids to draw.
+            callback (Callable, optional): called with (num_done, num_total) as images are
+                ready.
+
+        Returns:
+            list[Path]: drawn image paths in the order of image_ids. Unlabeled images and
+                images that could not be drawn are left out.
+        """
+        draw_dir = self.get_draw_dir(dataset)
+        categories = self._get_stats(dataset.category_dir.glob("*.json"))
+        names = dataset.get_category_names()
+
+        images = [dataset.image_dict[i] for i in image_ids if i in dataset.image_dict]
+        results = [None] * len(images)
+        missing = []
+        for i, image in enumerate(images):
+            version = self.get_version(dataset, image.image_id, image.file_name, categories)
+            output_path = draw_dir / f"{image.image_id}-{version}" / Path(image.file_name).name
+            if output_path.exists():
+                results[i] = output_path
+            else:
+                missing.append((i, image, output_path))
+
+        num_done = len(images) - len(missing)
+        if callback is not None:
+            callback(num_done, len(images))
+
+        if missing:
+            executor = self._get_executor()
+            futures = {}
+            for i, image, output_path in missing:
+                # remove drawings of older annotation versions, not the one being drawn
+                for old_dir in draw_dir.glob(f"{image.image_id}-*"):
+                    if old_dir != output_path.parent:
+                        shutil.rmtree(old_dir, ignore_errors=True)
+                annotation_files = (dataset.annotation_dir / str(image.image_id)).glob("*.json")
+                future = executor.submit(
+                    _draw_image,
+                    str(dataset.raw_image_dir / image.file_name),
+                    [str(f) for f in annotation_files],
+                    dataset.task,
+                    names,
+                    str(output_path),
+                )
+                futures[future] = (i, image)
+
+            for future in as_completed(futures):
+                i, image = futures[future]
+                try:
+                    results[i] = Path(future.result())
+                except BrokenProcessPool as e:
+                    logger.warning(f"Failed to draw image {image.image_id}: {e}")
+                    with self._lock:
+                        self._executor = None
+                except Exception as e:
+                    logger.warning(f"Failed to draw image {image.image_id}: {e}")
+                num_done += 1
+                if callback is not None:
+                    callback(num_done, len(images))
+
+        return [path for path in results if path is not None]
+
+
+draw_cache = DrawCache(num_workers=int(os.getenv("WAFFLE_APP_DRAW_WORKERS", 4)))
@@ -0,0 +1,120 @@
+import os
+import threading
+from pathlib import Path
+
+from waffle_hub.hub import Hub
+from waffle_hub.schema.configs import ModelConfig
+from waffle_utils.file import io
+
+
+def _stat_key(path: Path) -> tuple:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class HubCatalog:
+    """Index of hub infos keyed on the mtimes of each hub's model config and train status.
+
+    Only hubs whose files changed since the last scan are read again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # hub_dir: {"signature", "info", "caption", "hub"}
+
+    @staticmethod
+    def get_signature(hub_dir: Path) -> tuple:
+        return (
+            _stat_key(hub_dir / Hub.MODEL_CONFIG_FILE),
+            _stat_key(hub_dir / Hub.TRAINING_STATUS_FILE),
+        )
+
+    @staticmethod
+    def _read_info(hub_dir: Path) -> dict:
+        info = ModelConfig.load(hub_dir / Hub.MODEL_CONFIG_FILE).to_dict()
+        status_file = hub_dir / Hub.TRAINING_STATUS_FILE
+        status = io.load_json(status_file) if status_file.exists() else None
+        info["status"] = str(status["status_desc"]) if status else "INIT"
+        return info
+
+    @staticmethod
+    def _get_caption(info: dict) -> str:
+        return f"Backend: {info['backend'].upper():>24}, Task: {info['task'].upper():>24}, Categories: {str([category['name'] for category in info['categories']]):>20}, Status: {info['status']}"
+
+    def scan(self, root_dir) -> list[dict]:
+        """Get hub entries in root_dir, refreshing only the changed hubs.
+
+        Returns:
+            list[dict]: {"name", "info", "caption"} sorted by name
+        """
+        root_dir = Hub.parse_root_dir(root_dir)
+        if not root_dir.exists():
+            return []
+
+        entries = []
+        with self._lock:
+            alive = set()
+            for hub_dir in root_dir.iterdir():
+                if not hub_dir.is_dir():
+                    continue
+                signature = self.get_signature(hub_dir)
+                if signature[0] is None:
+                    continue
+                alive.add(hub_dir)
+
+                entry = self._entries.get(hub_dir, None)
+                if entry is None or entry["signature"] != signature:
+                    try:
+                        info = self._read_info(hub_dir)
+                    except Exception:
+                        continue
+                    entry = {
+                        "signature": signature,
+                        "info": info,
+                        "caption": self._get_caption(info),
+                        "hub": None,
+                    }
+                    self._entries[hub_dir] = entry
+                entries.append(
+                    {"name": hub_dir.name, "info": entry["info"], "caption": entry["caption"]}
+                )
+
+            for hub_dir in list(self._entries.keys()):
+                if hub_dir.parent == root_dir and hub_dir not in alive:
+                    del self._entries[hub_dir]
+
+        return sorted(entries, key=lambda x: x["name"])
+
+    def load(self, name: str, root_dir) -> Hub:
+        """Load a Hub, reusing the loaded instance while its model config is unchanged."""
+        root_dir = Hub.parse_root_dir(root_dir)
+        hub_dir = root_dir / name
+        signature = self.get_signature(hub_dir)
+        if signature[0] is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(hub_dir, None)
+            if entry is not None and entry["hub"] is not None:
+                if entry["signature"][0] == signature[0]:
+                    return entry["hub"]
+
+        hub = Hub.load(name, root_dir=root_dir)
+        with self._lock:
+            entry = self._entries.get(hub_dir, None)
+            if entry is not None and entry["signature"][0] == signature[0]:
+                entry["hub"] = hub
+        return hub
+
+    def invalidate(self, name: str = None, root_dir=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(Hub.parse_root_dir(root_dir) / name, None)
+
+
+hub_catalog = HubCatalog()
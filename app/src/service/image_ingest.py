@@ -0,0 +1,173 @@
+import enum
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from pathlib import Path
+
+from waffle_hub import BaseEnum
+from waffle_hub.schema.running_status import BaseRunningStatus
+from waffle_hub.utils.running_status_logger import RunningStatusLogger
+from waffle_utils.file import io, search
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024**2
+# jpeg files must end with the EOI marker, allowing some trailing padding
+JPEG_EOI = b"\xff\xd9"
+JPEG_TAIL_SIZE = 1024
+# save the status every this many images
+STATUS_INTERVAL = 256
+
+
+class IngestStatusDesc(BaseEnum):
+    INIT = enum.auto()
+    RUNNING = enum.auto()
+    SUCCESS = enum.auto()
+    FAILED = enum.auto()
+    STOPPED = enum.auto()
+
+
+@dataclass
+class IngestingStatus(BaseRunningStatus[IngestStatusDesc]):
+    num_corrupt: int = None
+    num_duplicate: int = None
+
+
+class IngestingStatusLogger(RunningStatusLogger):
+    def __init__(self, save_path: Path):
+        super().__init__(IngestingStatus(), save_path)
+        self.set_init()
+
+    def set_init(self):
+        self.clear_error()
+        self.clear_step()
+        self.running_status.num_corrupt = 0
+        self.running_status.num_duplicate = 0
+        self.set_status(IngestStatusDesc.INIT)
+
+    def set_failed(self, e):
+        self.set_error(e)
+        self.set_status(IngestStatusDesc.FAILED)
+
+    def set_success(self):
+        self.clear_error()
+        self.running_status.step = self.running_status.total_step
+        self.set_status(IngestStatusDesc.SUCCESS)
+
+    def set_running(self):
+        self.set_status(IngestStatusDesc.RUNNING)
+
+    def set_stopped(self, e):
+        self.set_error(e)
+        self.set_status(IngestStatusDesc.STOPPED)
+
+    def set_progress(self, step: int, num_corrupt: int, num_duplicate: int):
+        self.running_status.num_corrupt = num_corrupt
+        self.running_status.num_duplicate = num_duplicate
+        self.set_current_step(step)
+
+
+def hash_file(path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def inspect_image(path: str) -> dict:
+    """Read the size and content hash of an image and check that it is not broken.
+
+    Returns:
+        dict: {"path", "width", "height", "format", "bytes", "hash", "error"}. error is
+            None for a valid image.
+    """
+    import PIL.Image
+
+    result = {"path": path, "width": None, "height": None, "format": None, "error": None}
+    try:
+        h = hashlib.sha1()
+        tail = b""
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                h.update(chunk)
+                tail = (tail + chunk)[-JPEG_TAIL_SIZE:]
+        result["hash"] = h.hexdigest()
+        result["bytes"] = os.path.getsize(path)
+
+        # only the header is decoded, verify() walks the chunks without decoding pixels
+        with PIL.Image.open(path) as image:
+            result["width"], result["height"] = image.size
+            result["format"] = image.format
+            image.verify()
+        if result["format"] == "JPEG" and JPEG_EOI not in tail:
+            raise OSError("truncated jpeg file (no EOI marker)")
+    except Exception as e:
+        result["error"] = f"{e.__class__.__name__}: {e}"
+    return result
+
+
+def ingest_images(
+    image_dir,
+    status_logger: RunningStatusLogger = None,
+    num_workers: int = None,
+    chunksize: int = 64,
+) -> dict:
+    """Inspect every image in image_dir with a process pool.
+
+    Args:
+        image_dir (str): directory to search images in.
+        status_logger (RunningStatusLogger, optional): logger to report the progress to with
+            set_total_step and set_progress(step, num_corrupt, num_duplicate).
+        num_workers (int, optional): number of processes. Defaults to the number of cpus.
+        chunksize (int, optional): images sent to a process at once.
+
+    Returns:
+        dict: {"images": {relative path: inspect_image result}, "corrupt": [relative path],
+            "duplicates": {relative path: relative path of the first image with the same
+            content}}
+    """
+    image_dir = Path(image_dir)
+    paths = [str(path) for path in search.get_image_files(image_dir, recursive=True)]
+    if status_logger:
+        status_logger.set_total_step(len(paths))
+
+    images, corrupt, duplicates, hashes = {}, [], {}, {}
+    num_workers = num_workers or os.cpu_count()
+    with ProcessPoolExecutor(num_workers, mp_context=get_context("spawn")) as executor:
+        for step, result in enumerate(
+            executor.map(inspect_image, paths, chunksize=chunksize), start=1
+        ):
+            name = str(Path(result["path"]).relative_to(image_dir))
+            images[name] = result
+            if result["error"]:
+                corrupt.append(name)
+            elif result["hash"] in hashes:
+                duplicates[name] = hashes[result["hash"]]
+            else:
+                hashes[result["hash"]] = name
+
+            if status_logger and (step % STATUS_INTERVAL == 0 or step == len(paths)):
+                status_logger.set_progress(step, len(corrupt), len(duplicates))
+
+    if corrupt:
+        logger.warning(f"{len(corrupt)} corrupt images in {image_dir}")
+    if duplicates:
+        logger.warning(f"{len(duplicates)} duplicate images in {image_dir}")
+    return {"images": images, "corrupt": corrupt, "duplicates": duplicates}
+
+
+def save_report(report: dict, report_file):
+    """Save the corrupt and duplicate images of an ingest report."""
+    io.save_json(
+        {
+            "num_images": len(report["images"]),
+            "corrupt": {name: report["images"][name]["error"] for name in report["corrupt"]},
+            "duplicates": report["duplicates"],
+        },
+        report_file,
+        create_directory=True,
+    )
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+
+class MetricsReader:
+    """Values of a training metrics file by tag, updated from the new part of the file only.
+
+    Two formats are read:
+        - .csv (a header, then one row per epoch, appended while training like ultralytics'
+          results.csv): the read offset is kept and only complete new rows are parsed.
+        - .json (waffle_hub's metrics.json, [[{"tag", "value"}, ...] per epoch], written
+          whole): parsed again only when its size or mtime changes.
+
+    A file that was replaced or truncated is read again from the start.
+
+    Args:
+        path (Path): metrics file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._stat = None
+        self._offset = 0
+        self._header = None
+        self._values = {}  # tag: [value per epoch]
+        self._num_epochs = 0
+
+    def _add(self, epoch: int, tag: str, value):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return
+        values = self._values.setdefault(tag, [])
+        # tags missing in some epochs are padded, so all values line up with the epochs
+        values.extend([np.nan] * (epoch - len(values)))
+        values.append(value)
+
+    def _read_csv(self):
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # a row being written is read next time
+        lines = data[:end].decode().splitlines()
+        self._offset += end
+        for line in lines:
+            cells = [cell.strip() for cell in line.split(",")]
+            if not any(cells):
+                continue
+            if self._header is None:
+                self._header = cells
+                continue
+            for tag, value in zip(self._header, cells):
+                self._add(self._num_epochs, tag, value)
+            self._num_epochs += 1
+
+    def _read_json(self):
+        with open(self.path) as f:
+            epochs = json.load(f)
+        self._values = {}
+        for epoch, metric in enumerate(epochs):
+            for item in metric:
+                self._add(epoch, item["tag"], item["value"])
+        self._num_epochs = len(epochs)
+
+    def read(self) -> dict[str, np.ndarray]:
+        """Values of every tag, one per epoch (nan where an epoch has no value of it)."""
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                self._reset()
+                return {}
+
+            last = self._stat
+            if last is None or (stat.st_ino, stat.st_dev) != last[:2] or stat.st_size < last[2]:
+                self._reset()
+            if self._stat is None or (stat.st_size, stat.st_mtime_ns) != self._stat[2:]:
+                try:
+                    if self.path.suffix == ".csv":
+                        self._read_csv()
+                    else:
+                        self._read_json()
+                except ValueError:
+                    # being written, the last values are kept until it is complete
+                    return self._get_values()
+                self._stat = (stat.st_ino, stat.st_dev, stat.st_size, stat.st_mtime_ns)
+
+            return self._get_values()
+
+    def _get_values(self) -> dict[str, np.ndarray]:
+        return {
+            tag: np.array(values + [np.nan] * (self._num_epochs - len(values)))
+            for tag, values in self._values.items()
+        }
+
+
+class MetricsReaders:
+    """One MetricsReader per file, so every rerun reads only what was appended since the last."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._readers = {}
+
+    def read(self, path) -> dict[str, np.ndarray]:
+        path = Path(path).absolute()
+        with self._lock:
+            reader = self._readers.get(path, None)
+            if reader is None:
+                reader = self._readers[path] = MetricsReader(path)
+        return reader.read()
+
+
+metrics_readers = MetricsReaders()
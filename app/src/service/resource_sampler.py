@@ -0,0 +1,333 @@
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+import psutil
+import torch
+
+logger = logging.getLogger(__name__)
+
+# seconds between samples and number of samples kept (10 minutes by default)
+SAMPLE_INTERVAL = float(os.getenv("WAFFLE_APP_RESOURCE_SAMPLE_INTERVAL", 1.0))
+HISTORY_SIZE = int(os.getenv("WAFFLE_APP_RESOURCE_HISTORY_SIZE", 600))
+# number of fake gpus sampled on machines without gpus, for developing the pages
+FAKE_GPUS = int(os.getenv("WAFFLE_APP_FAKE_GPUS", 0))
+
+RUN_COLUMNS = ["cpu", "rss", "gpu_memory"]  # %, MB, MB of the process tree of a run
+
+
+def _to_float(value) -> float:
+    # nvitop gives "N/A" for values the driver does not report
+    return float(value) if isinstance(value, (int, float)) else math.nan
+
+
+class RingBuffer:
+    """Last `size` samples of fixed columns, kept in preallocated numpy arrays.
+
+    Args:
+        size (int): number of samples kept.
+        columns (list[str]): names of the values of a sample.
+    """
+
+    def __init__(self, size: int, columns: list[str]):
+        self.columns = columns
+        self._times = np.full(size, np.nan)
+        self._values = np.full((size, len(columns)), np.nan, dtype=np.float32)
+        self._count = 0  # samples appended so far
+
+    def __len__(self) -> int:
+        return min(self._count, len(self._times))
+
+    def append(self, sample_time: float, values: list[float]):
+        i = self._count % len(self._times)
+        self._times[i] = sample_time
+        self._values[i] = values
+        self._count += 1
+
+    def get(self) -> tuple[np.ndarray, np.ndarray]:
+        """Times (epoch seconds) and values (time x column) of the samples, oldest first."""
+        if self._count <= len(self._times):
+            return self._times[: self._count].copy(), self._values[: self._count].copy()
+        i = self._count % len(self._times)
+        return (
+            np.concatenate([self._times[i:], self._times[:i]]),
+            np.concatenate([self._values[i:], self._values[:i]]),
+        )
+
+    def last(self) -> np.ndarray:
+        if self._count == 0:
+            return None
+        return self._values[(self._count - 1) % len(self._times)].copy()
+
+
+class RunUsage:
+    """Resource usage of a run over all of its samples, not only the ones still buffered."""
+
+    def __init__(self):
+        self.num_samples = 0
+        self.cpu_sum = 0.0
+        self.rss_sum = 0.0
+        self.peak_rss = 0.0
+        self.peak_gpu_memory = None
+        # (pid, create_time): (cpu_time, read_bytes, write_bytes), kept after the process exits
+        self.counters = {}
+
+    def add(self, values: list[float], counters: dict):
+        cpu, rss, gpu_memory = values
+        if math.isnan(rss):
+            return
+        self.num_samples += 1
+        self.cpu_sum += cpu
+        self.rss_sum += rss
+        self.peak_rss = max(self.peak_rss, rss)
+        if gpu_memory > 0:
+            self.peak_gpu_memory = max(self.peak_gpu_memory or 0.0, gpu_memory)
+        self.counters.update(counters)
+
+    def to_dict(self) -> dict:
+        """Usage as RunInfo fields."""
+        if self.num_samples == 0:
+            return {}
+        counters = list(self.counters.values())
+        has_io = counters and all(counter[1] is not None for counter in counters)
+        return {
+            "peak_rss": round(self.peak_rss, 1),
+            "avg_rss": round(self.rss_sum / self.num_samples, 1),
+            "avg_cpu": round(self.cpu_sum / self.num_samples, 1),
+            "cpu_time": round(sum(counter[0] for counter in counters), 1),
+            "io_read_bytes": sum(counter[1] for counter in counters) if has_io else None,
+            "io_write_bytes": sum(counter[2] for counter in counters) if has_io else None,
+            "peak_gpu_memory": (
+                round(self.peak_gpu_memory, 1) if self.peak_gpu_memory is not None else None
+            ),
+        }
+
+
+class GpuReader:
+    """Utilization and memory of the gpus through nvitop, enumerated once."""
+
+    def __init__(self):
+        from nvitop import Device
+
+        self.devices = Device.all()
+        self.names = [f"{device.index}" for device in self.devices]
+
+    def read(self) -> list[tuple[float, float]]:
+        """(util %, memory %) of each device."""
+        return [
+            (_to_float(device.gpu_percent()), _to_float(device.memory_percent()))
+            for device in self.devices
+        ]
+
+    def read_process_memory(self) -> dict[int, float]:
+        """GPU memory (MB) of each process on all devices."""
+        memory = {}
+        for device in self.devices:
+            try:
+                processes = device.processes()
+            except Exception:
+                continue
+            for pid, process in processes.items():
+                value = _to_float(process.gpu_memory())
+                if not math.isnan(value):
+                    memory[pid] = memory.get(pid, 0.0) + value / 1024**2
+        return memory
+
+
+class FakeGpuReader:
+    """Slowly changing made-up values of num_devices gpus, for machines without gpus."""
+
+    def __init__(self, num_devices: int):
+        self.names = [f"{i}" for i in range(num_devices)]
+
+    def read(self) -> list[tuple[float, float]]:
+        t = time.time()
+        return [
+            (50 + 45 * math.sin(t / 30 + i), 50 + 30 * math.sin(t / 120 + i))
+            for i in range(len(self.names))
+        ]
+
+    def read_process_memory(self) -> dict[int, float]:
+        return {}
+
+
+def get_gpu_reader():
+    if torch.cuda.is_available():
+        try:
+            return GpuReader()
+        except Exception as e:
+            logger.warning(f"Failed to read gpus, sampling no gpu: {e}")
+    return FakeGpuReader(FAKE_GPUS)
+
+
+class ResourceSampler:
+    """Background thread sampling cpu, memory, gpus and tracked runs into ring buffers.
+
+    Pages read the buffers instead of checking resources themselves, so every session
+    sees the same samples and psutil.cpu_percent() is always the usage since the last
+    sample of this thread.
+
+    Args:
+        interval (float): seconds between samples.
+        history_size (int): number of samples kept.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, history_size: int = HISTORY_SIZE):
+        self.interval = interval
+        self.history_size = history_size
+
+        self._lock = threading.Lock()
+        self._gpu_reader = None
+        self._system = None
+        self._runs = {}  # name: {"pid", "buffer"}
+        self._processes = {}  # pid: psutil.Process, kept for their cpu_percent state
+        self._subscribers = []
+        self._thread = None
+
+    def _start(self):
+        # started on the first use, so run processes importing this never sample
+        if self._thread is not None:
+            return
+        self._gpu_reader = get_gpu_reader()
+        columns = ["cpu", "memory"]
+        for name in self._gpu_reader.names:
+            columns.extend([f"gpu{name}_util", f"gpu{name}_memory"])
+        self._system = RingBuffer(self.history_size, columns)
+        psutil.cpu_percent()  # the first call only starts the measurement
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _get_process(self, pid: int) -> psutil.Process:
+        process = self._processes.get(pid, None)
+        if process is None:
+            process = self._processes[pid] = psutil.Process(pid)
+            process.cpu_percent()
+        return process
+
+    def _sample_run(self, pid: int, gpu_memory: dict) -> tuple[list[float], dict]:
+        """Usage of the process tree of pid.
+
+        Returns:
+            tuple: [cpu %, rss (MB), gpu memory (MB)] of the tree and
+                {(pid, create_time): (cpu time, read bytes, write bytes)} of its processes.
+        """
+        try:
+            root = self._get_process(pid)
+            processes = [root, *root.children(recursive=True)]
+        except psutil.Error:
+            return [math.nan] * len(RUN_COLUMNS), {}
+        cpu, rss, gpu = 0.0, 0.0, 0.0
+        counters = {}
+        for process in processes:
+            try:
+                process = self._get_process(process.pid)
+                with process.oneshot():
+                    cpu += process.cpu_percent()
+                    rss += process.memory_info().rss / 1024**2
+                    # own times only, children are counted as processes of the tree
+                    cpu_times = process.cpu_times()
+                    try:
+                        io = process.io_counters()
+                        read_bytes, write_bytes = io.read_bytes, io.write_bytes
+                    except (psutil.AccessDenied, AttributeError):
+                        read_bytes, write_bytes = None, None
+                    counters[(process.pid, process.create_time())] = (
+                        cpu_times.user + cpu_times.system,
+                        read_bytes,
+                        write_bytes,
+                    )
+            except psutil.Error:
+                continue
+            gpu += gpu_memory.get(process.pid, 0.0)
+        return [cpu, rss, gpu], counters
+
+    def sample(self):
+        sample_time = time.time()
+        values = [psutil.cpu_percent(), psutil.virtual_memory().percent]
+        for util, memory in self._gpu_reader.read():
+            values.extend([util, memory])
+
+        with self._lock:
+            runs = {name: run["pid"] for name, run in self._runs.items()}
+        run_samples = {}
+        if runs:
+            gpu_memory = self._gpu_reader.read_process_memory()
+            for name, pid in runs.items():
+                run_samples[name] = self._sample_run(pid, gpu_memory)
+            alive = {process.pid for process in self._processes.values() if process.is_running()}
+            self._processes = {
+                pid: process for pid, process in self._processes.items() if pid in alive
+            }
+
+        with self._lock:
+            self._system.append(sample_time, values)
+            for name, (values, counters) in run_samples.items():
+                if name in self._runs:
+                    self._runs[name]["buffer"].append(sample_time, values)
+                    self._runs[name]["usage"].add(values, counters)
+            subscribers = list(self._subscribers)
+        # called without the lock, so subscribers may read the samples
+        for callback in subscribers:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Resource subscriber failed: {e}")
+
+    def _loop(self):
+        next_time = time.monotonic()
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Failed to sample resources: {e}")
+            # a slow sample delays the next ones instead of bunching them up
+            next_time = max(next_time + self.interval, time.monotonic())
+            time.sleep(next_time - time.monotonic())
+
+    def track(self, name: str, pid: int):
+        """Sample the process tree of a run from now on."""
+        with self._lock:
+            self._start()
+            self._runs[name] = {
+                "pid": pid,
+                "buffer": RingBuffer(self.history_size, RUN_COLUMNS),
+                "usage": RunUsage(),
+            }
+
+    def untrack(self, name: str):
+        with self._lock:
+            self._runs.pop(name, None)
+
+    def get_history(self) -> tuple[np.ndarray, np.ndarray, list[str]]:
+        """Times, values (time x column) and columns of the system samples."""
+        with self._lock:
+            self._start()
+            times, values = self._system.get()
+            return times, values, list(self._system.columns)
+
+    def get_run_history(self) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        """Times and values (time x RUN_COLUMNS) of each tracked run."""
+        with self._lock:
+            return {name: run["buffer"].get() for name, run in self._runs.items()}
+
+    def get_run_usage(self, name: str) -> dict:
+        """Usage of a tracked run since it was tracked, as RunInfo fields."""
+        with self._lock:
+            run = self._runs.get(name, None)
+            return run["usage"].to_dict() if run is not None else {}
+
+    def subscribe(self, callback):
+        """Call callback() after every sample."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def get_gpu_names(self) -> list[str]:
+        with self._lock:
+            self._start()
+            return list(self._gpu_reader.names)
+
+
+resource_sampler = ResourceSampler()
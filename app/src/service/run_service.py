@@ -1,151 +1,549 @@
-import queue
+import logging
+import os
 import threading
 import time
-from copy import copy
-from multiprocessing import Process
+from datetime import datetime
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+from pathlib import Path
 
+import psutil
 import torch
-from src.schema.run import RunInfo, RunType
-from waffle_utils.logger.time import datetime_now
+from src.schema.run import DATASET_RUN_TYPES, RunInfo, RunType
+from src.utils.process import AttachedProcess, get_func_path, load_func, run_target
+from waffle_utils.logger.time import DATE_FORMAT, datetime_now
 
-from .waffle_hub import get_status
+from . import dataset_job
+from .resource_sampler import resource_sampler
+from .run_store import RunStore
+from .scheduler import DeviceScheduler, get_default_scheduler
+from .status_watcher import status_watcher
+from .waffle_hub import dump_run_args, get_status, load_run_args
+from .worker_pool import PoolHandle, WarmWorkerPool
+
+logger = logging.getLogger(__name__)
+
+END_STATUS = ["SUCCESS", "FAILED", "STOPPED"]
+
+# processes re-attached after restart have no sentinel, so they are checked in this interval
+ATTACHED_PROCESS_CHECK_INTERVAL = 1.0
+# free device memory changes outside of the app, so blocked runs are re-checked in this interval
+SCHEDULE_RETRY_INTERVAL = 5.0
+# short runs that are sent to the warm worker pool when it is enabled
+POOL_RUN_TYPES = [RunType.EVALUATE, RunType.EXPORT_ONNX, RunType.EXPORT_WAFFLE]
 
 
 class RunService:
-    def __init__(self, max_run=2, max_queue=10):
+    def __init__(
+        self,
+        max_run=2,
+        max_queue=10,
+        store: RunStore = None,
+        scheduler: DeviceScheduler = None,
+        warm_workers: int = 0,
+        max_jobs_per_worker: int = 10,
+    ):
+        try:
+            torch.multiprocessing.set_start_method("spawn")
+        except RuntimeError:
+            pass
+
         self.max_run = max_run
         self.max_queue = max_queue
-        self.queue = queue.Queue(maxsize=max_queue)
+        self.pending_list = []
+        self.scheduler = scheduler or get_default_scheduler(max_run)
 
         self.stop = False
         self.run_dict = {}
-        self.run_loop_thread = threading.Thread(target=self.run_loop)
+        self.running_process_dict = {}
+        self.status_conn_dict = {}
+
+        # guards run_dict / running_process_dict and wakes run_loop when a slot frees
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
+        # wakes pages waiting for the runs to change, see wait_for_change
+        self._changed = threading.Condition(self._lock)
+        self._version = 0
+        # wakes supervise_loop when a new process is started
+        self._wakeup_reader, self._wakeup_writer = Pipe(duplex=False)
+
+        self.store = store
+        if self.store is not None:
+            self._restore()
+
+        # run() reads the pool, so it is built before run_loop can pick a restored run
+        self.worker_pool = (
+            WarmWorkerPool(warm_workers, max_jobs_per_worker=max_jobs_per_worker)
+            if warm_workers > 0
+            else None
+        )
+
+        self.run_loop_thread = threading.Thread(target=self.run_loop, daemon=True)
         self.run_loop_thread.start()
 
-        self.running_process_dict = {}
-        self.process_check_thread = threading.Thread(target=self.check_alive_loop)
-        self.process_check_thread.start()
+        self.supervise_thread = threading.Thread(target=self.supervise_loop, daemon=True)
+        self.supervise_thread.start()
 
-        try:
-            torch.multiprocessing.set_start_method("spawn")
-        except RuntimeError:
-            pass
+        # runs re-attached after restart send no status, so they follow the status files
+        self._unsubscribe_status = status_watcher.subscribe(self._on_status_change)
+        resource_sampler.subscribe(self._on_resource_sample)
 
     def __del__(self):
-        self.stop = True
+        self._unsubscribe_status()
+        with self._cond:
+            self.stop = True
+            self._cond.notify_all()
+        self._wakeup()
         self.run_loop_thread.join()
-        self.process_check_thread.join()
+        self.supervise_thread.join()
+        if self.worker_pool is not None:
+            self.worker_pool.close()
 
-    def add_run(self, name, run_type, func, args):
+    def _wakeup(self):
+        try:
+            self._wakeup_writer.send(None)
+        except OSError:
+            pass
+
+    def _restore(self):
+        for stored_run in self.store.load_all():
+            try:
+                run_info = RunInfo(**stored_run["run_info"])
+                args = load_run_args(stored_run["args"])
+                run = {
+                    "run_info": run_info,
+                    "func": load_func(stored_run["func"]),
+                    "args": args,
+                    "priority": run_info.priority or 0,
+                    "request": self.scheduler.get_request(
+                        run_info.run_type, args, memory=run_info.reserved_memory
+                    ),
+                }
+            except Exception as e:
+                # e.g. a row of an older RunInfo schema, skipped instead of failing the app
+                name = stored_run["run_info"].get("name", None)
+                logger.warning(f"Failed to restore run {name}: {e}")
+                continue
+            self.run_dict[run_info.name] = run
+
+            if run_info.start_time is None and run_info.end_time is None:
+                unfit_reason = self.scheduler.get_unfit_reason(run["request"])
+                if unfit_reason is not None:
+                    # the devices changed while the app was down
+                    self._fail_unfit(run_info, unfit_reason)
+                    self._save_run(run_info.name)
+                    continue
+                # 시작되지 않은 run은 다시 큐에 넣습니다.
+                if len(self.pending_list) >= self.max_queue:
+                    logger.warning(f"Queue is full. Drop restored run {run_info.name}")
+                    del self.run_dict[run_info.name]
+                    self.store.delete(run_info.name)
+                    continue
+                self.pending_list.append(run)
+            elif run_info.end_time is None:
+                try:
+                    start_time = datetime.strptime(run_info.start_time, DATE_FORMAT).timestamp()
+                    process = AttachedProcess(run_info.pid, start_time=start_time)
+                except (psutil.NoSuchProcess, psutil.AccessDenied, TypeError, ValueError):
+                    process = None
+
+                if process is not None and process.is_alive():
+                    self.running_process_dict[run_info.name] = process
+                    self.scheduler.allocate(run_info.name, run["request"])
+                    resource_sampler.track(run_info.name, process.pid)
+                    # also starts watching the status files of its hub
+                    self._log_run_info(run_info.name)
+                else:
+                    self._log_run_info(run_info.name)
+                    if run_info.status not in END_STATUS:
+                        run_info.status = "STOPPED"
+                        run_info.error_type = "ProcessLost"
+                        run_info.error_msg = "Process was lost while the app was restarting."
+                    run_info.end_time = datetime_now()
+                    self._save_run(run_info.name)
+
+    def _mark_changed(self):
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    def get_version(self) -> int:
+        """Counter of run changes (added, started, status or step, finished, deleted)."""
+        return self._version
+
+    def wait_for_change(self, version: int, timeout: float = None) -> int:
+        """Wait until the runs change after version or timeout.
+
+        Returns:
+            int: current version, equal to version on timeout.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def _save_run(self, name, with_payload=False):
+        self._mark_changed()
+        if self.store is None:
+            return
+        run = self.run_dict[name]
+        if with_payload:
+            self.store.save(
+                run["run_info"].to_dict(),
+                func=get_func_path(run["func"]),
+                args=dump_run_args(run["args"]),
+            )
+        else:
+            self.store.save(run["run_info"].to_dict())
+
+    def add_run(self, name, run_type, func, args, priority: int = 0, memory: int = None):
+        """Add a run to the queue.
+
+        Args:
+            name (str): run name
+            run_type (str): RunType
+            func (Callable): process target
+            args (dict): kwargs of func. args["args"]["device"] is used for scheduling.
+            priority (int, optional): higher runs first. Defaults to 0.
+            memory (int, optional): memory (MB) to reserve on each device. Defaults to None.
+        """
         if name in list(self.run_dict.keys()):
             # log 이미 존재하는 프로세스입니다.
             name = f"{name}_{time.time():.0f}"
-        if self.queue.qsize() >= self.max_queue:
+        if len(self.pending_list) >= self.max_queue:
             # log 큐가 가득 찼습니다.
             return
 
+        request = self.scheduler.get_request(run_type, args, memory=memory)
         run_info = RunInfo(
             name=name,
             run_type=run_type,
             scheduled_time=datetime_now(),
             status="INIT",
+            device=",".join(request["devices"]),
+            priority=priority,
+            reserved_memory=request["memory"],
         )
         run = {
             "run_info": run_info,
             "func": func,
             "args": args,
+            "priority": priority,
+            "request": request,
         }
 
-        self.run_dict[name] = run
-        self.queue.put(run)
+        # a run that can never fit would wait in the queue forever
+        unfit_reason = self.scheduler.get_unfit_reason(request)
+        if unfit_reason is not None:
+            self._fail_unfit(run_info, unfit_reason)
+
+        with self._cond:
+            self.run_dict[name] = run
+            self._save_run(name, with_payload=True)
+            if unfit_reason is None:
+                self.pending_list.append(run)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _fail_unfit(run_info: RunInfo, reason: str):
+        logger.warning(f"Run {run_info.name} can not be scheduled: {reason}")
+        run_info.status = "FAILED"
+        run_info.error_type = "Unschedulable"
+        run_info.error_msg = reason
+        run_info.end_time = datetime_now()
 
     def get_run(self, name):
         return self.run_dict.get(name, None)
 
     def get_run_list(self, run_type: str = None):
-        if run_type is None:
-            return [run_name for run_name in self.run_dict.keys()]
-        else:
-            return [
-                run_name
-                for run_name, run in self.run_dict.items()
-                if run["run_info"].run_type == run_type
-            ]
+        with self._lock:
+            if run_type is None:
+                return [run_name for run_name in self.run_dict.keys()]
+            else:
+                return [
+                    run_name
+                    for run_name, run in self.run_dict.items()
+                    if run["run_info"].run_type == run_type
+                ]
 
     def del_run_list(self, name: str):
-        if (name in self.run_dict.keys()) and (not name in self.get_running_process_name_list()):
-            del self.run_dict[name]
+        with self._lock:
+            if (name in self.run_dict.keys()) and (not name in self.get_running_process_name_list()):
+                run = self.run_dict.pop(name)
+                if run in self.pending_list:
+                    self.pending_list.remove(run)
+                if self.store is not None:
+                    self.store.delete(name)
+                self._mark_changed()
+
+    def _select_run(self):
+        if len(self.running_process_dict) >= self.max_run:
+            return None
+        return self.scheduler.select(self.pending_list)
 
     def run_loop(self):
-        while not self.stop:
-            while not self.queue.empty():
-                if len(self.running_process_dict) < self.max_run:
-                    run = self.queue.get()
-                    self.run(run_info=run["run_info"], func=run["func"], args=run["args"])
-                else:
-                    time.sleep(0.5)
-            time.sleep(1)
+        while True:
+            with self._cond:
+                run = None
+                while not self.stop:
+                    run = self._select_run()
+                    if run is not None:
+                        break
+                    self._cond.wait(SCHEDULE_RETRY_INTERVAL if self.pending_list else None)
+                if self.stop:
+                    return
+                self.pending_list.remove(run)
+                run_info = run["run_info"]
+                self.scheduler.allocate(run_info.name, run["request"])
+                try:
+                    self.run(run_info=run_info, func=run["func"], args=run["args"])
+                except Exception as e:
+                    logger.error(f"Failed to start run {run_info.name}: {e}")
+                    self.scheduler.release(run_info.name)
+                    run_info.status = "FAILED"
+                    run_info.error_type = e.__class__.__name__
+                    run_info.error_msg = str(e)
+                    run_info.end_time = datetime_now()
+                    self._save_run(run_info.name)
 
     def run(self, run_info, func, args):
-        process = Process(target=func, kwargs=args, name=run_info.name)
-        process.start()
-        self._add_running_process_dict(run_info.name, process)
+        handle = None
+        if self.worker_pool is not None and run_info.run_type in POOL_RUN_TYPES:
+            handle = self.worker_pool.submit(func, args)
+
+        if handle is not None:
+            process, parent_conn = handle, handle.conn
+        else:
+            parent_conn, child_conn = Pipe(duplex=False)
+            process = Process(
+                target=run_target,
+                kwargs={"func": func, "kwargs": args, "conn": child_conn},
+                name=run_info.name,
+            )
+            process.start()
+            child_conn.close()
+
+        with self._lock:
+            self.status_conn_dict[run_info.name] = parent_conn
+            self._add_running_process_dict(run_info.name, process)
+        self._wakeup()
 
     def kill(self, name):
-        process = self.running_process_dict.get(name, None)
-        if process:
-            self._del_running_process_dict(name)
+        with self._lock:
+            process = self.running_process_dict.get(name, None)
+        if process is None:
+            return
+        # waited for without the lock, so the loops and the pages are not blocked meanwhile
+        try:
             process.terminate()
             process.join(5)
-            process.kill()
-            process.join()
-            process.close()
-            self._log_run_info(name)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        except ValueError:
+            pass  # already finished and closed by supervise_loop
+        self._finish(name)
 
-    def _log_run_info(self, name):
+    def _log_run_info(self, name, refresh: bool = False):
         run = self.run_dict[name]
         run_info = run["run_info"]
-        status = get_status(run_info.run_type, run["args"]["hub"])
+        if run_info.run_type in DATASET_RUN_TYPES:
+            status = dataset_job.get_status(
+                run_info.run_type, run["args"]["dataset_name"], run["args"]["root_dir"]
+            )
+        else:
+            status = get_status(run_info.run_type, run["args"]["hub"], refresh=refresh)
         if status is None:
             return
-        run_info.status = status.status_desc
-        run_info.current_step = status.step
-        run_info.total_step = status.total_step
-        run_info.error_type = status.error_type
-        run_info.error_msg = status.error_msg
+        self._update_run_info(name, self._get_status_dict(status))
+
+    @staticmethod
+    def _get_status_dict(status) -> dict:
+        return {
+            "status_desc": str(status.status_desc),
+            "step": status.step,
+            "total_step": status.total_step,
+            "error_type": status.error_type,
+            "error_msg": status.error_msg,
+        }
+
+    def _on_status_change(self, hub_dir: Path, run_type: str, status):
+        if status is None:
+            return
+        with self._lock:
+            for name, process in self.running_process_dict.items():
+                run = self.run_dict[name]
+                if (
+                    isinstance(process, AttachedProcess)
+                    and run["run_info"].run_type == run_type
+                    and Path(run["args"]["hub"].hub_dir).absolute() == hub_dir
+                ):
+                    self._update_run_info(name, self._get_status_dict(status))
+
+    def _update_run_info(self, name, status: dict):
+        run_info = self.run_dict[name]["run_info"]
+        changed = (run_info.status, run_info.current_step) != (
+            status["status_desc"],
+            status["step"],
+        )
+        run_info.status = status["status_desc"]
+        run_info.current_step = status["step"]
+        run_info.total_step = status["total_step"]
+        run_info.error_type = status["error_type"]
+        run_info.error_msg = status["error_msg"]
+        if changed:
+            self._save_run(name)
 
     def _add_running_process_dict(self, name, process):
-        self.run_dict[name]["run_info"].start_time = datetime_now()
+        run_info = self.run_dict[name]["run_info"]
+        run_info.start_time = datetime_now()
+        run_info.pid = process.pid
         self.running_process_dict[name] = process
+        resource_sampler.track(name, process.pid)
+        self._save_run(name)
 
     def _del_running_process_dict(self, name):
         self.run_dict[name]["run_info"].end_time = datetime_now()
+        self._update_usage(name)
         del self.running_process_dict[name]
+        self.scheduler.release(name)
+        resource_sampler.untrack(name)
+        self._save_run(name)
+
+    def _update_usage(self, name):
+        """Copy the sampled usage and the steps per second of a run into its RunInfo."""
+        run_info = self.run_dict[name]["run_info"]
+        for key, value in resource_sampler.get_run_usage(name).items():
+            setattr(run_info, key, value)
+        if run_info.current_step and run_info.start_time:
+            start_time = datetime.strptime(run_info.start_time, DATE_FORMAT)
+            end_time = (
+                datetime.strptime(run_info.end_time, DATE_FORMAT)
+                if run_info.end_time
+                else datetime.now()
+            )
+            elapsed = (end_time - start_time).total_seconds()
+            if elapsed > 0:
+                run_info.steps_per_second = round(run_info.current_step / elapsed, 3)
+
+    def _on_resource_sample(self):
+        with self._lock:
+            for name in self.running_process_dict.keys():
+                self._update_usage(name)
+            if self.running_process_dict:
+                # shown live, saved to the store with the next transition
+                self._mark_changed()
+
+    def get_history(self) -> list[dict]:
+        """RunInfo of every run as dicts, in scheduled order."""
+        with self._lock:
+            return [run["run_info"].to_dict() for run in self.run_dict.values()]
 
     def get_running_process_name_list(self, run_type: str = None):
-        if run_type is None:
-            return [run_name for run_name in self.running_process_dict.keys()]
-        else:
-            return [
-                run_name
-                for run_name in self.running_process_dict.keys()
-                if self.run_dict[run_name]["run_info"].run_type == run_type
-            ]
+        with self._lock:
+            if run_type is None:
+                return [run_name for run_name in self.running_process_dict.keys()]
+            else:
+                return [
+                    run_name
+                    for run_name in self.running_process_dict.keys()
+                    if self.run_dict[run_name]["run_info"].run_type == run_type
+                ]
+
+    def _recv_status(self, name, conn):
+        try:
+            while conn.poll():
+                message = conn.recv()
+                if message["type"] == "status":
+                    self._update_run_info(name, message["status"])
+                elif message["type"] == "error":
+                    run_info = self.run_dict[name]["run_info"]
+                    run_info.error_type = message["error_type"]
+                    run_info.error_msg = message["error_msg"]
+                    self._mark_changed()
+                elif message["type"] == "done":
+                    # job on a warm worker is finished, but the worker is still alive
+                    self.running_process_dict[name].done = True
+                    break
+        except (EOFError, OSError):
+            conn.close()
+            del self.status_conn_dict[name]
+
+    def _finish(self, name):
+        with self._cond:
+            if name not in self.running_process_dict:
+                return
+            process = self.running_process_dict[name]
+            conn = self.status_conn_dict.get(name, None)
+            if conn is not None:
+                self._recv_status(name, conn)
+                if name in self.status_conn_dict:
+                    if not isinstance(process, PoolHandle):
+                        conn.close()
+                    del self.status_conn_dict[name]
+
+            run_info = self.run_dict[name]["run_info"]
+            if run_info.status not in END_STATUS:
+                # killed before waffle_hub could write its final status, or it was written
+                # after the last event of the status watcher
+                self._log_run_info(name, refresh=True)
+            if run_info.status not in END_STATUS:
+                run_info.status = "FAILED" if run_info.error_type else "STOPPED"
 
-    def check_alive_loop(self):
+            self._del_running_process_dict(name)
+            process.join()
+            process.close()
+            self._cond.notify_all()
+
+    def supervise_loop(self):
         while not self.stop:
-            while len(self.running_process_dict) > 0:
-                dict_keys = copy(list(self.running_process_dict.keys()))
-                for key in dict_keys:
-                    process = self.running_process_dict[key]
-                    self._log_run_info(key)
-                    if self.run_dict[key]["run_info"].status in ["SUCCESS", "FAILED", "STOPPED"]:
-                        self._del_running_process_dict(key)
-                        process.kill()
-                        process.join()
-                        process.close()
-                time.sleep(0.5)
-            time.sleep(1)
-
-
-run_service = RunService()
+            with self._lock:
+                sentinel_dict = {
+                    process.sentinel: name
+                    for name, process in self.running_process_dict.items()
+                    if not isinstance(process, AttachedProcess)
+                }
+                conn_dict = dict((conn, name) for name, conn in self.status_conn_dict.items())
+                attached = [
+                    name
+                    for name, process in self.running_process_dict.items()
+                    if isinstance(process, AttachedProcess)
+                ]
+
+            try:
+                ready = wait(
+                    [self._wakeup_reader, *conn_dict.keys(), *sentinel_dict.keys()],
+                    timeout=ATTACHED_PROCESS_CHECK_INTERVAL if attached else None,
+                )
+            except (OSError, ValueError):
+                # a process was finished by kill() while waiting
+                continue
+
+            with self._lock:
+                if self._wakeup_reader in ready:
+                    while self._wakeup_reader.poll():
+                        self._wakeup_reader.recv()
+                for obj in ready:
+                    if obj in conn_dict and conn_dict[obj] in self.status_conn_dict:
+                        name = conn_dict[obj]
+                        self._recv_status(name, obj)
+                        process = self.running_process_dict.get(name, None)
+                        if isinstance(process, PoolHandle) and process.done:
+                            self._finish(name)
+                for obj in ready:
+                    if obj in sentinel_dict:
+                        self._finish(sentinel_dict[obj])
+
+                for name in attached:
+                    if name not in self.running_process_dict:
+                        continue
+                    if self.run_dict[name]["run_info"].run_type in DATASET_RUN_TYPES:
+                        self._log_run_info(name)
+                    if not self.running_process_dict[name].is_alive():
+                        self._finish(name)
+
+
+run_service = RunService(
+    store=RunStore(os.getenv("WAFFLE_APP_RUN_STORE", "logs/runs.db")),
+    warm_workers=int(os.getenv("WAFFLE_APP_WARM_WORKERS", 0)),
+    max_jobs_per_worker=int(os.getenv("WAFFLE_APP_MAX_JOBS_PER_WORKER", 10)),
+)
@@ -0,0 +1,119 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+from waffle_utils.logger.time import datetime_now
+
+
+class RunStore:
+    """SQLite(WAL) journal of runs.
+
+    Every status change of a run is appended to the `transitions` table and the latest
+    snapshot is kept in the `runs` table, so the run list survives app restarts. Saves
+    that only update the progress or usage of a run are not journaled, so long runs do
+    not grow the table.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                run_type TEXT,
+                status TEXT,
+                func TEXT,
+                args TEXT,
+                run_info TEXT
+            );
+            CREATE TABLE IF NOT EXISTS transitions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                status TEXT,
+                time TEXT,
+                run_info TEXT
+            );
+            """
+        )
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def save(self, run_info: dict, func: str = None, args: dict = None):
+        """Upsert the run snapshot and journal the transition if the status changed.
+
+        Args:
+            run_info (dict): RunInfo as dict
+            func (str, optional): "module:qualname" of the run target. Kept if None.
+            args (dict, optional): json serializable run arguments. Kept if None.
+        """
+        run_info_json = json.dumps(run_info, default=str)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT status FROM runs WHERE name = ?", (run_info["name"],)
+            ).fetchone()
+            self._conn.execute(
+                """
+                INSERT INTO runs (name, run_type, status, func, args, run_info)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET
+                    status=excluded.status,
+                    run_info=excluded.run_info,
+                    func=COALESCE(excluded.func, runs.func),
+                    args=COALESCE(excluded.args, runs.args)
+                """,
+                (
+                    run_info["name"],
+                    run_info["run_type"],
+                    run_info["status"],
+                    func,
+                    json.dumps(args, default=str) if args is not None else None,
+                    run_info_json,
+                ),
+            )
+            if row is None or row[0] != run_info["status"]:
+                self._conn.execute(
+                    "INSERT INTO transitions (name, status, time, run_info) VALUES (?, ?, ?, ?)",
+                    (run_info["name"], run_info["status"], datetime_now(), run_info_json),
+                )
+
+    def delete(self, name: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM runs WHERE name = ?", (name,))
+            self._conn.execute("DELETE FROM transitions WHERE name = ?", (name,))
+
+    def load_all(self) -> list[dict]:
+        """Load every stored run in scheduled order.
+
+        Returns:
+            list[dict]: {"run_info": dict, "func": str, "args": dict}
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT func, args, run_info FROM runs ORDER BY seq"
+            ).fetchall()
+        return [
+            {
+                "run_info": json.loads(run_info),
+                "func": func,
+                "args": json.loads(args) if args else {},
+            }
+            for func, args, run_info in rows
+        ]
+
+    def get_transitions(self, name: str) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, time FROM transitions WHERE name = ? ORDER BY id", (name,)
+            ).fetchall()
+        return [{"status": status, "time": time} for status, time in rows]
@@ -0,0 +1,170 @@
+import os
+import threading
+from collections import Counter
+
+from src.schema.run import RunType
+from src.utils.resource import get_device_memory_info
+
+# default memory reservation (MB) per run type, used when add_run does not give one
+DEFAULT_MEMORY = {
+    RunType.TRAIN: 4096,
+    RunType.EVALUATE: 2048,
+    RunType.INFERENCE: 2048,
+    RunType.EXPORT_ONNX: 1024,
+    RunType.EXPORT_WAFFLE: 512,
+    RunType.DATASET_IMPORT: 1024,
+    RunType.DATASET_EXPORT: 1024,
+    RunType.DATASET_SPLIT: 512,
+    RunType.DATASET_MERGE: 1024,
+}
+
+
+class DeviceBackend:
+    def get_memory_info(self) -> dict[str, dict]:
+        return get_device_memory_info()
+
+
+class FakeDeviceBackend(DeviceBackend):
+    """Device backend with fixed devices for machines without gpu.
+
+    Args:
+        devices (dict[str, int]): {device: total memory (MB)}. "cpu" is added if not given.
+    """
+
+    def __init__(self, devices: dict[str, int]):
+        self.devices = {"cpu": 16384, **devices}
+
+    @classmethod
+    def from_string(cls, s: str) -> "FakeDeviceBackend":
+        """Parse "0:8192,1:8192" to two 8GB gpus."""
+        devices = {}
+        for item in s.split(","):
+            device, memory = item.split(":")
+            devices[device.strip()] = int(memory)
+        return cls(devices)
+
+    def get_memory_info(self) -> dict[str, dict]:
+        return {device: {"total": memory, "free": memory} for device, memory in self.devices.items()}
+
+
+def parse_devices(device: str) -> list[str]:
+    if not device or "cpu" in str(device):
+        return ["cpu"]
+    return [d.strip() for d in str(device).split(",") if d.strip()]
+
+
+class DeviceScheduler:
+    """Pick the next run that fits on its devices.
+
+    A gpu is given to at most `gpu_slots` runs at once and every run reserves memory on
+    each of its devices. Among the runs that fit, higher priority goes first, then the
+    run type with fewer running runs (fair share), then the scheduled order.
+    """
+
+    def __init__(self, backend: DeviceBackend = None, gpu_slots: int = 1, cpu_slots: int = 2):
+        self.backend = backend or DeviceBackend()
+        self.gpu_slots = gpu_slots
+        self.cpu_slots = cpu_slots
+
+        self._lock = threading.Lock()
+        self.allocations = {}  # run name: {"devices", "memory", "run_type"}
+
+    def get_request(self, run_type: str, args: dict, memory: int = None) -> dict:
+        run_args = args.get("args", None) or {}
+        devices = parse_devices(run_args.get("device", None))
+        if memory is None:
+            # the default is capped at the smallest device, so it also fits on small gpus
+            memory_info = self.backend.get_memory_info()
+            totals = [memory_info[device]["total"] for device in devices if device in memory_info]
+            memory = min([DEFAULT_MEMORY.get(run_type, 0), *totals])
+        return {
+            "devices": devices,
+            "memory": memory,
+            "run_type": run_type,
+        }
+
+    def get_unfit_reason(self, request: dict) -> str:
+        """Why a request can never fit on its devices, None if it can fit once they are free."""
+        memory_info = self.backend.get_memory_info()
+        for device in request["devices"]:
+            if device not in memory_info:
+                return f"Device {device} does not exist. Devices: {', '.join(memory_info)}"
+            if request["memory"] > memory_info[device]["total"]:
+                return (
+                    f"Reserved memory {request['memory']} MB is larger than the total memory "
+                    f"{memory_info[device]['total']} MB of device {device}"
+                )
+        return None
+
+    def _used(self) -> tuple[Counter, Counter]:
+        slots, memory = Counter(), Counter()
+        for allocation in self.allocations.values():
+            for device in allocation["devices"]:
+                slots[device] += 1
+                memory[device] += allocation["memory"]
+        return slots, memory
+
+    def _fits(self, request: dict, memory_info: dict, slots: Counter, memory: Counter) -> bool:
+        for device in request["devices"]:
+            if device not in memory_info:
+                return False
+            max_slots = self.cpu_slots if device == "cpu" else self.gpu_slots
+            if slots[device] >= max_slots:
+                return False
+            available = min(
+                memory_info[device]["free"], memory_info[device]["total"] - memory[device]
+            )
+            if available < request["memory"]:
+                return False
+        return True
+
+    def select(self, candidates: list[dict]) -> dict:
+        """Select a run to start.
+
+        Args:
+            candidates (list[dict]): runs with "request", "priority" in scheduled order
+
+        Returns:
+            dict: run to start or None if nothing fits now
+        """
+        if not candidates:
+            return None
+        with self._lock:
+            memory_info = self.backend.get_memory_info()
+            slots, memory = self._used()
+            running_per_type = Counter(a["run_type"] for a in self.allocations.values())
+
+            ordered = sorted(
+                enumerate(candidates),
+                key=lambda x: (
+                    -x[1]["priority"],
+                    running_per_type[x[1]["request"]["run_type"]],
+                    x[0],
+                ),
+            )
+            for _, run in ordered:
+                if self._fits(run["request"], memory_info, slots, memory):
+                    return run
+        return None
+
+    def allocate(self, name: str, request: dict):
+        with self._lock:
+            self.allocations[name] = request
+
+    def release(self, name: str):
+        with self._lock:
+            self.allocations.pop(name, None)
+
+    def get_allocations(self) -> dict:
+        with self._lock:
+            return dict(self.allocations)
+
+
+def get_default_scheduler(max_run: int) -> DeviceScheduler:
+    fake_devices = os.getenv("WAFFLE_APP_FAKE_DEVICES", None)
+    backend = FakeDeviceBackend.from_string(fake_devices) if fake_devices else DeviceBackend()
+    return DeviceScheduler(
+        backend=backend,
+        gpu_slots=int(os.getenv("WAFFLE_APP_GPU_SLOTS", 1)),
+        cpu_slots=max_run,
+    )
@@ -0,0 +1,283 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+from pathlib import Path
+
+from src.schema.run import RunType
+from waffle_hub.hub import Hub
+from waffle_hub.schema.running_status import (
+    EvaluatingStatus,
+    ExportingOnnxStatus,
+    ExportingWaffleStatus,
+    InferencingStatus,
+    TrainingStatus,
+)
+
+logger = logging.getLogger(__name__)
+
+STATUS_FILES = {
+    RunType.TRAIN: (Hub.TRAINING_STATUS_FILE, TrainingStatus),
+    RunType.EVALUATE: (Hub.EVALUATING_STATUS_FILE, EvaluatingStatus),
+    RunType.INFERENCE: (Hub.INFERENCING_STATUS_FILE, InferencingStatus),
+    RunType.EXPORT_ONNX: (Hub.EXPORTING_ONNX_STATUS_FILE, ExportingOnnxStatus),
+    RunType.EXPORT_WAFFLE: (Hub.EXPORTING_WAFFLE_STATUS_FILE, ExportingWaffleStatus),
+}
+STATUS_FILE_NAMES = {file.name: run_type for run_type, (file, _) in STATUS_FILES.items()}
+
+# hubs without an inotify watch are stat'ed in this interval
+POLL_INTERVAL = float(os.getenv("WAFFLE_APP_STATUS_POLL_INTERVAL", 0.5))
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+# the status dir is made by waffle_hub on the first run, so the hub dir is watched for it
+HUB_DIR_MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE_SELF | IN_ONLYDIR
+# files are read once they are closed, not while they are written
+STATUS_DIR_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF
+
+
+def _stat_key(path: Path) -> tuple:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class Inotify:
+    """inotify of linux through libc."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self) -> list[tuple[int, int, str]]:
+        """Pending events as (wd, mask, name)."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0").decode()
+                offset += length
+                events.append((wd, mask, name))
+
+
+class StatusWatcher:
+    """In-memory snapshot of the running status files of the hubs.
+
+    A hub is watched from its first lookup on: with inotify its files are read again only
+    when they are closed after a write, and where inotify is not available (or out of
+    watches) they are stat'ed every POLL_INTERVAL and read again when they changed.
+    Subscribers are called with (hub_dir, run_type, status) on every change.
+    """
+
+    def __init__(self, poll_interval: float = POLL_INTERVAL):
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._hubs = {}  # hub_dir: {run_type: (stat_key, status)}
+        self._watches = {}  # wd: (hub_dir, is_status_dir)
+        self._polled = set()  # hub dirs without an inotify watch of their status dir
+        self._subscribers = []
+        self._inotify = None
+        self._thread = None
+
+    def _start(self):
+        # started on the first lookup, so processes that never look up (runs) do not watch
+        if self._thread is not None:
+            return
+        try:
+            self._inotify = Inotify()
+        except (OSError, AttributeError, TypeError) as e:
+            logger.info(f"inotify is not available, polling status files instead: {e}")
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _read(self, hub_dir: Path, run_type: str, entry: tuple) -> tuple:
+        status_file, status_class = STATUS_FILES[run_type]
+        key = _stat_key(hub_dir / status_file)
+        if entry is not None and entry[0] == key:
+            return entry
+        if key is None:
+            return (None, None)
+        try:
+            return (key, status_class.load(hub_dir / status_file))
+        except Exception:
+            # being written, read again on the next event or poll
+            return entry if entry is not None else (None, None)
+
+    def _update(self, hub_dir: Path, run_types: list = None) -> list:
+        """Read the changed status files of a hub. Returns the changes to notify."""
+        entries = self._hubs.get(hub_dir, None)
+        if entries is None:
+            return []
+        changes = []
+        for run_type in run_types or STATUS_FILES.keys():
+            entry = entries.get(run_type, None)
+            new_entry = self._read(hub_dir, run_type, entry)
+            if new_entry is not entry:
+                entries[run_type] = new_entry
+                if entry is None or new_entry[1] != entry[1]:
+                    changes.append((hub_dir, run_type, new_entry[1]))
+        return changes
+
+    def _add_watches(self, hub_dir: Path):
+        self._polled.add(hub_dir)
+        if self._inotify is None:
+            return
+        try:
+            wd = self._inotify.add_watch(hub_dir, HUB_DIR_MASK)
+        except OSError as e:
+            logger.warning(f"Failed to watch {hub_dir}, polling it instead: {e}")
+            return
+        self._watches[wd] = (hub_dir, False)
+        self._polled.discard(hub_dir)
+        try:
+            wd = self._inotify.add_watch(hub_dir / Hub.RUNNING_STATUS_DIR, STATUS_DIR_MASK)
+            self._watches[wd] = (hub_dir, True)
+        except FileNotFoundError:
+            pass  # no status dir yet, watched on IN_CREATE of the hub dir
+        except OSError as e:
+            logger.warning(f"Failed to watch {hub_dir}, polling it instead: {e}")
+            self._polled.add(hub_dir)
+
+    def _watch(self, hub_dir: Path):
+        self._hubs[hub_dir] = {}
+        self._add_watches(hub_dir)
+        self._update(hub_dir)
+
+    def _forget(self, hub_dir: Path):
+        self._hubs.pop(hub_dir, None)
+        self._polled.discard(hub_dir)
+        for wd, (watched_dir, _) in list(self._watches.items()):
+            if watched_dir == hub_dir:
+                del self._watches[wd]
+                self._inotify.rm_watch(wd)
+
+    def _handle_events(self) -> list:
+        changes = []
+        for wd, mask, name in self._inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, every hub is read again
+                for hub_dir in list(self._hubs.keys()):
+                    changes.extend(self._update(hub_dir))
+                continue
+            if wd not in self._watches:
+                continue
+            hub_dir, is_status_dir = self._watches[wd]
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+            if mask & IN_DELETE_SELF:
+                if is_status_dir:
+                    # removed with its files, watched again once it is made again
+                    changes.extend(self._update(hub_dir))
+                else:
+                    self._forget(hub_dir)
+                continue
+            if is_status_dir:
+                if name in STATUS_FILE_NAMES:
+                    changes.extend(self._update(hub_dir, [STATUS_FILE_NAMES[name]]))
+            elif name == Hub.RUNNING_STATUS_DIR.name:
+                try:
+                    wd = self._inotify.add_watch(hub_dir / name, STATUS_DIR_MASK)
+                    self._watches[wd] = (hub_dir, True)
+                except OSError:
+                    self._polled.add(hub_dir)
+                # files written before the watch was added
+                changes.extend(self._update(hub_dir))
+        return changes
+
+    def _poll(self) -> list:
+        changes = []
+        for hub_dir in list(self._polled):
+            if not hub_dir.exists():
+                self._forget(hub_dir)
+                continue
+            changes.extend(self._update(hub_dir))
+        return changes
+
+    def _notify(self, changes: list):
+        for hub_dir, run_type, status in changes:
+            for callback in list(self._subscribers):
+                try:
+                    callback(hub_dir, run_type, status)
+                except Exception as e:
+                    logger.error(f"Status subscriber failed: {e}")
+
+    def _loop(self):
+        while True:
+            if self._inotify is not None:
+                select.select([self._inotify.fd], [], [], self.poll_interval)
+            else:
+                threading.Event().wait(self.poll_interval)
+            with self._lock:
+                changes = self._handle_events() if self._inotify is not None else []
+                changes.extend(self._poll())
+            # called without the lock, so subscribers may look up statuses
+            self._notify(changes)
+
+    def get(self, hub_dir, run_type: str):
+        """Running status of a hub from the snapshot, None if it has no status file."""
+        if run_type not in STATUS_FILES:
+            return None
+        hub_dir = Path(hub_dir).absolute()
+        with self._lock:
+            self._start()
+            if hub_dir not in self._hubs:
+                self._watch(hub_dir)
+            entry = self._hubs[hub_dir].get(run_type, None)
+        return entry[1] if entry is not None else None
+
+    def refresh(self, hub_dir):
+        """Read the changed status files of a hub now, e.g. right after a run ends."""
+        hub_dir = Path(hub_dir).absolute()
+        with self._lock:
+            changes = self._update(hub_dir)
+        self._notify(changes)
+
+    def subscribe(self, callback):
+        """Call callback(hub_dir, run_type, status) on every change of a watched status.
+
+        Returns:
+            Callable: unsubscribes the callback.
+        """
+        with self._lock:
+            self._start()
+            self._subscribers.append(callback)
+        return lambda: self._subscribers.remove(callback)
+
+
+status_watcher = StatusWatcher()
@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 512
+THUMBNAIL_QUALITY = 85
+
+
+def _make_thumbnail(src: Path, dst: Path, size: int) -> int:
+    with Image.open(src) as image:
+        # let the jpeg decoder downscale while decoding, much cheaper than a full decode
+        image.draft("RGB", (size, size))
+        image = image.convert("RGB")
+        image.thumbnail((size, size))
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        # a tmp file per call, so concurrent requests of the same thumbnail do not collide
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", prefix=f".{dst.name}.", dir=dst.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, format="JPEG", quality=THUMBNAIL_QUALITY)
+            os.replace(tmp, dst)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+    return dst.stat().st_size
+
+
+class ThumbnailCache:
+    """Content-addressed on-disk thumbnail cache.
+
+    A thumbnail is keyed by the source path, mtime and size, so an edited image gets a
+    new thumbnail and the old one is evicted in time. Thumbnails are stored as
+    `<cache_dir>/<key>/<image name>.jpg` so viewers still show the original names, and the
+    least recently used ones are removed when the total size exceeds `max_bytes`.
+
+    Args:
+        cache_dir (str): directory to store thumbnails.
+        max_bytes (int): total size limit of the thumbnails.
+        size (int): longest side of a thumbnail.
+        num_workers (int): threads generating thumbnails.
+    """
+
+    def __init__(
+        self, cache_dir: str, max_bytes: int, size: int = THUMBNAIL_SIZE, num_workers: int = 4
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.size = size
+        self.num_workers = num_workers
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._entries = None  # key: bytes, least recently used first
+        self._bytes = 0
+
+    def _load_entries(self):
+        entries = []
+        if self.cache_dir.exists():
+            for entry in os.scandir(self.cache_dir):
+                if not entry.is_dir():
+                    continue
+                # tmp files left by a crash are not thumbnails
+                files = [
+                    f for f in os.scandir(entry.path) if f.is_file() and not f.name.endswith(".tmp")
+                ]
+                if not files:
+                    continue
+                stat = files[0].stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        self._entries = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._bytes = sum(self._entries.values())
+
+    def get_key(self, path: Path) -> str:
+        stat = os.stat(path)
+        return hashlib.sha1(
+            f"{Path(path).resolve()}:{stat.st_mtime_ns}:{stat.st_size}:{self.size}".encode()
+        ).hexdigest()
+
+    def _get_thumbnail_path(self, key: str, path: Path) -> Path:
+        return self.cache_dir / key / f"{Path(path).stem}.jpg"
+
+    def _touch(self, key: str, thumbnail_path: Path):
+        self._entries.move_to_end(key)
+        try:
+            os.utime(thumbnail_path)
+        except FileNotFoundError:
+            pass
+
+    def _add(self, key: str, size: int):
+        self._entries[key] = size
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            old_key, old_size = self._entries.popitem(last=False)
+            self._bytes -= old_size
+            shutil.rmtree(self.cache_dir / old_key, ignore_errors=True)
+
+    def get_thumbnails(self, paths: list) -> list[Path]:
+        """Get thumbnail paths of the images, generating the missing ones in parallel.
+
+        Images that can not be read are returned as they are.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._load_entries()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.num_workers, thread_name_prefix="thumbnail")
+
+        results = list(paths)
+        missing = {}
+        with self._lock:
+            for i, path in enumerate(paths):
+                try:
+                    key = self.get_key(path)
+                except OSError:
+                    continue
+                thumbnail_path = self._get_thumbnail_path(key, path)
+                if key in self._entries and thumbnail_path.exists():
+                    self._touch(key, thumbnail_path)
+                    results[i] = thumbnail_path
+                else:
+                    missing[i] = (key, thumbnail_path)
+
+        futures = {
+            i: self._executor.submit(_make_thumbnail, paths[i], thumbnail_path, self.size)
+            for i, (_, thumbnail_path) in missing.items()
+        }
+        for i, future in futures.items():
+            key, thumbnail_path = missing[i]
+            try:
+                size = future.result()
+            except Exception as e:
+                logger.warning(f"Failed to make thumbnail of {paths[i]}: {e}")
+                continue
+            with self._lock:
+                if key not in self._entries:
+                    self._add(key, size)
+            results[i] = thumbnail_path
+
+        return results
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            if self._entries is None:
+                self._load_entries()
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+thumbnail_cache = ThumbnailCache(
+    cache_dir=os.getenv("WAFFLE_APP_THUMBNAIL_DIR", "logs/thumbnails"),
+    max_bytes=int(os.getenv("WAFFLE_APP_THUMBNAIL_CACHE_MB", 512)) * 1024**2,
+    size=int(os.getenv("WAFFLE_APP_THUMBNAIL_SIZE", THUMBNAIL_SIZE)),
+)
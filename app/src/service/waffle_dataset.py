@@ -1,14 +1,28 @@
 import os
-import random
-from collections import OrderedDict
+import uuid
 from pathlib import Path
-from tempfile import NamedTemporaryFile, TemporaryDirectory
+from tempfile import TemporaryDirectory
 from typing import Union
 
+import numpy as np
+from src.utils.cache import LRUCache, get_cache_dir
 from waffle_hub.dataset import Dataset
 from waffle_hub.schema.fields import Image
 from waffle_utils.file import io, search
 
+from . import coco_import, dataset_export, dataset_merge, dataset_split, image_ingest
+from .dataset_catalog import DatasetCatalog, dataset_catalog
+from .dataset_sampler import SAMPLE_METHODS, dataset_sampler
+from .dataset_statistics import (
+    ASPECT_RATIO_BINS,
+    BBOX_SIZE_BINS,
+    OBJECTS_PER_IMAGE_BINS,
+    RESOLUTION_BINS,
+    statistics_engine,
+)
+from .dataset_store import ColumnStore, column_store_manager
+from .draw_cache import draw_cache
+
 SET_CODES = {
     "total": None,
     "train": 0,
@@ -18,34 +32,77 @@ SET_CODES = {
 }
 
 
+# rough memory of one loaded image or annotation with its index entries
+DATASET_RECORD_BYTES = 2048
+
+
+def _estimate_dataset_bytes(dataset: Dataset) -> int:
+    return (len(dataset.image_dict) + len(dataset.annotation_dict)) * DATASET_RECORD_BYTES
+
+
+dataset_cache = LRUCache(
+    max_weight=int(os.getenv("WAFFLE_APP_DATASET_CACHE_MB", 2048)) * 1024**2,
+    weigher=_estimate_dataset_bytes,
+)
+
+
+def _load(dataset_name: str, root_dir: str = None) -> Dataset:
+    root_dir = Dataset.parse_root_dir(root_dir)
+    return dataset_cache.get_or_load(
+        (str(root_dir), dataset_name),
+        lambda: Dataset.load(dataset_name, root_dir=root_dir),
+        version=DatasetCatalog.get_signature(root_dir / dataset_name),
+    )
+
+
+def _invalidate(dataset_name: str, root_dir: str = None):
+    root_dir = Dataset.parse_root_dir(root_dir)
+    dataset_cache.invalidate((str(root_dir), dataset_name))
+
+
+def get_column_store(dataset_name: str, root_dir: str = None) -> ColumnStore:
+    """Memory mapped columns of the labeled images and annotations of a dataset."""
+    return column_store_manager.get_store(
+        dataset_name, root_dir, lambda: _load(dataset_name, root_dir=root_dir)
+    )[1]
+
+
+def get_dataset_cache_stats() -> dict:
+    return dataset_cache.get_stats()
+
+
 def get_parse_root_dir() -> Path:
     return Dataset.parse_root_dir(os.getenv("WAFFLE_DATASET_ROOT_DIR", None))
 
 
-def get_dataset_list(root_dir: str = None, task: str = None) -> list[str]:
-    dataset_list = Dataset.get_dataset_list(root_dir=root_dir)
-    temp_list = dataset_list.copy()
-    if task:
-        for dataset_name in dataset_list:
-            dataset = Dataset.load(dataset_name, root_dir=root_dir)
-            if dataset.task.lower() != task.lower():
-                temp_list.remove(dataset_name)
+def get_dataset_entries(root_dir: str = None) -> list[dict]:
+    """Get {"name", "info", "stats"} of every dataset from the dataset catalog."""
+    return dataset_catalog.scan(root_dir)
 
-    return temp_list
+
+def get_dataset_list(root_dir: str = None, task: str = None) -> list[str]:
+    return [
+        entry["name"]
+        for entry in get_dataset_entries(root_dir)
+        if not task or entry["info"]["task"].lower() == task.lower()
+    ]
 
 
 def get_dataset_info_dict(dataset_name: str, root_dir: str = None) -> dict:
-    dataset = Dataset.load(dataset_name, root_dir=root_dir)
+    entry = dataset_catalog.get(dataset_name, root_dir)
+    if entry is not None:
+        return entry["info"]
+    dataset = _load(dataset_name, root_dir=root_dir)
     return dataset.get_dataset_info().to_dict()
 
 
 def get_category_names(dataset_name: str, root_dir: str = None) -> list[str]:
-    dataset = Dataset.load(dataset_name, root_dir=root_dir)
+    dataset = _load(dataset_name, root_dir=root_dir)
     return dataset.get_category_names()
 
 
 def get_images(dataset_name: str, set_name: str = "total", root_dir: str = None) -> list[Image]:
-    dataset = Dataset.load(dataset_name, root_dir=root_dir)
+    dataset = _load(dataset_name, root_dir=root_dir)
     if set_name == "total":
         return dataset.get_images()
     else:
@@ -53,58 +110,56 @@ def get_images(dataset_name: str, set_name: str = "total", root_dir: str = None)
         return dataset.get_images(image_ids) if image_ids else []
 
 
+def get_image_ids(
+    dataset_name: str, set_name: str = "total", category_id: int = None, root_dir: str = None
+) -> np.ndarray:
+    """Ids of the labeled images of a split (and of a category) from the column store."""
+    store = get_column_store(dataset_name, root_dir=root_dir)
+    return store.get_image_ids(set_name=set_name, category_id=category_id)
+
+
 def get_statistics(dataset_name: str, set_name: str = "total", root_dir: str = None) -> dict:
-    dataset = Dataset.load(dataset_name, root_dir=root_dir)
-    if dataset.task.lower() == "text_recognition":
+    info = get_dataset_info_dict(dataset_name, root_dir=root_dir)
+    if info["task"].lower() == "text_recognition":
         # raise ValueError("Text recognition dataset does not support statistics.")
         return None
-    if set_name == "total":
-        images = dataset.get_images()
-    else:
-        image_ids = dataset.get_split_ids()[SET_CODES[set_name]]
-        images = dataset.get_images(image_ids) if image_ids else []
-
-    image_ids = [image.image_id for image in images]
-    num_images = len(images)
-
-    categories = dataset.get_categories()
-    num_categories = len(categories)
-
-    image_to_annotations = dataset.image_to_annotations
-    image_to_annotations = {image_id: image_to_annotations[image_id] for image_id in image_ids}
-
-    num_annotations = 0
-    num_images_per_category = OrderedDict({category.category_id: set() for category in categories})
-    num_instances_per_category = OrderedDict({category.category_id: 0 for category in categories})
-    for image_id, annotations in image_to_annotations.items():
-        num_annotations += len(annotations)
-        for annotation in annotations:
-            num_images_per_category[annotation.category_id].add(image_id)
-            num_instances_per_category[annotation.category_id] += 1
-    num_images_per_category = OrderedDict(
-        {category_id: len(image_ids) for category_id, image_ids in num_images_per_category.items()}
-    )
 
-    return {
-        "images": images,
-        "categories": categories,
-        "num_images": num_images,
-        "num_categories": num_categories,
-        "image_to_annotations": image_to_annotations,
-        "num_annotations": num_annotations,
-        "num_images_per_category": num_images_per_category,
-        "num_instances_per_category": num_instances_per_category,
+    statistics = statistics_engine.get_statistics(
+        dataset_name,
+        root_dir=root_dir,
+        load_dataset=lambda: _load(dataset_name, root_dir=root_dir),
+        set_name=set_name,
+    )
+    category_names = {
+        category["category_id"]: category["name"] for category in info.get("categories", [])
     }
+    statistics["category_names"] = [
+        category_names.get(category_id, str(category_id))
+        for category_id in statistics["category_ids"]
+    ]
+    statistics["bbox_size_bins"] = BBOX_SIZE_BINS.tolist()
+    statistics["aspect_ratio_bins"] = ASPECT_RATIO_BINS.tolist()
+    statistics["resolution_bins"] = RESOLUTION_BINS.tolist()
+    statistics["objects_per_image_bins"] = OBJECTS_PER_IMAGE_BINS.tolist()
+    return statistics
 
 
 def get_split_list(dataset_name: str, root_dir: str = None) -> list[str]:
-    dataset = Dataset.load(dataset_name, root_dir=root_dir)
-    set_names = ["train", "val", "test", "unlabeled"]
-    try:
-        split_ids = dataset.get_split_ids()
-    except FileNotFoundError:
+    entry = dataset_catalog.get(dataset_name, root_dir)
+    if entry is None:
         return []
-    return [set_name for set_name in set_names if len(split_ids[SET_CODES[set_name]]) > 0]
+    split_sizes = entry["stats"]["split_sizes"]
+    if "train" not in split_sizes:
+        return []
+    set_names = ["train", "val", "test", "unlabeled"]
+    return [set_name for set_name in set_names if split_sizes.get(set_name, 0) > 0]
+
+
+def get_num_sample_images(dataset_name: str, set_name: str = "total", root_dir: str = None) -> int:
+    if set_name == "unlabeled":
+        return len(_load(dataset_name, root_dir=root_dir).get_split_ids()[SET_CODES[set_name]])
+    store = get_column_store(dataset_name, root_dir=root_dir)
+    return int(store.get_image_mask(set_name).sum())
 
 
 def get_sample_image_paths(
@@ -113,56 +168,164 @@ def get_sample_image_paths(
     draw: bool = False,
     set_name: str = "total",
     root_dir: str = None,
+    seed: int = None,
+    callback=None,
+    method: str = "random",
+    offset: int = 0,
 ) -> list[Path]:
-    dataset = Dataset.load(dataset_name, root_dir=root_dir)
-    if set_name == "total":
-        images = dataset.get_images()
-        image_ids = [image.image_id for image in images]
-    else:
+    """Get sample image paths, drawn with annotations if `draw`.
+
+    Samples are drawn lazily by dataset_sampler from the column store, so only images
+    offset ~ offset + sample_num of the sample are looked up. The same seed gives the same
+    sample, so pages and drawn images are reused across reruns.
+    `callback(num_done, num_total)` is called while drawing.
+    """
+    seed = 0 if seed is None else seed
+    if set_name == "unlabeled":
+        # the column store has labeled images only, the set file is shuffled as a whole
+        dataset = _load(dataset_name, root_dir=root_dir)
         image_ids = dataset.get_split_ids()[SET_CODES[set_name]]
-
-    sample_ids = random.sample(
-        image_ids,
-        sample_num if len(image_ids) > sample_num else len(image_ids),
-    )
+        sample_ids = (
+            np.random.default_rng(seed).permutation(image_ids)[offset : offset + sample_num].tolist()
+        )
+    else:
+        store = get_column_store(dataset_name, root_dir=root_dir)
+        sample_ids = dataset_sampler.sample(
+            store, method=method, set_name=set_name, seed=seed, offset=offset, count=sample_num
+        ).tolist()
 
     if draw:
-        if dataset.draw_dir.exists():
-            io.remove_directory(dataset.draw_dir, recursive=True)
-        dataset.draw_annotations(sample_ids)
-        return [path for path in dataset.draw_dir.rglob("*") if path.is_file()]
+        dataset = _load(dataset_name, root_dir=root_dir)
+        return draw_cache.draw(dataset, sample_ids, callback=callback)
+    elif set_name == "unlabeled":
+        image_dict = dataset.unlabeled_image_dict
+        return [dataset.raw_image_dir / image_dict[i].file_name for i in sample_ids]
     else:
-        image_dir = dataset.raw_image_dir
-        return [image_dir / image["file_name"] for image in dataset.get_images(sample_ids)]
+        image_dir = Dataset.parse_root_dir(root_dir) / dataset_name / Dataset.RAW_IMAGE_DIR
+        return [image_dir / file_name for file_name in store.get_file_names(sample_ids)]
+
+
+def get_ingest_status_file(dataset_name: str, root_dir: str = None) -> Path:
+    root_dir = Dataset.parse_root_dir(root_dir)
+    return get_cache_dir(root_dir, "running_status") / f"{dataset_name}_ingesting_status.json"
+
+
+def get_ingest_report_file(dataset_name: str, root_dir: str = None) -> Path:
+    root_dir = Dataset.parse_root_dir(root_dir)
+    return get_cache_dir(root_dir, "ingest") / f"{dataset_name}.json"
+
+
+def get_merge_report_file(dataset_name: str, root_dir: str = None) -> Path:
+    root_dir = Dataset.parse_root_dir(root_dir)
+    return get_cache_dir(root_dir, "merge") / f"{dataset_name}.json"
+
+
+def get_ingest_status(dataset_name: str, root_dir: str = None) -> dict:
+    status_file = get_ingest_status_file(dataset_name, root_dir=root_dir)
+    return io.load_json(status_file) if status_file.exists() else None
+
+
+def get_ingest_report(dataset_name: str, root_dir: str = None) -> dict:
+    report_file = get_ingest_report_file(dataset_name, root_dir=root_dir)
+    return io.load_json(report_file) if report_file.exists() else None
+
+
+def get_merge_report(dataset_name: str, root_dir: str = None) -> dict:
+    report_file = get_merge_report_file(dataset_name, root_dir=root_dir)
+    return io.load_json(report_file) if report_file.exists() else None
+
+
+def _ingest_images(dataset_name: str, image_dir, root_dir: str = None, status_logger=None) -> dict:
+    """Check the imported images in parallel, failing on corrupt ones.
+
+    Progress goes to status_logger if given, else to the dataset's ingesting status file.
+    """
+    own_status_logger = status_logger is None
+    if own_status_logger:
+        status_logger = image_ingest.IngestingStatusLogger(
+            get_ingest_status_file(dataset_name, root_dir=root_dir)
+        )
+        status_logger.set_running()
+
+    try:
+        report = image_ingest.ingest_images(
+            image_dir,
+            status_logger=status_logger,
+            num_workers=int(os.getenv("WAFFLE_APP_INGEST_WORKERS", 0)) or None,
+        )
+        image_ingest.save_report(report, get_ingest_report_file(dataset_name, root_dir=root_dir))
+        if report["corrupt"]:
+            raise ValueError(
+                f"{len(report['corrupt'])} corrupt images: "
+                + ", ".join(
+                    f"{name} ({report['images'][name]['error']})" for name in report["corrupt"][:5]
+                )
+                + (" ..." if len(report["corrupt"]) > 5 else "")
+            )
+    except Exception as e:
+        if own_status_logger:
+            status_logger.set_failed(e)
+        raise e
+
+    if own_status_logger:
+        status_logger.set_success()
+    return report
 
 
 # waffle dataset methods
-def from_coco(dataset_name: str, root_dir: str, task: str, image_zip_file, json_files):
-    temp_image_zip_file = NamedTemporaryFile(suffix=".zip")
-    temp_image_zip_file.write(image_zip_file.read())
+def stage_uploads(uploaded_files: list, root_dir: str = None) -> tuple[Path, list[Path]]:
+    """Copy uploaded files to a new staging dir, for jobs running in another process.
+
+    Returns:
+        tuple[Path, list[Path]]: staging dir and the copied files
+    """
+    root_dir = Dataset.parse_root_dir(root_dir)
+    staging_dir = get_cache_dir(root_dir, "uploads", uuid.uuid4().hex)
+    return staging_dir, [
+        coco_import.copy_upload(uploaded_file, staging_dir / f"{i}_{Path(uploaded_file.name).name}")
+        for i, uploaded_file in enumerate(uploaded_files)
+    ]
+
+
+def _as_file(file, dst: Path) -> Path:
+    """Local path of a file, copying an uploaded file object to dst."""
+    if isinstance(file, (str, Path)):
+        return Path(file)
+    return coco_import.copy_upload(file, dst)
 
-    temp_json_files = [NamedTemporaryFile(suffix=".json") for _ in range(len(json_files))]
-    for i, json_file in enumerate(json_files):
-        temp_json_files[i].write(json_file.read())
 
+def from_coco(
+    dataset_name: str, root_dir: str, task: str, image_zip_file, json_files, status_logger=None
+):
     with TemporaryDirectory() as temp_dir:
-        io.unzip(temp_image_zip_file.name, temp_dir, create_directory=True)
+        temp_image_zip_file = _as_file(image_zip_file, Path(temp_dir, "images.zip"))
+        temp_json_files = [
+            _as_file(json_file, Path(temp_dir, f"{i}.json"))
+            for i, json_file in enumerate(json_files)
+        ]
 
-        Dataset.from_coco(
+        dataset = coco_import.from_coco(
             name=dataset_name,
             task=task,
-            coco_root_dir=temp_dir,
-            coco_file=[temp_json_file.name for temp_json_file in temp_json_files],
+            coco_files=temp_json_files,
+            image_zip_file=temp_image_zip_file,
             root_dir=root_dir,
+            status_logger=status_logger,
         )
 
+    try:
+        _ingest_images(
+            dataset_name, dataset.raw_image_dir, root_dir=root_dir, status_logger=status_logger
+        )
+    except Exception as e:
+        dataset.delete()
+        raise e
 
-def from_yolo(dataset_name: str, root_dir: str, task: str, yolo_root_zip_file):
-    temp_root_zip_file = NamedTemporaryFile(suffix=".zip")
-    temp_root_zip_file.write(yolo_root_zip_file.read())
 
-    with TemporaryDirectory() as temp_dir:
-        io.unzip(temp_root_zip_file.name, temp_dir, create_directory=True)
+def from_yolo(dataset_name: str, root_dir: str, task: str, yolo_root_zip_file, status_logger=None):
+    with TemporaryDirectory() as temp_dir, TemporaryDirectory() as temp_zip_dir:
+        temp_root_zip_file = _as_file(yolo_root_zip_file, Path(temp_zip_dir, "root.zip"))
+        io.unzip(temp_root_zip_file, temp_dir, create_directory=True)
         yaml_file = search.get_files(temp_dir, extension=".yaml")
         if yaml_file:
             if len(yaml_file) > 1:
@@ -173,6 +336,7 @@ def from_yolo(dataset_name: str, root_dir: str, task: str, yolo_root_zip_file):
                 raise ValueError(f"{task} requires a yaml file.")
             temp_yaml_file = None
 
+        _ingest_images(dataset_name, temp_dir, root_dir=root_dir, status_logger=status_logger)
         Dataset.from_yolo(
             name=dataset_name,
             task=task,
@@ -183,31 +347,105 @@ def from_yolo(dataset_name: str, root_dir: str, task: str, yolo_root_zip_file):
 
 
 def load(dataset_name: str, root_dir: str = None) -> Dataset:
-    return Dataset.load(dataset_name, root_dir=root_dir)
+    return _load(dataset_name, root_dir=root_dir)
 
 
 def split(
-    dataset_name: str, train_ratio: float, val_ratio: float, test_ratio: float, root_dir: str = None
-):
-    dataset = Dataset.load(dataset_name, root_dir=root_dir)
-    dataset.split(train_ratio=train_ratio, val_ratio=val_ratio, test_ratio=test_ratio)
+    dataset_name: str,
+    train_ratio: float,
+    val_ratio: float,
+    test_ratio: float,
+    root_dir: str = None,
+    seed: int = 0,
+    stratify: bool = True,
+    group_by: str = None,
+    incremental: bool = False,
+) -> dict:
+    """Split a dataset with dataset_split.split on its statistics columns."""
+    dataset = _load(dataset_name, root_dir=root_dir)
+    columns = get_column_store(dataset_name, root_dir=root_dir).columns
+    try:
+        return dataset_split.split(
+            dataset,
+            columns,
+            train_ratio=train_ratio,
+            val_ratio=val_ratio,
+            test_ratio=test_ratio,
+            seed=seed,
+            stratify=stratify,
+            group_by=group_by,
+            incremental=incremental,
+        )
+    finally:
+        _invalidate(dataset_name, root_dir=root_dir)
 
 
 def export(dataset_name: str, data_type: str, root_dir: str = None) -> str:
-    dataset = Dataset.load(dataset_name, root_dir=root_dir)
+    dataset = _load(dataset_name, root_dir=root_dir)
     return dataset.export(data_type=data_type)
 
 
+def export_archive(
+    dataset_name: str, data_type: str, root_dir: str = None, status_logger=None
+) -> Path:
+    dataset = _load(dataset_name, root_dir=root_dir)
+    return dataset_export.export_archive(dataset, data_type, status_logger=status_logger)
+
+
+def get_export_archive(dataset_name: str, data_type: str, root_dir: str = None) -> Path:
+    """Zip file of the export of the current dataset version, None if not exported yet."""
+    dataset = _load(dataset_name, root_dir=root_dir)
+    archive_file = dataset_export.get_archive_file(dataset, data_type)
+    return archive_file if archive_file.exists() else None
+
+
 def delete(dataset_name: str, root_dir: str = None):
-    dataset = Dataset.load(dataset_name, root_dir=root_dir)
+    dataset = _load(dataset_name, root_dir=root_dir)
+    _invalidate(dataset_name, root_dir=root_dir)
     dataset.delete()
+    dataset_export.delete_archives(dataset_name, root_dir=root_dir)
+    column_store_manager.invalidate(dataset_name, root_dir=root_dir)
+    for report_file in [
+        get_ingest_report_file(dataset_name, root_dir=root_dir),
+        get_merge_report_file(dataset_name, root_dir=root_dir),
+    ]:
+        report_file.unlink(missing_ok=True)
+
+
+def merge(
+    new_dataset_name: str,
+    select_dataset_names: list[str],
+    task: str,
+    root_dir: str = None,
+    deduplicate: bool = True,
+    status_logger=None,
+):
+    """Merge datasets.
+
+    With deduplicate, identical images are merged by content and raw images are linked from
+    the sources (see dataset_merge.merge), else waffle_hub copies every image.
+    """
+    _invalidate(new_dataset_name, root_dir=root_dir)
+    if not deduplicate:
+        Dataset.merge(
+            name=new_dataset_name,
+            root_dir=str(root_dir),
+            src_names=select_dataset_names,
+            src_root_dirs=root_dir,
+            task=task,
+        )
+        return
 
-
-def merge(new_dataset_name: str, select_dataset_names: list[str], task: str, root_dir: str = None):
-    Dataset.merge(
+    _, report = dataset_merge.merge(
         name=new_dataset_name,
-        root_dir=str(root_dir),
+        root_dir=root_dir,
         src_names=select_dataset_names,
         src_root_dirs=root_dir,
         task=task,
+        status_logger=status_logger,
+        num_workers=int(os.getenv("WAFFLE_APP_INGEST_WORKERS", 0)) or None,
+    )
+    dataset_merge.save_report(
+        {**report, "sources": select_dataset_names},
+        get_merge_report_file(new_dataset_name, root_dir=root_dir),
     )
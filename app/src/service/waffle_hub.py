@@ -4,6 +4,8 @@ from tempfile import NamedTemporaryFile
 
 import torch
 from src.schema.run import RunType
+from src.utils.cache import LRUCache, memoize
+from waffle_hub import __version__ as waffle_hub_version
 from waffle_hub.hub import Hub
 from waffle_hub.schema.result import EvaluateResult, InferenceResult, TrainResult
 from waffle_hub.schema.running_status import (
@@ -15,6 +17,10 @@ from waffle_hub.schema.running_status import (
 )
 from waffle_utils.file import io
 
+from .hub_catalog import hub_catalog
+from .metrics_reader import metrics_readers
+from .status_watcher import status_watcher
+
 
 def get_parse_root_dir():
     return Hub.parse_root_dir(os.getenv("WAFFLE_HUB_ROOT_DIR", None))
@@ -24,22 +30,64 @@ def get_hub_list(root_dir) -> list[str]:
     return Hub.get_hub_list(root_dir=root_dir)
 
 
+def get_hub_infos(root_dir) -> list[dict]:
+    """Get {"name", "info", "caption"} of every hub from the hub catalog."""
+    return hub_catalog.scan(root_dir)
+
+
+# registry lookups change only when waffle_hub is upgraded, the ttl catches editable installs
+registry_cache = LRUCache(
+    max_weight=1024, ttl=float(os.getenv("WAFFLE_APP_REGISTRY_CACHE_TTL", 3600))
+)
+# per-hub configs, dropped when the config files of the hub change
+hub_cache = LRUCache(max_weight=256)
+
+
+def _get_registry_version(*args, **kwargs) -> str:
+    return waffle_hub_version
+
+
+def _get_hub_key(hub: Hub) -> str:
+    return str(hub.hub_dir) if hub is not None else None
+
+
+def _get_hub_version(hub: Hub) -> tuple:
+    if hub is None:
+        return None
+    version = []
+    for file in [hub.model_config_file, hub.train_config_file]:
+        try:
+            version.append(file.stat().st_mtime_ns)
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+
+def get_cache_stats() -> dict:
+    return {"registry": registry_cache.get_stats(), "hub": hub_cache.get_stats()}
+
+
+@memoize(registry_cache, version=_get_registry_version)
 def get_available_backends() -> list[str]:
     return list({str(back).upper() for back in Hub.get_available_backends()})
 
 
+@memoize(registry_cache, version=_get_registry_version)
 def get_available_tasks(backend: str) -> list[str]:
     return Hub.get_available_tasks(backend=backend)
 
 
+@memoize(registry_cache, version=_get_registry_version)
 def get_available_model_types(backend: str, task: str) -> list[str]:
     return Hub.get_available_model_types(backend=backend, task=task)
 
 
+@memoize(registry_cache, version=_get_registry_version)
 def get_available_model_sizes(backend: str, task: str, model_type: str) -> list[str]:
     return Hub.get_available_model_sizes(backend=backend, task=task, model_type=model_type)
 
 
+@memoize(hub_cache, key=_get_hub_key, version=_get_hub_version)
 def get_model_config_dict(hub: Hub) -> dict:
     if hub is not None:
         return hub.get_model_config().to_dict()
@@ -47,6 +95,7 @@ def get_model_config_dict(hub: Hub) -> dict:
         return None
 
 
+@memoize(hub_cache, key=_get_hub_key, version=_get_hub_version)
 def get_category_names(hub: Hub) -> list[str]:
     if hub is not None:
         return hub.get_category_names()
@@ -54,6 +103,11 @@ def get_category_names(hub: Hub) -> list[str]:
         return []
 
 
+@memoize(
+    registry_cache,
+    key=lambda hub: (hub.backend, hub.task, hub.model_type, hub.model_size) if hub else None,
+    version=_get_registry_version,
+)
 def get_default_train_params(hub: Hub) -> dict:
     if hub is not None:
         return Hub.get_default_train_params(
@@ -72,40 +126,48 @@ def get_default_advanced_train_params(hub: Hub) -> dict:
 
 def get_train_status(hub: Hub) -> TrainingStatus:
     if hub is not None:
-        return hub.get_training_status()
+        return status_watcher.get(hub.hub_dir, RunType.TRAIN)
     else:
         return None
 
 
 def get_evaluate_status(hub: Hub) -> EvaluatingStatus:
     if hub is not None:
-        return hub.get_evaluating_status()
+        return status_watcher.get(hub.hub_dir, RunType.EVALUATE)
     else:
         return None
 
 
 def get_inference_status(hub: Hub) -> InferencingStatus:
     if hub is not None:
-        return hub.get_inferencing_status()
+        return status_watcher.get(hub.hub_dir, RunType.INFERENCE)
     else:
         return None
 
 
 def get_export_onnx_status(hub: Hub) -> ExportingOnnxStatus:
     if hub is not None:
-        return hub.get_exporting_onnx_status()
+        return status_watcher.get(hub.hub_dir, RunType.EXPORT_ONNX)
     else:
         return None
 
 
 def get_export_waffle_status(hub: Hub) -> ExportingWaffleStatus:
     if hub is not None:
-        return hub.get_exporting_waffle_status()
+        return status_watcher.get(hub.hub_dir, RunType.EXPORT_WAFFLE)
     else:
         return None
 
 
-def get_status(run_type: str, hub: Hub) -> dict:
+def get_status(run_type: str, hub: Hub, refresh: bool = False) -> dict:
+    """Running status of a hub from the status watcher.
+
+    Args:
+        refresh (bool, optional): read the changed status files now instead of waiting for
+            the watcher, e.g. right after the run process ended. Defaults to False.
+    """
+    if refresh and hub is not None:
+        status_watcher.refresh(hub.hub_dir)
     if run_type == RunType.TRAIN:
         return get_train_status(hub)
     elif run_type == RunType.EVALUATE:
@@ -185,28 +247,34 @@ METRICS_MAP = {
 }
 
 
+def get_metrics_file(hub: Hub):
+    """File to read the metrics of a hub from.
+
+    metrics.json is written once training ends, but ultralytics appends a row to
+    results.csv every epoch, so that one gives the curves while training is running.
+    """
+    if hub.metric_file.exists():
+        return hub.metric_file
+    results_file = hub.artifact_dir / "results.csv"
+    if hub.backend.lower() == "ultralytics" and results_file.exists():
+        return results_file
+    return None
+
+
 def get_metrics(hub: Hub) -> tuple[dict]:
     if hub is not None:
         backend = hub.backend.lower()
         task = hub.task.upper()
-        metrics = hub.get_metrics()
-        train_loss = dict()
-        for tag_name in METRICS_MAP[backend][task]["train_loss"]:
-            train_loss[tag_name] = [
-                tags["value"] for metric in metrics for tags in metric if tags["tag"] == tag_name
-            ]
-        val_loss = dict()
-        for tag_name in METRICS_MAP[backend][task]["val_loss"]:
-            val_loss[tag_name] = [
-                tags["value"] for metric in metrics for tags in metric if tags["tag"] == tag_name
-            ]
-        metric = dict()
-        for tag_name in METRICS_MAP[backend][task]["metric"]:
-            metric[tag_name] = [
-                tags["value"] for metric in metrics for tags in metric if tags["tag"] == tag_name
-            ]
-
-        return train_loss, val_loss, metric
+        metrics_file = get_metrics_file(hub)
+        values = metrics_readers.read(metrics_file) if metrics_file else {}
+        return tuple(
+            {
+                tag_name: values[tag_name].tolist()
+                for tag_name in METRICS_MAP[backend][task][key]
+                if tag_name in values
+            }
+            for key in ["train_loss", "val_loss", "metric"]
+        )
     else:
         return ({}, {}, {})
 
@@ -218,6 +286,7 @@ def get_evaluate_result(hub: Hub) -> dict:
         return None
 
 
+@memoize(hub_cache, key=_get_hub_key, version=_get_hub_version)
 def get_train_config(hub: Hub) -> dict:
     if hub is not None:
         return hub.get_train_config().to_dict()
@@ -263,8 +332,34 @@ def load(hub_name: str, root_dir: str = None) -> Hub:
         return None
 
 
+def load_cached(hub_name: str, root_dir: str = None) -> Hub:
+    if hub_name is None:
+        return None
+    return hub_catalog.load(hub_name, root_dir=root_dir)
+
+
+def dump_run_args(args: dict) -> dict:
+    """Make run args json serializable. Hub is stored by its name and root dir."""
+    dumped = {}
+    for key, value in args.items():
+        if isinstance(value, Hub):
+            value = {"__hub__": {"name": value.name, "root_dir": str(value.root_dir)}}
+        dumped[key] = value
+    return dumped
+
+
+def load_run_args(args: dict) -> dict:
+    loaded = {}
+    for key, value in args.items():
+        if isinstance(value, dict) and "__hub__" in value:
+            value = load(value["__hub__"]["name"], root_dir=value["__hub__"]["root_dir"])
+        loaded[key] = value
+    return loaded
+
+
 def delete_hub(hub: Hub) -> None:
     if hub is not None:
+        hub_catalog.invalidate(hub.name, root_dir=hub.root_dir)
         return hub.delete_hub()
     else:
         return None
@@ -294,6 +389,7 @@ def delete_status(hub: Hub, run_type: str) -> None:
         elif run_type == RunType.EXPORT_WAFFLE:
             if hub.exporting_waffle_status_file.exists():
                 io.remove_file(hub.exporting_waffle_status_file)
+        status_watcher.refresh(hub.hub_dir)
 
 
 def delete_evaluate_result(hub: Hub) -> None:
@@ -339,19 +435,27 @@ def train(hub: Hub, args: dict) -> TrainResult:
 
 def is_trained(hub: Hub) -> bool:
     if hub is not None:
-        status = hub.get_training_status()
+        status = get_train_status(hub)
         if status is not None:
             return status["status_desc"] == "SUCCESS"
     return False
 
 
+def is_training(hub: Hub) -> bool:
+    if hub is not None:
+        status = get_train_status(hub)
+        if status is not None:
+            return status["status_desc"] == "RUNNING"
+    return False
+
+
 def evaluate(hub: Hub, args: dict) -> EvaluateResult:
     return hub.evaluate(**args)
 
 
 def is_evaluated(hub: Hub) -> bool:
     if hub is not None:
-        status = hub.get_evaluating_status()
+        status = get_evaluate_status(hub)
         if status is not None:
             return status["status_desc"] == "SUCCESS"
     return False
@@ -365,7 +469,7 @@ def inference(hub: Hub, args: dict) -> InferenceResult:
 
 def is_inferenced(hub: Hub) -> bool:
     if hub is not None:
-        status = hub.get_inferencing_status()
+        status = get_inference_status(hub)
         if status is not None:
             return status["status_desc"] == "SUCCESS"
     return False
@@ -377,7 +481,7 @@ def export_onnx(hub: Hub, args: dict):
 
 def is_exported_onnx(hub: Hub) -> bool:
     if hub is not None:
-        status = hub.get_exporting_onnx_status()
+        status = get_export_onnx_status(hub)
         if status is not None:
             return status["status_desc"] == "SUCCESS"
     return False
@@ -389,7 +493,7 @@ def export_waffle(hub: Hub):
 
 def is_exported_waffle(hub: Hub) -> bool:
     if hub is not None:
-        status = hub.get_exporting_waffle_status()
+        status = get_export_waffle_status(hub)
         if status is not None:
             return status["status_desc"] == "SUCCESS"
     return False
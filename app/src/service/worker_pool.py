@@ -0,0 +1,153 @@
+import atexit
+import logging
+import threading
+from multiprocessing import Pipe, Process
+
+from src.utils.process import install_status_hook, send_error
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(conn, max_jobs: int):
+    # import heavy modules once, so the jobs don't pay for them
+    import torch  # noqa: F401
+    from waffle_hub.hub import Hub  # noqa: F401
+
+    install_status_hook(conn)
+    for _ in range(max_jobs):
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        try:
+            job["func"](**job["kwargs"])
+        except Exception as e:
+            send_error(conn, e)
+        conn.send({"type": "done"})
+
+
+class _Worker:
+    def __init__(self, max_jobs: int, name: str):
+        self.conn, child_conn = Pipe()
+        # not a daemon, daemonic processes can not start children (e.g. dataloader workers)
+        self.process = Process(target=_worker_main, args=(child_conn, max_jobs), name=name)
+        self.process.start()
+        child_conn.close()
+        self.max_jobs = max_jobs
+        self.num_jobs = 0
+
+    @property
+    def exhausted(self) -> bool:
+        return self.num_jobs >= self.max_jobs
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process.close()
+
+
+class PoolHandle:
+    """A job running on a warm worker, with the Process interface RunService uses."""
+
+    def __init__(self, pool: "WarmWorkerPool", worker: _Worker):
+        self._pool = pool
+        self._worker = worker
+        self.pid = worker.process.pid
+        self.sentinel = worker.process.sentinel
+        self.conn = worker.conn
+        self.done = False
+
+    def is_alive(self) -> bool:
+        return not self.done and self._worker.process.is_alive()
+
+    def terminate(self):
+        self._worker.process.terminate()
+
+    def kill(self):
+        self._worker.process.kill()
+
+    def join(self, timeout: float = None):
+        if not self.done:
+            self._worker.process.join(timeout)
+
+    def close(self):
+        self._pool._release(self._worker, reusable=self.done)
+
+
+class WarmWorkerPool:
+    """Pre-forked processes with torch and waffle_hub already imported.
+
+    A worker exits after `max_jobs_per_worker` jobs to cap memory growth and a new one
+    is forked in its place.
+    """
+
+    def __init__(self, size: int, max_jobs_per_worker: int = 10):
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+
+        self._lock = threading.Lock()
+        self._num_created = 0
+        self._closed = False
+        self.idle_workers = []
+        self.busy_workers = []
+        for _ in range(size):
+            self.idle_workers.append(self._new_worker())
+        # the workers are not daemons, so they are stopped before multiprocessing joins them
+        atexit.register(self.close)
+
+    def _new_worker(self) -> _Worker:
+        self._num_created += 1
+        return _Worker(self.max_jobs_per_worker, name=f"warm_worker_{self._num_created}")
+
+    def _replace(self, worker: _Worker):
+        """Stop a dead or retired worker and fork a new one in its place."""
+        worker.stop()
+        if not self._closed and len(self.idle_workers) + len(self.busy_workers) < self.size:
+            self.idle_workers.append(self._new_worker())
+
+    def submit(self, func, kwargs: dict) -> PoolHandle:
+        """Run `func(**kwargs)` on an idle worker.
+
+        Returns:
+            PoolHandle: handle of the job, or None if every worker is busy
+        """
+        with self._lock:
+            for worker in [worker for worker in self.idle_workers if not worker.process.is_alive()]:
+                logger.warning(f"Warm worker {worker.process.name} died, forking a new one")
+                self.idle_workers.remove(worker)
+                self._replace(worker)
+            if not self.idle_workers:
+                return None
+
+            worker = self.idle_workers.pop(0)
+
+            worker.conn.send({"func": func, "kwargs": kwargs})
+            worker.num_jobs += 1
+            self.busy_workers.append(worker)
+            return PoolHandle(self, worker)
+
+    def _release(self, worker: _Worker, reusable: bool):
+        with self._lock:
+            if worker in self.busy_workers:
+                self.busy_workers.remove(worker)
+            if reusable and not worker.exhausted and worker.process.is_alive():
+                self.idle_workers.append(worker)
+                return
+            self._replace(worker)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for worker in self.idle_workers + self.busy_workers:
+                worker.stop()
+            self.idle_workers = []
+            self.busy_workers = []
@@ -0,0 +1,134 @@
+import copy
+import functools
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# app caches are kept under the root dirs, in a directory waffle_hub does not list
+CACHE_DIR_NAME = ".waffle_app"
+
+
+def get_cache_dir(root_dir, *names: str) -> Path:
+    cache_dir = Path(root_dir, CACHE_DIR_NAME, *names)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total weight of its values.
+
+    A value is stored with a version (e.g. file mtimes) and a lookup with another version
+    is a miss, so stale values are dropped on access. With a ttl, values older than it are
+    dropped the same way.
+
+    Args:
+        max_weight (int): eviction starts when the total weight exceeds this.
+        weigher (Callable, optional): value -> weight. Defaults to 1 per value.
+        ttl (float, optional): seconds a value is kept. Defaults to None (no expiry).
+    """
+
+    def __init__(self, max_weight: int, weigher=None, ttl: float = None):
+        self.max_weight = max_weight
+        self.weigher = weigher or (lambda value: 1)
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key: (value, version, weight, expire_time)
+        self._weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, version=None):
+        with self._lock:
+            item = self._items.get(key, None)
+            expired = item is not None and item[3] is not None and item[3] < time.monotonic()
+            if item is None or item[1] != version or expired:
+                if item is not None:
+                    self._remove(key)
+                self.expirations += expired
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, version=None):
+        weight = self.weigher(value)
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            expire_time = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._items[key] = (value, version, weight, expire_time)
+            self._weight += weight
+            # keep at least the newest value even if it alone is over the limit
+            while self._weight > self.max_weight and len(self._items) > 1:
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+
+    def get_or_load(self, key, loader, version=None):
+        value = self.get(key, version=version)
+        if value is None:
+            value = loader()
+            self.put(key, value, version=version)
+        return value
+
+    def _remove(self, key):
+        _, _, weight, _ = self._items.pop(key)
+        self._weight -= weight
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._items.clear()
+                self._weight = 0
+            elif key in self._items:
+                self._remove(key)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._items),
+                "weight": self._weight,
+                "max_weight": self.max_weight,
+            }
+
+
+def memoize(cache: LRUCache, key=None, version=None):
+    """Cache the results of a function in an LRUCache.
+
+    Results are copied on the way in and out, so callers may change them freely. None is
+    never cached.
+
+    Args:
+        cache (LRUCache): cache to keep the results in, shared by several functions.
+        key (Callable, optional): (*args, **kwargs) -> key. Defaults to the arguments.
+        version (Callable, optional): (*args, **kwargs) -> version of the result, e.g.
+            a package version or file mtimes. Defaults to None.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = (
+                func.__qualname__,
+                key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items()))),
+            )
+            cache_version = version(*args, **kwargs) if version else None
+            value = cache.get(cache_key, version=cache_version)
+            if value is None:
+                value = func(*args, **kwargs)
+                if value is None:
+                    return None
+                cache.put(cache_key, copy.deepcopy(value), version=cache_version)
+            return copy.deepcopy(value)
+
+        return wrapper
+
+    return decorator
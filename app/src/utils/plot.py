@@ -5,7 +5,7 @@ matplotlib.rc(
     **{
         "family": "serif",
         "size": 16,
-    }
+    },
 )
 
 import numpy as np
@@ -63,3 +63,60 @@ def plot_graphs(
     if legend:
         plt.legend()
     return fig
+
+
+def plot_histogram(
+    bins: list,
+    counts: list,
+    title: str = "",
+    xlabel: str = "",
+    ylabel: str = "",
+    figsize: tuple = (10, 5),
+):
+    """Plot precomputed histogram counts, one bar per bin labeled with its edges."""
+    fig = plt.figure(figsize=figsize)
+    x = list(range(len(counts)))
+    plt.bar(x, counts, color=colors[0])
+    plt.xticks(
+        x,
+        [f"{bins[i]:g}~{bins[i + 1]:g}" for i in range(len(counts))],
+        rotation=45,
+        fontsize=10,
+    )
+    plt.title(title)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.tight_layout()
+    return fig
+
+
+def plot_heatmap(
+    matrix: list[list],
+    names: list = None,
+    title: str = "",
+    figsize: tuple = (10, 10),
+    annotate: bool = True,
+):
+    fig = plt.figure(figsize=figsize)
+    matrix = np.asarray(matrix)
+    plt.imshow(matrix, cmap="Blues")
+    plt.colorbar()
+    if names:
+        plt.xticks(range(len(names)), names, rotation=90, fontsize=10)
+        plt.yticks(range(len(names)), names, fontsize=10)
+    if annotate and matrix.size <= 400:
+        threshold = matrix.max() / 2 if matrix.size else 0
+        for i in range(matrix.shape[0]):
+            for j in range(matrix.shape[1]):
+                plt.text(
+                    j,
+                    i,
+                    matrix[i, j],
+                    ha="center",
+                    va="center",
+                    fontsize=8,
+                    color="white" if matrix[i, j] > threshold else "black",
+                )
+    plt.title(title)
+    plt.tight_layout()
+    return fig
@@ -0,0 +1,106 @@
+import importlib
+
+import psutil
+
+
+def get_func_path(func) -> str:
+    return f"{func.__module__}:{func.__qualname__}"
+
+
+def load_func(func_path: str):
+    module_name, qualname = func_path.split(":")
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class AttachedProcess:
+    """A process started by a previous app instance.
+
+    It is not our child anymore, so it is controlled through psutil with the same
+    interface as multiprocessing.Process.
+    """
+
+    def __init__(self, pid: int, start_time: float = None):
+        self.pid = pid
+        self._process = psutil.Process(pid)
+        if start_time is not None and self._process.create_time() > start_time + 2:
+            # pid is reused by a process created after the run had started
+            raise psutil.NoSuchProcess(pid)
+
+    def is_alive(self) -> bool:
+        try:
+            return self._process.is_running() and (self._process.status() != psutil.STATUS_ZOMBIE)
+        except psutil.NoSuchProcess:
+            return False
+
+    def terminate(self):
+        try:
+            self._process.terminate()
+        except psutil.NoSuchProcess:
+            pass
+
+    def kill(self):
+        try:
+            self._process.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+    def join(self, timeout: float = None):
+        try:
+            self._process.wait(timeout)
+        except (psutil.NoSuchProcess, psutil.TimeoutExpired):
+            pass
+
+    def close(self):
+        pass
+
+
+def _status_to_dict(status) -> dict:
+    return {
+        "status_desc": str(status.status_desc) if status.status_desc is not None else None,
+        "step": status.step,
+        "total_step": status.total_step,
+        "error_type": status.error_type,
+        "error_msg": str(status.error_msg) if status.error_msg is not None else None,
+    }
+
+
+def install_status_hook(conn):
+    """Send every waffle_hub running status save of this process through `conn` too."""
+    from waffle_hub.utils.running_status_logger import RunningStatusLogger
+
+    save = RunningStatusLogger.save
+
+    def save_and_send(self):
+        save(self)
+        try:
+            conn.send({"type": "status", "status": _status_to_dict(self.running_status)})
+        except (BrokenPipeError, OSError):
+            pass
+
+    RunningStatusLogger.save = save_and_send
+
+
+def send_error(conn, e: BaseException):
+    try:
+        conn.send({"type": "error", "error_type": e.__class__.__name__, "error_msg": str(e)})
+    except (BrokenPipeError, OSError):
+        pass
+
+
+def run_target(func, kwargs: dict, conn):
+    """Process target that pushes running status changes to the parent through `conn`.
+
+    waffle_hub saves every running status change with RunningStatusLogger.save, so it is
+    hooked in the child process to send the same status through the pipe.
+    """
+    install_status_hook(conn)
+    try:
+        func(**kwargs)
+    except BaseException as e:
+        send_error(conn, e)
+        raise
+    finally:
+        conn.close()
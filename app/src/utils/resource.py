@@ -2,60 +2,36 @@ import torch
 from nvitop import Device
 
 
-def cpu_check() -> str:
-    """Check CPU Memory using psutil
+def get_available_devices() -> list[str]:
+    """Check available devices
 
     Returns:
-        str: cpu percent
+        list[str]: available devices
     """
-    import psutil
+    base = ["cpu"]
+    # check available gpu
+    if torch.cuda.is_available():
+        devices = Device.all()
+        base.extend([f"{device.index}" for device in devices])
 
-    return f"{psutil.cpu_percent():.2f}%"
+    return base
 
 
-def memory_check() -> str:
-    """Check Memory using psutil
+def get_device_memory_info() -> dict[str, dict]:
+    """Check total and free memory of each device
 
     Returns:
-        str: memory used, memory total
+        dict[str, dict]: {device: {"total": MB, "free": MB}}, "cpu" is system memory
     """
     import psutil
 
     mem = psutil.virtual_memory()
-    return f"{mem.used / 1024 ** 3:.2f}G / {mem.total / 1024 ** 3:.2f}G"
-
-
-def gpu_check() -> str:
-    """Check GPU Memory using nivdia-smi
-
-    Returns:
-        str: gpu_id, memory used, memory total
-    """
-    width = 8
-    s = [["GPU id", "Mem %", "Util %"]]
-    devices = Device.all()
-    for device in devices:
-        s.append(
-            [f"{device.index}", f"{device.memory_percent():.2f}", f"{device.gpu_percent():.2f}"]
-        )
-
-    result = ""
-    for s_ in s:
-        result += "".join(list(map(lambda x: x.ljust(width), s_))) + "\n"
-
-    return result
-
-
-def get_available_devices() -> list[str]:
-    """Check available devices
-
-    Returns:
-        list[str]: available devices
-    """
-    base = ["cpu"]
-    # check available gpu
+    info = {"cpu": {"total": mem.total // 1024**2, "free": mem.available // 1024**2}}
     if torch.cuda.is_available():
-        devices = Device.all()
-        base.extend([f"{device.index}" for device in devices])
+        for device in Device.all():
+            info[f"{device.index}"] = {
+                "total": device.memory_total() // 1024**2,
+                "free": device.memory_free() // 1024**2,
+            }
 
-    return base
+    return info